@@ -1,5 +1,5 @@
 from dataclasses import dataclass
-from typing import Optional, TypedDict, NotRequired, Literal
+from typing import Any, Optional, TypedDict, NotRequired, Literal
 from pacha.data_engine.artifacts import ArtifactJson, Artifacts, Artifact
 from pacha.data_engine.user_confirmations import UserConfirmationResult
 from pacha.data_engine.data_engine import SqlOutput, SqlStatement, SqlStatementJson
@@ -259,11 +259,12 @@ def to_turn_json(turn: PachaTurn, artifacts: Artifacts) -> PachaTurnJson:
         return to_user_confirmation_request_json(turn)
 
 
-def from_artifact_json(artifact_json: str) -> Artifact:
-    artifact_dict = json.loads(artifact_json)
+def from_artifact_json(artifact_dict: dict[str, Any]) -> Artifact:
     return Artifact(
         identifier=artifact_dict['identifier'],
         title=artifact_dict['title'],
         artifact_type=artifact_dict['artifact_type'],
-        data=artifact_dict['data']
+        data=artifact_dict['data'],
+        # Artifacts persisted before versioning don't have a version
+        version=artifact_dict.get('version', 1)
     )
@@ -1,10 +1,11 @@
-from typing import Sequence
+from typing import Iterable, Optional, Sequence
 import aiosqlite
 import json
 
 
 from pacha.sdk.chat import Turn
-from pacha.data_engine.artifacts import Artifacts, Artifact
+from pacha.data_engine.artifacts import Artifacts, Artifact, ArtifactMetadataJson, apply_artifact_diff
+from pacha.utils.logging import get_logger
 from pacha.data_engine.user_confirmations import UserConfirmationResult
 from examples.chat_server.chat_json import to_turn_json, from_turn_json, from_artifact_json, PachaTurn
 
@@ -28,6 +29,9 @@ async def init_db(database_path):
         thread_id TEXT NOT NULL,
         artifact_id TEXT NOT NULL,
         artifact_json TEXT,
+        -- Metadata of the artifact version after this row, only set on the
+        -- latest row of each artifact
+        artifact_metadata TEXT,
         created_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now'))
     );
     CREATE TABLE IF NOT EXISTS user_confirmations (
@@ -53,10 +57,18 @@ async def init_db(database_path):
     CREATE INDEX IF NOT EXISTS idx_user_confirmations_thread_id ON user_confirmations(thread_id);
 
    ''')
+    await migrate_db(conn)
     await conn.commit()
     await conn.close()
 
 
+async def migrate_db(conn: aiosqlite.Connection):
+    cursor = await conn.execute("PRAGMA table_info(artifacts)")
+    artifact_columns = [row[1] for row in await cursor.fetchall()]
+    if 'artifact_metadata' not in artifact_columns:
+        await conn.execute("ALTER TABLE artifacts ADD COLUMN artifact_metadata TEXT")
+
+
 async def fetch_threads(db: aiosqlite.Connection):
     cursor = await db.execute("SELECT thread_id, title FROM threads order by created_at desc")
     rows = await cursor.fetchall()
@@ -89,12 +101,39 @@ async def persist_turn_many(db: aiosqlite.Connection, thread_id: str, turns: Seq
                              VALUES  ('{thread_id}', :message);''', params)
 
 
-async def persist_artifacts(db: aiosqlite.Connection, thread_id: str, artifacts: dict[str, Artifact]):
-    artifact_params = [{'artifact_id': artifact.identifier, 'artifact_json': json.dumps(artifact.to_json())}
-                       for artifact in artifacts.values()]
+async def persist_artifacts(db: aiosqlite.Connection, thread_id: str, artifacts: Artifacts, identifiers: Iterable[str], persisted_versions: dict[str, int]):
+    """
+    Persist the versions of the artifacts with these `identifiers` that are newer
+    than `persisted_versions`, which is updated.
+    Where possible only the diffs since the persisted version are written. Writing
+    a full snapshot deletes the older rows of the artifact (compaction). The latest
+    row of each artifact also gets its metadata, so that threads can be loaded
+    without parsing the artifact data.
+    """
+    identifiers = list(identifiers)
+    await artifacts.load(identifiers)
+    artifact_params = []
+    for identifier in identifiers:
+        artifact = artifacts.artifacts[identifier]
+        persisted_version = persisted_versions.get(artifact.identifier, 0)
+        if artifact.version <= persisted_version:
+            continue
+        snapshot_version = artifact.version - len(artifact.diffs)
+        if persisted_version >= snapshot_version:
+            for diff in artifact.diffs[persisted_version - snapshot_version:]:
+                artifact_params.append({'artifact_id': artifact.identifier, 'artifact_json': json.dumps(
+                    {'identifier': artifact.identifier, 'version': diff['base_version'] + 1, 'diff': diff}), 'artifact_metadata': None})
+        else:
+            await db.execute("DELETE FROM artifacts WHERE thread_id = ? AND artifact_id = ?", (thread_id, artifact.identifier))
+            artifact_params.append({'artifact_id': artifact.identifier, 'artifact_json': json.dumps(
+                artifact.to_json() | {'version': artifact.version}), 'artifact_metadata': None})
+        # Computed when the artifact was stored
+        artifact_params[-1]['artifact_metadata'] = json.dumps(
+            artifacts.get_metadata(identifier))
+        persisted_versions[artifact.identifier] = artifact.version
     if len(artifact_params) > 0:
-        await db.executemany(f'''INSERT INTO artifacts (thread_id, artifact_id, artifact_json)
-                             VALUES ('{thread_id}', :artifact_id, :artifact_json);''', artifact_params)
+        await db.executemany(f'''INSERT INTO artifacts (thread_id, artifact_id, artifact_json, artifact_metadata)
+                             VALUES ('{thread_id}', :artifact_id, :artifact_json, :artifact_metadata);''', artifact_params)
 
 
 async def fetch_turns(db: aiosqlite.Connection, thread_id: str) -> list[PachaTurn]:
@@ -108,14 +147,47 @@ async def fetch_turns(db: aiosqlite.Connection, thread_id: str) -> list[PachaTur
     return turns
 
 
-async def fetch_artifacts(db: aiosqlite.Connection, thread_id: str) -> dict[str, Artifact]:
-    cursor = await db.execute(
-        "SELECT artifact_json FROM artifacts WHERE thread_id = ? order by id", (thread_id,))
+async def fetch_artifacts(db: aiosqlite.Connection, thread_id: str, identifiers: Optional[list[str]] = None) -> dict[str, Artifact]:
+    """Latest version of the artifacts of a thread, or of just the given `identifiers`"""
+    if identifiers is None:
+        cursor = await db.execute(
+            "SELECT artifact_json FROM artifacts WHERE thread_id = ? order by id", (thread_id,))
+    else:
+        placeholders = ', '.join('?' for _ in identifiers)
+        cursor = await db.execute(
+            f"SELECT artifact_json FROM artifacts WHERE thread_id = ? AND artifact_id IN ({placeholders}) order by id", (thread_id, *identifiers))
     artifact_rows = await cursor.fetchall()
+    return apply_artifact_rows(row[0] for row in artifact_rows)
+
+
+async def fetch_artifact_metadata(db: aiosqlite.Connection, thread_id: str) -> dict[str, Optional[ArtifactMetadataJson]]:
+    """
+    Metadata of the latest version of each artifact, in the order the artifacts
+    were first persisted. Artifacts persisted without metadata map to None.
+    """
+    cursor = await db.execute('''SELECT a.artifact_id, a.artifact_metadata FROM artifacts a
+                                 JOIN (SELECT MIN(id) AS first_id, MAX(id) AS last_id FROM artifacts
+                                       WHERE thread_id = ? GROUP BY artifact_id) r
+                                 ON a.id = r.last_id
+                                 ORDER BY r.first_id''', (thread_id,))
+    metadata_rows = await cursor.fetchall()
+    return {row[0]: None if row[1] is None else json.loads(row[1]) for row in metadata_rows}
+
+
+def apply_artifact_rows(artifact_json_rows: Iterable[str]) -> dict[str, Artifact]:
     artifacts: dict[str, Artifact] = {}
-    for artifact_row in artifact_rows:
-        artifact = from_artifact_json(artifact_row[0])
-        artifacts[artifact.identifier] = artifact
+    for artifact_json_row in artifact_json_rows:
+        artifact_json = json.loads(artifact_json_row)
+        identifier = artifact_json['identifier']
+        if 'diff' in artifact_json:
+            base = artifacts.get(identifier)
+            if base is None or base.version != artifact_json['diff']['base_version']:
+                get_logger().warning(
+                    f"Skipping diff of artifact {identifier} without its base version")
+                continue
+            artifacts[identifier] = apply_artifact_diff(base, artifact_json['diff'])
+        else:
+            artifacts[identifier] = from_artifact_json(artifact_json)
     return artifacts
 
 
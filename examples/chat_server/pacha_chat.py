@@ -3,7 +3,7 @@ from typing import Optional, AsyncGenerator, Dict, List
 from pacha.data_engine.artifacts import Artifacts
 from pacha.data_engine.context import ExecutionContext
 from pacha.data_engine.user_confirmations import UserConfirmationProvider, UserConfirmationResult
-from pacha.sdk.chat import Turn, UserTurn, AssistantTurn, ToolResponseTurn, Chat, ToolCallResponse
+from pacha.sdk.chat import Turn, UserTurn, AssistantTurn, ToolResponseTurn, Chat, ToolCallResponse, get_recent_user_text
 from pacha.sdk.llm import Llm
 from pacha.sdk.tool import ErrorToolOutput, Tool
 from pacha.utils.logging import get_logger
@@ -35,6 +35,9 @@ type PachaTurn = Turn | UserConfirmationRequest
 
 CONFIRMATION_PROVIDERS: Dict[str, UserConfirmationProvider] = {}
 
+# Number of latest user turns used to pick the relevant schema for the prompt
+SCHEMA_QUERY_USER_TURNS = 3
+
 
 @dataclass
 class PachaChat:
@@ -58,7 +61,7 @@ class PachaChat:
         def system_prompt_builder(turns: List[Turn]) -> str:
             return f"""
                 {self.system_prompt}
-                {self.pacha_tool.system_prompt_fragment(self.artifacts)}."""
+                {self.pacha_tool.system_prompt_fragment(self.artifacts, get_recent_user_text(turns, SCHEMA_QUERY_USER_TURNS))}."""
 
         self.chat = Chat(system_prompt=system_prompt_builder)
 
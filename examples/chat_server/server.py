@@ -5,6 +5,7 @@ from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import Optional, Dict, List, Callable
 from enum import Enum
+from contextlib import asynccontextmanager
 import uuid
 import argparse
 import os
@@ -15,6 +16,10 @@ import httpx
 
 from pacha.sdk.llm import Llm
 from pacha.sdk.tool import Tool
+from pacha.sdk.tools import PachaPythonTool
+from pacha.data_engine.artifacts import Artifacts
+from pacha.data_engine.artifact_spill import SpillingArtifactMap
+from pacha.data_engine.runtime_pool import close_runtime_connection_pools
 from pacha.data_engine.user_confirmations import UserConfirmationResult
 from pacha.utils.logging import setup_logger, get_logger
 from examples.utils.cli import add_llm_args, add_tool_args, get_llm, get_pacha_tool
@@ -32,9 +37,20 @@ SYSTEM_PROMPT: str = "You are a helpful assistant"
 DATABASE_PATH: str = "pacha.db"
 CORS_ORIGINS: List[str] = ["*"]
 ASSISTANT_NAME: str = 'unknown'
+# If set, artifacts beyond this many bytes per thread are spilled to disk
+ARTIFACT_MEMORY_BUDGET_BYTES: Optional[int] = None
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Warm connections to the Python runtime are opened on the server's loop
+    await close_runtime_connection_pools()
+    if isinstance(PACHA_TOOL, PachaPythonTool) and PACHA_TOOL.executor_options.llm_cache is not None:
+        await PACHA_TOOL.executor_options.llm_cache.close()
+
+
+app = FastAPI(lifespan=lifespan)
 # Mount the static files
 app.mount("/assets", StaticFiles(directory="frontend/dist/assets"), name="static")
 
@@ -54,6 +70,12 @@ app.add_middleware(
 )
 
 
+def new_artifacts() -> Artifacts:
+    if ARTIFACT_MEMORY_BUDGET_BYTES is None:
+        return Artifacts()
+    return Artifacts(artifacts=SpillingArtifactMap(memory_budget_bytes=ARTIFACT_MEMORY_BUDGET_BYTES))
+
+
 async def get_db():
     conn = await aiosqlite.connect(database=DATABASE_PATH, autocommit=True)
     try:
@@ -144,9 +166,9 @@ async def get_threads(db: aiosqlite.Connection = Depends(get_db)):
 async def get_thread(thread_id: str, db: aiosqlite.Connection = Depends(get_db)):
     try:
         default_chat = PachaChat(id=thread_id,
-                                 llm=LLM, pacha_tool=PACHA_TOOL, system_prompt=SYSTEM_PROMPT)
+                                 llm=LLM, pacha_tool=PACHA_TOOL, system_prompt=SYSTEM_PROMPT, artifacts=new_artifacts())
         thread = await Thread.from_db(thread_id, default_chat, db)
-        return thread.to_json()
+        return await thread.to_json()
     except ThreadNotFound as e:
         raise HTTPException(status_code=404, detail="Thread not found")
     except Exception as e:
@@ -164,7 +186,7 @@ async def start_thread(message_input: MessageInput):
         title = message_input.message[slice(40)]
         await persist_thread(db, thread_id, title)
         thread = Thread(id=thread_id, title=title,
-                        chat=PachaChat(id=thread_id, llm=LLM, pacha_tool=PACHA_TOOL, system_prompt=SYSTEM_PROMPT), db=db)
+                        chat=PachaChat(id=thread_id, llm=LLM, pacha_tool=PACHA_TOOL, system_prompt=SYSTEM_PROMPT, artifacts=new_artifacts()), db=db)
         background_tasks = BackgroundTasks()
         background_tasks.add_task(closedb, db)
         if message_input.stream:
@@ -198,7 +220,7 @@ async def send_message(thread_id: str, message_input: MessageInput):
     try:
         db = await get_db_open()
         default_chat = PachaChat(id=thread_id,
-                                 llm=LLM, pacha_tool=PACHA_TOOL, system_prompt=SYSTEM_PROMPT)
+                                 llm=LLM, pacha_tool=PACHA_TOOL, system_prompt=SYSTEM_PROMPT, artifacts=new_artifacts())
         thread = await Thread.from_db(thread_id, default_chat, db)
         background_tasks = BackgroundTasks()
         background_tasks.add_task(closedb, db)
@@ -235,7 +257,7 @@ async def send_message(thread_id: str, message_input: MessageInput):
 async def send_user_confirmation(thread_id: str, confirmation_input: ConfirmationInput,  db: aiosqlite.Connection = Depends(get_db)):
     try:
         default_chat = PachaChat(id=thread_id,
-                                 llm=LLM, pacha_tool=PACHA_TOOL, system_prompt=SYSTEM_PROMPT)
+                                 llm=LLM, pacha_tool=PACHA_TOOL, system_prompt=SYSTEM_PROMPT, artifacts=new_artifacts())
         thread = await Thread.from_db(thread_id, default_chat, db)
         confirmation_result = UserConfirmationResult.APPROVED if confirmation_input.confirm else UserConfirmationResult.DENIED
         await update_user_confirmation(db, thread_id, confirmation_input.confirmation_id, confirmation_result)
@@ -337,6 +359,7 @@ async def async_setup():
     global DATABASE_PATH
     global CORS_ORIGINS
     global ASSISTANT_NAME
+    global ARTIFACT_MEMORY_BUDGET_BYTES
 
     parser = argparse.ArgumentParser(description='Pacha Chat Server')
     add_llm_args(parser)
@@ -356,6 +379,10 @@ async def async_setup():
 
     ASSISTANT_NAME = os.environ.get("ASSISTANT_NAME", "unknown")
 
+    artifact_memory_budget_mb = os.environ.get("ARTIFACT_MEMORY_BUDGET_MB")
+    if artifact_memory_budget_mb is not None:
+        ARTIFACT_MEMORY_BUDGET_BYTES = int(float(artifact_memory_budget_mb) * 1024 * 1024)
+
 
 def main():
     asyncio.run(async_setup())
@@ -1,6 +1,6 @@
 from dataclasses import dataclass, field
-from typing import NotRequired, TypedDict, AsyncGenerator, Any, Optional, Dict
-from pacha.data_engine.artifacts import ArtifactJson, Artifacts
+from typing import NotRequired, Sequence, TypedDict, AsyncGenerator, Any, Optional, Dict
+from pacha.data_engine.artifacts import ArtifactJson, LazyArtifactMap
 from pacha.sdk.chat import Turn, UserTurn, AssistantTurn, ToolResponseTurn, ToolCallResponse
 from pacha.data_engine.user_confirmations import UserConfirmationResult
 from pacha.sdk.tools import PythonToolOutput
@@ -22,6 +22,7 @@ from examples.chat_server.db import (
     fetch_thread,
     fetch_turns,
     fetch_artifacts,
+    fetch_artifact_metadata,
     fetch_user_confirmations,
     update_user_confirmation
 )
@@ -30,6 +31,7 @@ from examples.chat_server.db import (
 import json
 import aiosqlite
 import asyncio
+import functools
 
 
 START_EVENT = 'start'
@@ -61,6 +63,8 @@ class Thread:
     db: aiosqlite.Connection
     user_confirmations: Dict[str, UserConfirmationResult] = field(
         default_factory=dict)
+    # Latest persisted version of each artifact, so only newer versions are persisted
+    persisted_artifact_versions: Dict[str, int] = field(default_factory=dict)
 
     async def send(self, message: str) -> list[Turn]:
         user_message = UserTurn(message)
@@ -69,8 +73,11 @@ class Thread:
 
         assistant_messages = await self.chat.process_chat(message)
         thread_messages.extend(assistant_messages)
+        # Turns are persisted with the artifacts they modified
+        await self.chat.artifacts.load(get_modified_artifact_identifiers(assistant_messages))
         await persist_turn_many(self.db, self.id, assistant_messages, self.chat.artifacts)
-        await persist_artifacts(self.db, self.id, self.chat.artifacts.artifacts)
+        await persist_artifacts(self.db, self.id, self.chat.artifacts,
+                                get_modified_artifact_identifiers(assistant_messages), self.persisted_artifact_versions)
 
         return thread_messages
 
@@ -95,14 +102,14 @@ class Thread:
 
                 elif isinstance(chunk, ToolCallResponse):
                     if isinstance(chunk.output, PythonToolOutput):
-                        modified_artifacts = {identifier: self.chat.artifacts.artifacts[identifier]
-                                              for identifier in chunk.output.modified_artifact_identifiers}
-                        await persist_artifacts(self.db, self.id, modified_artifacts)
+                        await persist_artifacts(self.db, self.id, self.chat.artifacts,
+                                                chunk.output.modified_artifact_identifiers, self.persisted_artifact_versions)
                     event_data = json.dumps(
                         to_tool_call_response_json(chunk, self.chat.artifacts))
                     yield render_event(TOOL_RESPONSE_EVENT, event_data)
 
                 elif isinstance(chunk, ToolResponseTurn):
+                    await self.chat.artifacts.load(get_modified_artifact_identifiers([chunk]))
                     await persist_turn(self.db, self.id, chunk, self.chat.artifacts)
 
                 elif isinstance(chunk, ChatFinish):
@@ -134,12 +141,14 @@ class Thread:
                 if request.result == UserConfirmationResult.PENDING:
                     await update_user_confirmation(self.db, self.id, confirmation_id, UserConfirmationResult.CANCELED)
 
-    def to_json(self, include_history: bool = True) -> ThreadJson:
+    async def to_json(self, include_history: bool = True) -> ThreadJson:
         json: ThreadJson = {
             "thread_id": self.id,
             "title": self.title
         }
         if include_history:
+            # Artifacts loaded on demand are all fetched at once
+            await self.chat.artifacts.load()
             json["history"] = [to_turn_json(turn,
                                             self.chat.artifacts) for turn in self.chat.turns]
             json["artifacts"] = [artifact.to_json()
@@ -155,15 +164,47 @@ class Thread:
             raise ThreadNotFound
         thread_id, title = thread['thread_id'], thread['title']
         pacha_turns = await fetch_turns(db, thread_id)
-        artifacts = await fetch_artifacts(db, thread_id)
         user_confirmations = await fetch_user_confirmations(db, thread_id)
         chat = default_chat
         chat.turns = pacha_turns
         chat.chat.turns = [
             turn for turn in pacha_turns if isinstance(turn, Turn)]
-        chat.artifacts = Artifacts(artifacts=artifacts)
 
-        return cls(id=thread_id, title=title, chat=chat, db=db, user_confirmations=user_confirmations)
+        persisted_artifact_versions: Dict[str, int] = {}
+        artifact_metadata = await fetch_artifact_metadata(db, thread_id)
+        if any(metadata is None for metadata in artifact_metadata.values()):
+            # Artifacts persisted before metadata was recorded are loaded eagerly
+            artifacts = await fetch_artifacts(db, thread_id)
+            # Keeps the storage of the default chat's artifacts (eg: spilling to disk)
+            for identifier, artifact in artifacts.items():
+                chat.artifacts.artifacts[identifier] = artifact
+                persisted_artifact_versions[identifier] = artifact.version
+            await chat.artifacts.flush()
+        else:
+            # Only the metadata is needed to render the artifacts for prompts,
+            # the data is loaded when an artifact is first needed
+            chat.artifacts.artifacts = LazyArtifactMap(
+                load=functools.partial(fetch_artifacts, db, thread_id),
+                unloaded=set(artifact_metadata),
+                loaded=chat.artifacts.artifacts,
+                identifiers=dict.fromkeys(artifact_metadata))
+            for identifier, metadata in artifact_metadata.items():
+                assert metadata is not None
+                chat.artifacts.metadata[identifier] = metadata
+                persisted_artifact_versions[identifier] = metadata['version']
+
+        return cls(id=thread_id, title=title, chat=chat, db=db, user_confirmations=user_confirmations, persisted_artifact_versions=persisted_artifact_versions)
+
+
+def get_modified_artifact_identifiers(turns: Sequence[Turn]) -> list[str]:
+    identifiers: dict[str, None] = {}
+    for turn in turns:
+        if isinstance(turn, ToolResponseTurn):
+            for response in turn.tool_responses:
+                if isinstance(response.output, PythonToolOutput):
+                    identifiers.update(dict.fromkeys(
+                        response.output.modified_artifact_identifiers))
+    return list(identifiers)
 
 
 class ThreadNotFound(Exception):
@@ -6,7 +6,7 @@ from examples.utils.io import (
 import logging
 from pacha.data_engine.artifacts import Artifacts
 from pacha.data_engine.context import ExecutionContext
-from pacha.sdk.chat import Chat, ToolCallResponse, ToolResponseTurn, UserTurn
+from pacha.sdk.chat import Chat, ToolCallResponse, ToolResponseTurn, UserTurn, get_recent_user_text
 from pacha.sdk.tool import ErrorToolOutput
 from pacha.utils.logging import setup_logger as setup_pacha_logger
 import os
@@ -15,6 +15,9 @@ import asyncio
 # Assuming LLM performance degrades after 32k tokens and 4 characters per token
 CHARACTER_LIMIT = 32000 * 4
 
+# Number of latest user turns used to pick the relevant schema for the prompt
+SCHEMA_QUERY_USER_TURNS = 3
+
 
 async def async_main():
     log_level = os.environ.get('LOG', 'WARNING').upper()
@@ -33,7 +36,7 @@ async def async_main():
     You are Pacha - an assistant that is connected to user's data. If needed, use the "{pacha_tool.name()}" tool to retrieve, observe, or process any contextual user data relevant to the conversation.
     Do not call this tool out to the user - from a user's point of view you are doing everything as a single system.
 
-    {pacha_tool.system_prompt_fragment(artifacts)}.
+    {pacha_tool.system_prompt_fragment(artifacts, get_recent_user_text(turns, SCHEMA_QUERY_USER_TURNS))}.
     """
 
     output("=== Chat with Pacha tool ===", Colors.RED)
@@ -2,15 +2,19 @@ import argparse
 
 from examples.utils.io import get_python_executor_hooks_for_rendering_to_stdout, get_query_planner_hooks_for_rendering_to_stdout
 from pacha.data_engine.data_engine import DataEngine
+from pacha.data_engine.catalog_cache import DEFAULT_CATALOG_TTL_SECS, CachingDataEngine
 from pacha.data_engine.ddn import DdnDataEngine
+from pacha.data_engine.local_runtime import DEFAULT_MAX_TASKS_PER_WORKER, DEFAULT_WORKERS, LocalRuntime
+from pacha.data_engine.python_executor import PythonExecutorOptions
 from pacha.data_engine.postgres import PostgresDataEngine
-from pacha.query_planner.query_planner import QueryPlanner
+from pacha.query_planner.query_planner import PlanCandidate, QueryPlanner
 from pacha.sdk.tool import Tool
-from pacha.sdk.tools.code_tool import PachaPythonTool, create_python_tool
+from pacha.sdk.tools.code_tool import ARTIFACTS_PROMPT_TOKENS, PachaPythonTool, create_python_tool
 from pacha.sdk.tools.nl_tool import PachaNlTool
 from pacha.sdk.tools.sql_tool import PachaSqlTool, create_sql_tool
 from pacha.sdk.llms import openai, anthropic
 from pacha.sdk.llm import Llm
+from pacha.sdk.llm_cache import DEFAULT_MAX_ENTRIES, LlmCache
 
 
 def add_data_engine_args(parser: argparse.ArgumentParser):
@@ -24,27 +28,85 @@ def add_data_engine_args(parser: argparse.ArgumentParser):
                         help="postgres connection string", type=str)
     parser.add_argument('-s', '--include-schema', dest='included_schemas', type=str, action='append',
                         help='one or more schemas to include from the postgres database')
+    parser.add_argument('--catalog-cache-ttl', type=float,
+                        help=f'Seconds to reuse the introspected catalog for before checking it for changes (default: {DEFAULT_CATALOG_TTL_SECS} if --catalog-cache-path is set)')
+    parser.add_argument('--catalog-cache-path', type=str,
+                        help='File to persist the introspected catalog to, for faster restarts')
 
 
 def get_data_engine(args: argparse.Namespace) -> DataEngine:
+    data_engine: DataEngine
     if args.data_engine == 'postgres':
-        return PostgresDataEngine(
+        data_engine = PostgresDataEngine(
             connection_string=args.connection_string,
             included_schemas=args.included_schemas)
+    else:
+        headers_dict = {}
+        for header in args.headers:
+            header: str = header
+            header_name, header_value = header.split(':', 1)
+            headers_dict[header_name] = header_value.lstrip()
 
-    headers_dict = {}
-    for header in args.headers:
-        header: str = header
-        header_name, header_value = header.split(':', 1)
-        headers_dict[header_name] = header_value.lstrip()
+        data_engine = DdnDataEngine(url=args.url, headers=headers_dict)
 
-    return DdnDataEngine(url=args.url, headers=headers_dict)
+    if args.catalog_cache_ttl is not None or args.catalog_cache_path is not None:
+        data_engine = CachingDataEngine(
+            data_engine=data_engine,
+            ttl_secs=args.catalog_cache_ttl if args.catalog_cache_ttl is not None else DEFAULT_CATALOG_TTL_SECS,
+            path=args.catalog_cache_path)
+    return data_engine
 
 
 def add_tool_args(parser: argparse.ArgumentParser):
     add_data_engine_args(parser)
     parser.add_argument('-t', '--tool', type=str,
                         choices=['nl', 'sql', 'python'], default='python')
+    parser.add_argument('--schema-top-k', type=int,
+                        help='Only describe these many tables relevant to the conversation (plus related tables) in prompts, for large schemas')
+    parser.add_argument('--sql-columnar', action='store_true',
+                        help='With the sql tool, show query results to the LLM in columnar form, which is shorter for wide results')
+    parser.add_argument('--speculative-temperatures', type=float, nargs='+', default=[],
+                        help='With the nl tool, generate and execute a query plan at each of these temperatures concurrently, and use the first successful one')
+    parser.add_argument('--artifacts-prompt-tokens', type=int, default=ARTIFACTS_PROMPT_TOKENS,
+                        help='Approximate number of tokens to describe previously created artifacts in prompts')
+    parser.add_argument('--llm-cache-entries', type=int,
+                        help=f'Reuse the responses to these many recent identical classify/summarize prompts (default: {DEFAULT_MAX_ENTRIES} if --llm-cache-path is set)')
+    parser.add_argument('--llm-cache-path', type=str,
+                        help='SQLite database to persist classify/summarize responses to')
+    parser.add_argument('--warm-runtime-connections', type=int, default=0,
+                        help='Number of connections to the Python runtime to keep open ahead of time')
+    parser.add_argument('--local-runtime', action='store_true',
+                        help='Execute Python code in local worker processes instead of the remote Python runtime')
+    parser.add_argument('--local-runtime-workers', type=int, default=DEFAULT_WORKERS,
+                        help='Number of idle local Python workers to keep ready')
+    parser.add_argument('--local-runtime-max-workers', type=int,
+                        help='Maximum number of concurrent executions by local Python workers, beyond which executions are queued')
+    parser.add_argument('--local-runtime-max-tasks-per-worker', type=int, default=DEFAULT_MAX_TASKS_PER_WORKER,
+                        help='Number of executions after which a local Python worker is replaced')
+    parser.add_argument('--local-runtime-max-memory-mb', type=int,
+                        help='Address space limit of each local Python worker')
+    parser.add_argument('--local-runtime-max-rss-mb', type=int,
+                        help='Resident memory beyond which a local Python worker is replaced after its execution')
+    parser.add_argument('--local-runtime-max-cpu-secs', type=float,
+                        help='CPU time limit of each execution by a local Python worker')
+
+
+def get_python_executor_options(args: argparse.Namespace) -> PythonExecutorOptions:
+    options = PythonExecutorOptions(
+        warm_runtime_connections=args.warm_runtime_connections)
+    if args.llm_cache_entries is not None or args.llm_cache_path is not None:
+        options.llm_cache = LlmCache(
+            max_entries=args.llm_cache_entries if args.llm_cache_entries is not None else DEFAULT_MAX_ENTRIES,
+            path=args.llm_cache_path)
+    if args.local_runtime:
+        options.local_runtime = LocalRuntime(
+            size=args.local_runtime_workers,
+            max_workers=args.local_runtime_max_workers,
+            max_tasks_per_worker=args.local_runtime_max_tasks_per_worker,
+            max_memory_bytes=args.local_runtime_max_memory_mb * 1024 * 1024 if args.local_runtime_max_memory_mb is not None else None,
+            max_rss_bytes=args.local_runtime_max_rss_mb * 1024 * 1024 if args.local_runtime_max_rss_mb is not None else None,
+            max_cpu_secs=args.local_runtime_max_cpu_secs)
+    return options
 
 
 async def get_pacha_tool(args, render_to_stdout=True) -> Tool:
@@ -52,15 +114,18 @@ async def get_pacha_tool(args, render_to_stdout=True) -> Tool:
     if args.tool == 'nl':
         return PachaNlTool(query_planner=QueryPlanner(
             data_engine=data_engine,
-            hooks=get_query_planner_hooks_for_rendering_to_stdout()))
+            hooks=get_query_planner_hooks_for_rendering_to_stdout(),
+            schema_top_k=args.schema_top_k,
+            speculative_candidates=[PlanCandidate(temperature=temperature) for temperature in args.speculative_temperatures]))
     elif args.tool == 'sql':
-        return await create_sql_tool(data_engine=data_engine)
+        return await create_sql_tool(data_engine=data_engine, schema_top_k=args.schema_top_k, columnar=args.sql_columnar)
     elif args.tool == 'python':
+        executor_options = get_python_executor_options(args)
         if render_to_stdout:
             return await create_python_tool(
-                data_engine=data_engine, hooks=get_python_executor_hooks_for_rendering_to_stdout(), llm=get_llm(args))
+                data_engine=data_engine, hooks=get_python_executor_hooks_for_rendering_to_stdout(), llm=get_llm(args), schema_top_k=args.schema_top_k, artifacts_prompt_tokens=args.artifacts_prompt_tokens, executor_options=executor_options)
         else:
-            return await create_python_tool(data_engine=data_engine, llm=get_llm(args))
+            return await create_python_tool(data_engine=data_engine, llm=get_llm(args), schema_top_k=args.schema_top_k, artifacts_prompt_tokens=args.artifacts_prompt_tokens, executor_options=executor_options)
     else:
         print("Invalid tool choice")
         exit(1)
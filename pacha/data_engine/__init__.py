@@ -1 +1 @@
-from .data_engine import DataEngine, SqlOutput, SqlStatement
\ No newline at end of file
+from .data_engine import DataEngine, SqlOutput, SqlStatement, ColumnarSqlOutput
\ No newline at end of file
@@ -0,0 +1,200 @@
+from collections import OrderedDict
+from collections.abc import Collection, Iterable, Iterator
+from dataclasses import dataclass, field
+from typing import Optional
+from pacha.data_engine.artifacts import Artifact, ArtifactData, AsyncArtifactMap
+from pacha.error import PachaException
+import asyncio
+import json
+import os
+import pickle
+import sqlite3
+import tempfile
+import weakref
+
+# Number of rows sampled to estimate the size of a table artifact
+SIZE_ESTIMATE_SAMPLE_ROWS = 100
+
+
+def estimate_size(data: ArtifactData) -> int:
+    """Approximate size of artifact data in bytes, based on a sample of its rows"""
+    if isinstance(data, str):
+        return len(data)
+    if len(data) == 0:
+        return 0
+    sample = data[:SIZE_ESTIMATE_SAMPLE_ROWS]
+    return len(json.dumps(sample, default=str)) * len(data) // len(sample)
+
+
+def close_spill_database(connection: sqlite3.Connection, path: Optional[str]):
+    connection.close()
+    if path is not None:
+        os.remove(path)
+
+
+@dataclass
+class SpillingArtifactMap(AsyncArtifactMap):
+    """
+    Map of artifact identifier to artifact that keeps the most recently used
+    artifacts in memory within `memory_budget_bytes`, and spills the rest to a
+    SQLite database. Evicted artifacts are written on `flush`, and spilled ones
+    are read back with `load_artifacts`, both on a worker thread so that pickling
+    and disk access don't block the event loop. Without a `path` a temporary
+    database is created on the first spill, and deleted along with the map.
+    """
+    memory_budget_bytes: int
+    path: Optional[str] = None
+    # Artifacts in memory, least recently used first
+    hot: OrderedDict[str, Artifact] = field(
+        default_factory=OrderedDict, init=False, repr=False)
+    sizes: dict[str, int] = field(default_factory=dict, init=False, repr=False)
+    memory_bytes: int = field(default=0, init=False)
+    # Identifiers of all the artifacts, in insertion order
+    identifiers: dict[str, None] = field(
+        default_factory=dict, init=False, repr=False)
+    # Evicted artifacts that are yet to be written to the database
+    pending: dict[str, Artifact] = field(
+        default_factory=dict, init=False, repr=False)
+    # Artifacts whose current version is in the database. Artifacts are never
+    # modified in place, so these can be evicted without being written again.
+    spilled: set[str] = field(default_factory=set, init=False, repr=False)
+    # Artifacts whose rows in the database are outdated and yet to be deleted
+    outdated: set[str] = field(default_factory=set, init=False, repr=False)
+    # Opened on the first spill, so that maps that fit in memory never touch disk
+    connection: Optional[sqlite3.Connection] = field(
+        default=None, init=False, repr=False)
+    # Held while the database is accessed from a worker thread
+    lock: asyncio.Lock = field(
+        default_factory=asyncio.Lock, init=False, repr=False)
+
+    def get_connection(self) -> sqlite3.Connection:
+        if self.connection is None:
+            temporary_path = None
+            if self.path is None:
+                file, temporary_path = tempfile.mkstemp(
+                    prefix='pacha-artifacts-', suffix='.db')
+                os.close(file)
+            self.connection = sqlite3.connect(
+                self.path or temporary_path, check_same_thread=False)
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS spilled_artifacts (identifier TEXT PRIMARY KEY, artifact BLOB NOT NULL)")
+            weakref.finalize(self, close_spill_database,
+                             self.connection, temporary_path)
+        return self.connection
+
+    def __getitem__(self, identifier: str) -> Artifact:
+        artifact = self.hot.get(identifier)
+        if artifact is not None:
+            self.hot.move_to_end(identifier)
+            return artifact
+        artifact = self.pending.get(identifier)
+        if artifact is not None:
+            return artifact
+        if identifier not in self.identifiers:
+            raise KeyError(identifier)
+        raise PachaException(f"Artifact {identifier} is spilled to disk and not loaded")
+
+    def __setitem__(self, identifier: str, artifact: Artifact):
+        if identifier in self.identifiers:
+            self.forget(identifier)
+        self.identifiers[identifier] = None
+        self.make_hot(identifier, artifact)
+
+    def __delitem__(self, identifier: str):
+        if identifier not in self.identifiers:
+            raise KeyError(identifier)
+        self.forget(identifier)
+        del self.identifiers[identifier]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.identifiers)
+
+    def __len__(self) -> int:
+        return len(self.identifiers)
+
+    def __contains__(self, identifier: object) -> bool:
+        return identifier in self.identifiers
+
+    async def load_artifacts(self, identifiers: Iterable[str]):
+        identifiers = [identifier for identifier in identifiers
+                       if identifier in self.identifiers]
+        async with self.lock:
+            to_read = [identifier for identifier in identifiers
+                       if identifier in self.spilled and identifier not in self.hot]
+            read: dict[str, Artifact] = {}
+            if len(to_read) > 0:
+                read = await asyncio.to_thread(self.read_artifacts, to_read)
+        # All the requested artifacts stay in memory until the map is next
+        # modified, even if together they are larger than the budget
+        pinned = set(identifiers)
+        for identifier in identifiers:
+            if identifier in self.hot:
+                self.hot.move_to_end(identifier)
+            elif identifier in self.pending:
+                self.make_hot(identifier, self.pending.pop(
+                    identifier), pinned)
+            elif identifier in self.spilled and identifier in read:
+                # Unless the artifact was replaced while it was being read
+                self.make_hot(identifier, read[identifier], pinned)
+        await self.flush()
+
+    async def flush(self):
+        async with self.lock:
+            if len(self.pending) == 0 and len(self.outdated) == 0:
+                return
+            to_write = dict(self.pending)
+            # Writing an artifact replaces its outdated row
+            to_delete = self.outdated - to_write.keys()
+            self.outdated = set()
+            await asyncio.to_thread(self.write_artifacts, to_write, to_delete)
+            for identifier, artifact in to_write.items():
+                if self.pending.get(identifier, self.hot.get(identifier)) is artifact:
+                    self.pending.pop(identifier, None)
+                    self.spilled.add(identifier)
+                else:
+                    # Replaced or deleted while it was being written
+                    self.outdated.add(identifier)
+
+    def read_artifacts(self, identifiers: list[str]) -> dict[str, Artifact]:
+        placeholders = ', '.join('?' for _ in identifiers)
+        rows = self.get_connection().execute(
+            f"SELECT identifier, artifact FROM spilled_artifacts WHERE identifier IN ({placeholders})", identifiers).fetchall()
+        return {identifier: pickle.loads(artifact) for identifier, artifact in rows}
+
+    def write_artifacts(self, artifacts: dict[str, Artifact], outdated: set[str]):
+        connection = self.get_connection()
+        connection.executemany("DELETE FROM spilled_artifacts WHERE identifier = ?",
+                               [(identifier,) for identifier in outdated])
+        connection.executemany("INSERT OR REPLACE INTO spilled_artifacts (identifier, artifact) VALUES (?, ?)",
+                               [(identifier, pickle.dumps(artifact, protocol=pickle.HIGHEST_PROTOCOL))
+                                for identifier, artifact in artifacts.items()])
+        connection.commit()
+
+    def make_hot(self, identifier: str, artifact: Artifact, pinned: Collection[str] = ()):
+        size = estimate_size(artifact.data)
+        self.hot[identifier] = artifact
+        self.sizes[identifier] = size
+        self.memory_bytes += size
+        # The artifact just accessed always stays in memory, even if it is
+        # larger than the budget by itself
+        for candidate in list(self.hot):
+            if self.memory_bytes <= self.memory_budget_bytes:
+                break
+            if candidate != identifier and candidate not in pinned:
+                self.evict(candidate)
+
+    def evict(self, identifier: str):
+        artifact = self.hot.pop(identifier)
+        self.memory_bytes -= self.sizes.pop(identifier)
+        if identifier not in self.spilled:
+            # Written on the next flush
+            self.pending[identifier] = artifact
+
+    def forget(self, identifier: str):
+        if identifier in self.hot:
+            del self.hot[identifier]
+            self.memory_bytes -= self.sizes.pop(identifier)
+        self.pending.pop(identifier, None)
+        if identifier in self.spilled:
+            self.spilled.discard(identifier)
+            self.outdated.add(identifier)
@@ -0,0 +1,218 @@
+from array import array
+from typing import Any, Optional
+from pacha.data_engine.data_engine import ColumnarSqlOutput, ColumnValues, SqlOutput
+from pacha.error import PachaException
+import math
+import statistics
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+AGGREGATES = ['count', 'distinct', 'sum', 'mean', 'std', 'min', 'max']
+DEFAULT_AGGREGATES = ['count', 'mean', 'min', 'max']
+# Only these are computed for columns that aren't numeric
+NON_NUMERIC_AGGREGATES = ['count', 'distinct', 'min', 'max']
+MAX_HISTOGRAM_BINS = 100
+
+
+def is_numeric(values: ColumnValues) -> bool:
+    if isinstance(values, array):
+        return True
+    has_number = False
+    for value in values:
+        if value is None:
+            continue
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return False
+        has_number = True
+    return has_number
+
+
+def is_integer(values: ColumnValues) -> bool:
+    if isinstance(values, array):
+        return values.typecode == 'q'
+    return all(value is None or isinstance(value, int) for value in values)
+
+
+def group_rows(output: ColumnarSqlOutput, group_by: list[str]) -> tuple[list[tuple], list[list[int]]]:
+    """Keys of the groups in order of first appearance, and the row indices of each group"""
+    if len(group_by) == 0:
+        return [()], [list(range(output.num_rows))]
+    group_indices: dict[tuple, list[int]] = {}
+    for index, key in enumerate(zip(*[output.column(column) for column in group_by])):
+        try:
+            group_indices.setdefault(key, []).append(index)
+        except TypeError:
+            # Unhashable values, eg: lists
+            raise PachaException(
+                f"Can't group by columns {group_by}, since they have values like lists or dicts")
+    return list(group_indices), list(group_indices.values())
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    """Percentile with linear interpolation between the closest ranks, like numpy's default"""
+    position = (len(sorted_values) - 1) * q / 100
+    lower = math.floor(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def histogram(values: list[float], bins: int) -> list[dict[str, Any]]:
+    low, high = min(values), max(values)
+    if low == high:
+        # Same range as numpy uses for a constant column
+        low, high = low - 0.5, high + 0.5
+    width = (high - low) / bins
+    counts = [0] * bins
+    for value in values:
+        counts[min(int((value - low) / width), bins - 1)] += 1
+    return [{"start": low + width * bin, "end": low + width * (bin + 1), "count": count}
+            for bin, count in enumerate(counts)]
+
+
+def numeric_stats(values: Any, integer: bool, aggregates: list[str], percentiles: list[float], histogram_bins: int) -> dict[str, Any]:
+    """
+    Statistics of the non-null values of a numeric column, which are a numpy array
+    if numpy is installed and a list otherwise
+    """
+    stats: dict[str, Any] = {}
+    empty = len(values) == 0
+    if numpy is not None:
+        for aggregate in aggregates:
+            match aggregate:
+                case 'count': stats[aggregate] = int(len(values))
+                case 'distinct': stats[aggregate] = int(len(numpy.unique(values)))
+                case 'sum': stats[aggregate] = values.sum().item()
+                case 'mean': stats[aggregate] = None if empty else values.mean().item()
+                case 'std': stats[aggregate] = None if empty else values.std().item()
+                case 'min': stats[aggregate] = None if empty else values.min().item()
+                case 'max': stats[aggregate] = None if empty else values.max().item()
+        if not empty and len(percentiles) > 0:
+            for q, value in zip(percentiles, numpy.percentile(values, percentiles).tolist()):
+                stats[f'p{q:g}'] = value
+        if not empty and histogram_bins > 0:
+            counts, edges = numpy.histogram(values, bins=histogram_bins)
+            stats['histogram'] = [{"start": edges[bin].item(), "end": edges[bin + 1].item(), "count": int(count)}
+                                  for bin, count in enumerate(counts)]
+    else:
+        for aggregate in aggregates:
+            match aggregate:
+                case 'count': stats[aggregate] = len(values)
+                case 'distinct': stats[aggregate] = len(set(values))
+                case 'sum': stats[aggregate] = sum(values) if integer else math.fsum(values)
+                case 'mean': stats[aggregate] = None if empty else statistics.fmean(values)
+                case 'std': stats[aggregate] = None if empty else statistics.pstdev(values)
+                case 'min': stats[aggregate] = None if empty else min(values)
+                case 'max': stats[aggregate] = None if empty else max(values)
+        if not empty and len(percentiles) > 0:
+            sorted_values = sorted(values)
+            for q in percentiles:
+                stats[f'p{q:g}'] = percentile(sorted_values, q)
+        if not empty and histogram_bins > 0:
+            stats['histogram'] = histogram(values, histogram_bins)
+    if integer:
+        for aggregate in ['sum', 'min', 'max']:
+            if isinstance(stats.get(aggregate), float):
+                stats[aggregate] = int(stats[aggregate])
+    return stats
+
+
+def non_numeric_stats(values: list[Any], aggregates: list[str]) -> dict[str, Any]:
+    stats: dict[str, Any] = {}
+    for aggregate in aggregates:
+        if aggregate not in NON_NUMERIC_AGGREGATES:
+            stats[aggregate] = None
+            continue
+        match aggregate:
+            case 'count': stats[aggregate] = len(values)
+            case 'distinct':
+                try:
+                    stats[aggregate] = len(set(values))
+                except TypeError:
+                    # Unhashable values, eg: lists
+                    stats[aggregate] = None
+            case 'min' | 'max':
+                try:
+                    stats[aggregate] = None if len(values) == 0 else (
+                        min(values) if aggregate == 'min' else max(values))
+                except TypeError:
+                    # Values of different types that can't be compared
+                    stats[aggregate] = None
+    return stats
+
+
+def compute_column_stats(rows: SqlOutput, columns: list[str], group_by: Optional[list[str]] = None, aggregates: Optional[list[str]] = None,
+                         percentiles: Optional[list[float]] = None, histogram_bins: int = 0) -> list[dict[str, Any]]:
+    """
+    Aggregates of `columns` of a table, for each group of rows with the same values
+    of the `group_by` columns. Each result row has the group's values of the
+    `group_by` columns, its number of rows as `row_count`, and for each column
+    `<column>_<aggregate>`, `<column>_p<percentile>` and `<column>_histogram`
+    (a list of bins with their start, end and count). Only count, distinct, min
+    and max are computed for columns that aren't numeric. Null values are ignored.
+    """
+    group_by = group_by or []
+    aggregates = DEFAULT_AGGREGATES if aggregates is None else aggregates
+    percentiles = percentiles or []
+    for aggregate in aggregates:
+        if aggregate not in AGGREGATES:
+            raise PachaException(
+                f"Unknown aggregate {aggregate}, expected one of {AGGREGATES}")
+    for q in percentiles:
+        if not 0 <= q <= 100:
+            raise PachaException(
+                f"Percentiles must be between 0 and 100, got {q}")
+    if not 0 <= histogram_bins <= MAX_HISTOGRAM_BINS:
+        raise PachaException(
+            f"histogram_bins must be between 0 and {MAX_HISTOGRAM_BINS}")
+
+    output = ColumnarSqlOutput.from_rows(rows)
+    for column in columns + group_by:
+        if column not in output.columns:
+            raise PachaException(
+                f"Unknown column {column}, the columns are {output.columns}")
+
+    # Numeric columns are converted once, and then indexed for each group
+    numeric_columns: dict[str, Any] = {}
+    integer_columns: set[str] = set()
+    for column in columns:
+        values = output.column(column)
+        if not is_numeric(values):
+            continue
+        if is_integer(values):
+            integer_columns.add(column)
+        if numpy is None:
+            numeric_columns[column] = values
+        elif isinstance(values, array):
+            numeric_columns[column] = numpy.frombuffer(
+                values, dtype=values.typecode)
+        else:
+            numeric_columns[column] = numpy.array(
+                [math.nan if value is None else value for value in values], dtype=numpy.float64)
+
+    keys, group_indices = group_rows(output, group_by)
+    results: list[dict[str, Any]] = []
+    for key, indices in zip(keys, group_indices):
+        result: dict[str, Any] = dict(zip(group_by, key))
+        result['row_count'] = len(indices)
+        for column in columns:
+            if column in numeric_columns:
+                values = numeric_columns[column]
+                if numpy is not None:
+                    values = values if len(group_by) == 0 else values[indices]
+                    if values.dtype == numpy.float64:
+                        values = values[~numpy.isnan(values)]
+                else:
+                    values = [values[index] for index in indices if values[index] is not None]
+                stats = numeric_stats(values, column in integer_columns,
+                                      aggregates, percentiles, histogram_bins)
+            else:
+                values = output.column(column)
+                stats = non_numeric_stats(
+                    [values[index] for index in indices if values[index] is not None], aggregates)
+            for name, value in stats.items():
+                result[f'{column}_{name}'] = value
+        results.append(result)
+    return results
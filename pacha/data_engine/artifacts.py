@@ -1,11 +1,26 @@
 
-from dataclasses import asdict, dataclass, field
-from typing import Any, Literal, TypedDict, cast, Tuple
+from abc import abstractmethod
+from collections.abc import Awaitable, Iterable, Iterator, MutableMapping
+from dataclasses import dataclass, field
+from typing import Any, Callable, Literal, NotRequired, Optional, TypedDict, Tuple, cast
+from pacha.data_engine.data_engine import ColumnarSqlOutput
+from pacha.error import PachaException
 
 ArtifactType = Literal['table', 'text']
 ArtifactData = list[dict[str, Any]] | str
 
 NUM_SAMPLE_ROWS = 2
+NUM_TEXT_PREVIEW_CHARS = 100
+# Longer text values in sample rows are truncated in prompts
+MAX_SAMPLE_VALUE_CHARS = 100
+# Rough size of a token, to budget prompts without a tokenizer
+CHARS_PER_TOKEN = 4
+
+# A new full snapshot of an artifact is taken after these many diffs
+MAX_DIFF_CHAIN_LENGTH = 8
+# Changes to more than this fraction of the existing cells of a table are not
+# worth storing as a diff
+MAX_DIFF_CHANGED_CELLS_FRACTION = 0.5
 
 
 class ArtifactJson(TypedDict):
@@ -15,30 +30,169 @@ class ArtifactJson(TypedDict):
     data: ArtifactData
 
 
+class ColumnStatsJson(TypedDict):
+    nulls: int
+    distinct: NotRequired[int]
+    min: NotRequired[Any]
+    max: NotRequired[Any]
+    mean: NotRequired[float]
+
+
+class ArtifactMetadataJson(TypedDict):
+    """
+    Summary of an artifact for prompts, computed once when the artifact is stored
+    so that prompts can describe the artifact without its data
+    """
+    identifier: str
+    title: str
+    artifact_type: ArtifactType
+    version: int
+    # Number of rows of a table artifact, or length of a text artifact
+    size: int
+    # Sample rows of a table artifact, or the start of a text artifact
+    preview: ArtifactData
+    # Inferred type of each column of a table artifact
+    columns: NotRequired[dict[str, str]]
+    stats: NotRequired[dict[str, ColumnStatsJson]]
+
+
+def infer_value_type(value: Any) -> str:
+    if isinstance(value, bool):
+        return 'boolean'
+    if isinstance(value, int):
+        return 'integer'
+    if isinstance(value, float):
+        return 'number'
+    if isinstance(value, str):
+        return 'text'
+    if isinstance(value, (list, tuple)):
+        return 'list'
+    if isinstance(value, dict):
+        return 'object'
+    return type(value).__name__
+
+
+def summarize_table(rows: list[dict[str, Any]]) -> Tuple[dict[str, str], dict[str, ColumnStatsJson]]:
+    """Inferred column types and basic statistics of each column of a table"""
+    column_values: dict[str, list[Any]] = {}
+    for row in rows:
+        for column, value in row.items():
+            column_values.setdefault(column, []).append(value)
+    columns: dict[str, str] = {}
+    stats: dict[str, ColumnStatsJson] = {}
+    for column, values in column_values.items():
+        non_null = [value for value in values if value is not None]
+        column_stats: ColumnStatsJson = {
+            'nulls': len(rows) - len(non_null)}
+        types = {infer_value_type(value) for value in non_null}
+        if types <= {'integer', 'number'} and len(types) > 0:
+            columns[column] = 'number' if 'number' in types else 'integer'
+            column_stats['min'] = min(non_null)
+            column_stats['max'] = max(non_null)
+            column_stats['mean'] = round(sum(non_null) / len(non_null), 4)
+        elif len(types) == 1:
+            columns[column] = types.pop()
+            if columns[column] in ('text', 'boolean'):
+                column_stats['distinct'] = len(set(non_null))
+            if columns[column] == 'text':
+                # Dates and timestamps are text, for which these are meaningful
+                column_stats['min'] = truncate_value(min(non_null))
+                column_stats['max'] = truncate_value(max(non_null))
+        else:
+            columns[column] = 'null' if len(types) == 0 else 'mixed'
+        stats[column] = column_stats
+    return columns, stats
+
+
+def truncate_value(value: Any) -> Any:
+    if isinstance(value, str) and len(value) > MAX_SAMPLE_VALUE_CHARS:
+        return value[:MAX_SAMPLE_VALUE_CHARS] + '...'
+    return value
+
+
+def render_metadata_for_prompt(metadata: ArtifactMetadataJson) -> str:
+    output = render_metadata_title_for_prompt(metadata)
+    if metadata['artifact_type'] == 'text':
+        output += f", text_preview = '{metadata['preview']}'"
+    elif metadata['artifact_type'] == 'table':
+        output += f", number of rows = {metadata['size']}"
+        if 'columns' in metadata:
+            output += f", columns = {metadata['columns']}"
+        output += f", sample rows = {metadata['preview']}"
+        if 'stats' in metadata:
+            output += f", column stats = {metadata['stats']}"
+    else:
+        raise ValueError(f'Invalid artifact type {metadata['artifact_type']}')
+    return output
+
+
+def render_metadata_title_for_prompt(metadata: ArtifactMetadataJson) -> str:
+    return f"{metadata['artifact_type']} artifact: identifier = '{
+        metadata['identifier']}', title = '{metadata['title']}'"
+
+
+class ArtifactDiffJson(TypedDict):
+    """Changes from version `base_version` of a table artifact to the next version"""
+    base_version: int
+    title: str
+    # Rows appended after the existing rows
+    appended_rows: list[dict[str, Any]]
+    # Columns added to all the existing rows, with their value for each row
+    added_columns: dict[str, list[Any]]
+    # [row index, column, value] of any other changed or added cells of the existing rows
+    changed_cells: list[tuple[int, str, Any]]
+    # Column order of the changed rows, so that they are rebuilt as they were stored
+    columns: NotRequired[list[str]]
+
+
 @dataclass
 class Artifact:
     identifier: str
     title: str
     artifact_type: ArtifactType
     data: ArtifactData
+    # Incremented every time the artifact is stored under the same identifier
+    version: int = field(default=1, compare=False)
+    # Diffs from the last full snapshot of the artifact up to this version
+    diffs: list[ArtifactDiffJson] = field(
+        default_factory=list, compare=False, repr=False)
 
     def render_for_prompt(self) -> str:
-        output = f"{self.artifact_type} artifact: identifier = '{
-            self.identifier}', title = '{self.title}'"
+        return render_metadata_for_prompt(self.get_metadata())
+
+    def get_metadata(self) -> ArtifactMetadataJson:
+        """Summarizes the data, so this is linear in the size of the artifact"""
+        metadata: ArtifactMetadataJson = {
+            "identifier": self.identifier,
+            "title": self.title,
+            "artifact_type": self.artifact_type,
+            "version": self.version,
+            "size": len(self.data),
+            "preview": ""
+        }
         if self.artifact_type == 'text':
             assert (isinstance(self.data, str))
-            output += f", text_preview = '{self.data[:100]}'"
+            metadata["preview"] = self.data[:NUM_TEXT_PREVIEW_CHARS]
         elif self.artifact_type == 'table':
             assert (isinstance(self.data, list) and len(self.data) > 0)
             assert (isinstance(self.data[0], dict))
-            output += f", number of rows = {len(self.data)}"
-            output += f", sample rows = {self.data[:NUM_SAMPLE_ROWS]}"
+            metadata["preview"] = [{column: truncate_value(value) for column, value in row.items()}
+                                   for row in self.data[:NUM_SAMPLE_ROWS]]
+            metadata["columns"], metadata["stats"] = summarize_table(
+                self.data)
         else:
             raise ValueError(f'Invalid artifact type {self.artifact_type}')
-        return output
+        return metadata
 
     def to_json(self) -> ArtifactJson:
-        return cast(ArtifactJson, asdict(self))
+        # The data is shared rather than deep copied (as asdict would), since
+        # artifacts are never modified in place
+        return {
+            "identifier": self.identifier,
+            "title": self.title,
+            "artifact_type": self.artifact_type,
+            "data": self.data
+        }
 
     def get_validation_error(self) -> str | None:
         if self.artifact_type == 'text':
@@ -56,28 +210,299 @@ class Artifact:
         return None
 
 
+def diff_artifacts(base: Artifact, artifact: Artifact) -> Optional[Tuple[ArtifactDiffJson, list[dict[str, Any]]]]:
+    """
+    Diff a table artifact against its previous version. Also returns the rows of
+    the new version with the unchanged rows shared with the previous version.
+    Returns None if the change is not a (small enough) addition or update of
+    rows and columns.
+    """
+    if base.artifact_type != 'table' or artifact.artifact_type != 'table':
+        return None
+    old_rows = cast(list[dict[str, Any]], base.data)
+    new_rows = cast(list[dict[str, Any]], artifact.data)
+    if len(new_rows) < len(old_rows):
+        return None
+
+    rows = list(old_rows)
+    columns: Optional[list[str]] = None
+    existing_cells = 0
+    added_cells: dict[str, list[tuple[int, Any]]] = {}
+    changed_cells: list[tuple[int, str, Any]] = []
+    for index, old_row in enumerate(old_rows):
+        existing_cells += len(old_row)
+        new_row = new_rows[index]
+        if old_row == new_row:
+            continue
+        if not old_row.keys() <= new_row.keys():
+            # Columns were removed
+            return None
+        if columns is None:
+            columns = list(new_row)
+        elif list(new_row) != [column for column in columns if column in new_row]:
+            # The changed rows have different column orders
+            return None
+        rows[index] = new_row
+        for column, value in new_row.items():
+            if column not in old_row:
+                added_cells.setdefault(column, []).append((index, value))
+            elif old_row[column] != value:
+                changed_cells.append((index, column, value))
+
+    added_columns: dict[str, list[Any]] = {}
+    for column, cells in added_cells.items():
+        if len(cells) == len(old_rows):
+            added_columns[column] = [value for _, value in cells]
+        else:
+            changed_cells.extend((index, column, value)
+                                 for index, value in cells)
+    if len(changed_cells) > MAX_DIFF_CHANGED_CELLS_FRACTION * existing_cells:
+        return None
+
+    appended_rows = new_rows[len(old_rows):]
+    rows.extend(appended_rows)
+    diff: ArtifactDiffJson = {
+        "base_version": base.version,
+        "title": artifact.title,
+        "appended_rows": appended_rows,
+        "added_columns": added_columns,
+        "changed_cells": changed_cells
+    }
+    if columns is not None:
+        diff["columns"] = columns
+    return diff, rows
+
+
+def apply_artifact_diff(base: Artifact, diff: ArtifactDiffJson) -> Artifact:
+    """The next version of a table artifact, sharing its unchanged rows with `base`"""
+    rows = list(cast(list[dict[str, Any]], base.data))
+    copied: set[int] = set()
+
+    def get_row_for_update(index: int) -> dict[str, Any]:
+        if index not in copied:
+            rows[index] = dict(rows[index])
+            copied.add(index)
+        return rows[index]
+
+    for column, values in diff["added_columns"].items():
+        for index, value in enumerate(values):
+            get_row_for_update(index)[column] = value
+    for index, column, value in diff["changed_cells"]:
+        get_row_for_update(index)[column] = value
+    columns = diff.get("columns")
+    if columns is not None:
+        for index in copied:
+            row = rows[index]
+            rows[index] = {column: row[column]
+                           for column in columns if column in row}
+    rows.extend(diff["appended_rows"])
+    return Artifact(identifier=base.identifier, title=diff["title"], artifact_type=base.artifact_type,
+                    data=rows, version=base.version + 1, diffs=base.diffs + [diff])
+
+
+class AsyncArtifactMap(MutableMapping[str, Artifact]):
+    """
+    Map of artifact identifier to artifact that keeps some artifacts out of
+    memory. Reading and writing those is I/O that must not block the event loop,
+    so they must be loaded with `load_artifacts` before they are accessed, and
+    writes are deferred until `flush`.
+    """
+
+    @abstractmethod
+    async def load_artifacts(self, identifiers: Iterable[str]):
+        """Bring these artifacts into memory, where they stay until the map is next modified"""
+        ...
+
+    async def flush(self):
+        """Finish any writes deferred by modifications of the map"""
+        pass
+
+
+@dataclass
+class LazyArtifactMap(AsyncArtifactMap):
+    """
+    Map of artifact identifier to artifact, where the artifacts in `unloaded` are
+    fetched with `load` and then kept in `loaded`. Loading is asynchronous, so
+    unloaded artifacts must be loaded with `load_artifacts` before they are accessed.
+    """
+    load: Callable[[list[str]], Awaitable[dict[str, Artifact]]]
+    unloaded: set[str] = field(default_factory=set)
+    loaded: MutableMapping[str, Artifact] = field(default_factory=dict)
+    # Identifiers of all the artifacts, in order
+    identifiers: dict[str, None] = field(default_factory=dict)
+
+    def __post_init__(self):
+        self.identifiers.update(dict.fromkeys(self.unloaded))
+        self.identifiers.update(dict.fromkeys(self.loaded))
+
+    async def load_artifacts(self, identifiers: Iterable[str]):
+        """Load those of the artifacts that aren't loaded yet, with a single call to `load`"""
+        identifiers = list(identifiers)
+        to_load = [identifier for identifier in identifiers
+                   if identifier in self.unloaded]
+        if len(to_load) > 0:
+            artifacts = await self.load(to_load)
+            for identifier in to_load:
+                # Unless the artifact was replaced while it was being loaded
+                if identifier in self.unloaded and identifier in artifacts:
+                    self.loaded[identifier] = artifacts[identifier]
+                    self.unloaded.discard(identifier)
+        if isinstance(self.loaded, AsyncArtifactMap):
+            # The loaded artifacts may themselves be kept out of memory (eg: spilled to disk)
+            await self.loaded.load_artifacts(
+                identifier for identifier in identifiers if identifier in self.loaded)
+
+    async def flush(self):
+        if isinstance(self.loaded, AsyncArtifactMap):
+            await self.loaded.flush()
+
+    def __getitem__(self, identifier: str) -> Artifact:
+        if identifier in self.unloaded:
+            raise PachaException(f"Artifact {identifier} is not loaded")
+        return self.loaded[identifier]
+
+    def __setitem__(self, identifier: str, artifact: Artifact):
+        self.unloaded.discard(identifier)
+        self.loaded[identifier] = artifact
+        self.identifiers[identifier] = None
+
+    def __delitem__(self, identifier: str):
+        if identifier in self.unloaded:
+            self.unloaded.discard(identifier)
+        else:
+            del self.loaded[identifier]
+        del self.identifiers[identifier]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.identifiers)
+
+    def __len__(self) -> int:
+        return len(self.identifiers)
+
+    def __contains__(self, identifier: object) -> bool:
+        return identifier in self.identifiers
+
+
 @dataclass
 class Artifacts:
-    # Map of artifact identifier to artifact
-    artifacts: dict[str, Artifact] = field(default_factory=dict)
+    """
+    Artifacts are copy-on-write: a stored artifact is never modified in place,
+    and storing an artifact under an existing identifier replaces it with a new
+    version. This allows the data to be shared with readers without copying.
+    """
+    # Map of artifact identifier to artifact. May be an AsyncArtifactMap, eg: a
+    # SpillingArtifactMap to bound the memory used by artifacts, or a
+    # LazyArtifactMap to load them on demand.
+    artifacts: MutableMapping[str, Artifact] = field(default_factory=dict)
+    # Summaries of the artifacts, most recently stored last, so that rendering
+    # doesn't need the data of spilled or unloaded artifacts
+    metadata: dict[str, ArtifactMetadataJson] = field(
+        default_factory=dict, init=False, repr=False)
+    # Prompt renderings of the summaries
+    rendered: dict[str, str] = field(
+        default_factory=dict, init=False, repr=False)
 
-    def store_artifact(self, identifier: str, title: str, artifact_type: ArtifactType, data: ArtifactData) -> Tuple[str, bool]:
+    async def store_artifact(self, identifier: str, title: str, artifact_type: ArtifactType, data: ArtifactData | ColumnarSqlOutput) -> Tuple[str, bool]:
+        if isinstance(data, ColumnarSqlOutput):
+            # Artifacts are stored as rows, which is what the runtime and the
+            # diffs of later versions work with
+            data = data.to_rows()
 
+        # The previous version is needed for the version number and to diff against
+        await self.load([identifier])
+        previous = self.artifacts.get(identifier)
         artifact = Artifact(
-            identifier=identifier, title=title, artifact_type=artifact_type, data=data)
+            identifier=identifier, title=title, artifact_type=artifact_type, data=data,
+            version=1 if previous is None else previous.version + 1)
         validation_error = artifact.get_validation_error()
         if validation_error is not None:
             return (f"Invalid artifact {identifier} not stored: {validation_error}", False)
 
-        rendered = artifact.render_for_prompt()
+        # Record the new version as a diff where possible, so that it can be
+        # persisted incrementally and shares unchanged rows with the previous version
+        if previous is not None and len(previous.diffs) < MAX_DIFF_CHAIN_LENGTH:
+            diff = diff_artifacts(previous, artifact)
+            if diff is not None:
+                artifact.diffs = previous.diffs + [diff[0]]
+                artifact.data = diff[1]
+
         self.artifacts[identifier] = artifact
-        return (f"Stored {rendered}", True)
+        self.metadata.pop(identifier, None)
+        self.metadata[identifier] = artifact.get_metadata()
+        self.rendered[identifier] = render_metadata_for_prompt(
+            self.metadata[identifier])
+        await self.flush()
+        return (f"Stored {self.rendered[identifier]}", True)
+
+    async def load(self, identifiers: Optional[Iterable[str]] = None):
+        """
+        Load the data of these artifacts (all the artifacts by default) if they are
+        loaded on demand. Must be awaited before the artifacts are accessed.
+        """
+        if isinstance(self.artifacts, AsyncArtifactMap):
+            await self.artifacts.load_artifacts(self.artifacts if identifiers is None else identifiers)
+
+    async def flush(self):
+        """Finish any writes deferred by storing artifacts (eg: spilling them to disk)"""
+        if isinstance(self.artifacts, AsyncArtifactMap):
+            await self.artifacts.flush()
 
     def get_artifact(self, identifier: str) -> ArtifactData:
+        """The returned data is shared with the stored artifact, and must not be mutated"""
         return self.artifacts[identifier].data
 
-    def render_for_prompt(self) -> str:
-        rendered = ""
-        for artifact in self.artifacts.values():
-            rendered += f"{artifact.render_for_prompt()}\n\n"
+    def get_version(self, identifier: str) -> int:
+        return self.artifacts[identifier].version
+
+    def get_metadata(self, identifier: str) -> ArtifactMetadataJson:
+        metadata = self.metadata.get(identifier)
+        if metadata is None:
+            metadata = self.artifacts[identifier].get_metadata()
+            self.metadata[identifier] = metadata
+        return metadata
+
+    def get_rendered(self, identifier: str) -> str:
+        rendered = self.rendered.get(identifier)
+        if rendered is None:
+            rendered = render_metadata_for_prompt(
+                self.get_metadata(identifier))
+            self.rendered[identifier] = rendered
         return rendered
+
+    def render_for_prompt(self, max_tokens: Optional[int] = None) -> str:
+        """
+        If `max_tokens` is set, only the most recently stored artifacts that fit are
+        described in full, older artifacts by just their identifier and title,
+        and any remaining artifacts are only counted.
+        """
+        identifiers = list(self.artifacts)
+        for identifier in identifiers:
+            self.get_rendered(identifier)
+        if max_tokens is None:
+            return "".join(f"{self.rendered[identifier]}\n\n" for identifier in identifiers)
+
+        # Most recently stored first
+        by_recency = [identifier for identifier in reversed(
+            self.metadata) if identifier in self.artifacts]
+        budget = max_tokens * CHARS_PER_TOKEN
+        renderings: dict[str, str] = {}
+        for identifier in by_recency:
+            rendered = self.rendered[identifier]
+            if len(rendered) > budget:
+                break
+            renderings[identifier] = rendered
+            budget -= len(rendered)
+        for identifier in by_recency[len(renderings):]:
+            rendered = render_metadata_title_for_prompt(
+                self.metadata[identifier])
+            if len(rendered) > budget:
+                break
+            renderings[identifier] = rendered
+            budget -= len(rendered)
+
+        output = "".join(f"{renderings[identifier]}\n\n"
+                         for identifier in identifiers if identifier in renderings)
+        omitted = len(identifiers) - len(renderings)
+        if omitted > 0:
+            output += f"... and {omitted} older artifacts, not described here to save space\n\n"
+        return output
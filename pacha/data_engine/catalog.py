@@ -1,5 +1,5 @@
 from enum import Enum
-from typing import Optional
+from typing import Any, Optional
 from dataclasses import dataclass, field
 
 
@@ -25,18 +25,40 @@ class TypeReference:
     underlying_type: Array | ScalarType | str
 
     def render(self, with_not_null: bool) -> str:
-        rendered = ""
         if isinstance(self.underlying_type, Array):
-            rendered += f"ARRAY<{
+            rendered = f"ARRAY<{
                 self.underlying_type.element_type.render(with_not_null)}>"
         elif isinstance(self.underlying_type, ScalarType):
-            rendered += self.underlying_type.name
+            rendered = self.underlying_type.name
         else:
-            rendered += self.underlying_type
+            rendered = self.underlying_type
         if with_not_null and not self.nullable:
-            rendered += " NOT NULL"
+            return f"{rendered} NOT NULL"
         return rendered
 
+    def to_json(self) -> dict[str, Any]:
+        if isinstance(self.underlying_type, Array):
+            underlying_type: dict[str, Any] = {
+                "array": self.underlying_type.element_type.to_json()}
+        elif isinstance(self.underlying_type, ScalarType):
+            underlying_type = {"scalar": self.underlying_type.name}
+        else:
+            underlying_type = {"custom": self.underlying_type}
+        return {"nullable": self.nullable, "underlying_type": underlying_type}
+
+    @classmethod
+    def from_json(cls, json_data: dict[str, Any]) -> 'TypeReference':
+        underlying_type_json = json_data["underlying_type"]
+        underlying_type: Array | ScalarType | str
+        if "array" in underlying_type_json:
+            underlying_type = Array(
+                TypeReference.from_json(underlying_type_json["array"]))
+        elif "scalar" in underlying_type_json:
+            underlying_type = ScalarType[underlying_type_json["scalar"]]
+        else:
+            underlying_type = underlying_type_json["custom"]
+        return cls(nullable=json_data["nullable"], underlying_type=underlying_type)
+
 
 @dataclass
 class StructField:
@@ -79,6 +101,13 @@ class Column:
             rendered += " -- Description: " + self.description
         return rendered
 
+    def to_json(self) -> dict[str, Any]:
+        return {"name": self.name, "type": self.type.to_json(), "description": self.description}
+
+    @classmethod
+    def from_json(cls, json_data: dict[str, Any]) -> 'Column':
+        return cls(name=json_data["name"], type=TypeReference.from_json(json_data["type"]), description=json_data["description"])
+
 
 @dataclass
 class Table:
@@ -88,16 +117,32 @@ class Table:
     foreign_keys: list['ForeignKey'] = field(default_factory=list)
 
     def render(self, schema_name: str) -> str:
-        rendered = f"CREATE TABLE {schema_name}.{self.name} ("
-        if self.description is not None:
-            rendered += " -- Description: " + self.description
-        rendered += "\n"
-        for field in self.columns.values():
-            rendered += f"  {field.render()}\n"
-        for foreign_key in self.foreign_keys:
-            rendered += f"  {foreign_key.render()}\n"
-        rendered += ")"
-        return rendered
+        lines = [f"CREATE TABLE {schema_name}.{self.name} (" if self.description is None else
+                 f"CREATE TABLE {schema_name}.{self.name} ( -- Description: {self.description}"]
+        lines.extend(f"  {field.render()}" for field in self.columns.values())
+        lines.extend(f"  {foreign_key.render()}" for foreign_key in self.foreign_keys)
+        lines.append(")")
+        return "\n".join(lines)
+
+    def to_json(self) -> dict[str, Any]:
+        return {
+            "name": self.name,
+            "description": self.description,
+            "columns": [column.to_json() for column in self.columns.values()],
+            "foreign_keys": [foreign_key.to_json() for foreign_key in self.foreign_keys]
+        }
+
+    @classmethod
+    def from_json(cls, json_data: dict[str, Any]) -> 'Table':
+        columns = [Column.from_json(column)
+                   for column in json_data["columns"]]
+        return cls(
+            name=json_data["name"],
+            description=json_data["description"],
+            columns={column.name: column for column in columns},
+            foreign_keys=[ForeignKey.from_json(foreign_key)
+                          for foreign_key in json_data["foreign_keys"]]
+        )
 
 
 @dataclass
@@ -112,6 +157,13 @@ class Argument:
             rendered += " -- Description: " + self.description
         return rendered
 
+    def to_json(self) -> dict[str, Any]:
+        return {"name": self.name, "type": self.type.to_json(), "description": self.description}
+
+    @classmethod
+    def from_json(cls, json_data: dict[str, Any]) -> 'Argument':
+        return cls(name=json_data["name"], type=TypeReference.from_json(json_data["type"]), description=json_data["description"])
+
 
 @dataclass
 class Function:
@@ -122,17 +174,36 @@ class Function:
     description: Optional[str] = None
 
     def render(self) -> str:
-        rendered = f"CREATE FUNCTION {self.name} ("
+        parts = [f"CREATE FUNCTION {self.name} ("]
         if self.description is not None:
-            rendered += " -- Description: " + self.description
-        rendered += "\nSTRUCT <\n"
-        for argument in self.arguments.values():
-            rendered += f"  {argument.render()}\n"
-        rendered += ">) RETURNS TABLE ("
-        for column in self.result_type.values():
-            rendered += f"  {column.render()}\n"
-        rendered += ")"
-        return rendered
+            parts.append(f" -- Description: {self.description}")
+        parts.append("\nSTRUCT <\n")
+        parts.extend(f"  {argument.render()}\n" for argument in self.arguments.values())
+        parts.append(">) RETURNS TABLE (")
+        parts.extend(f"  {column.render()}\n" for column in self.result_type.values())
+        parts.append(")")
+        return "".join(parts)
+
+    def to_json(self) -> dict[str, Any]:
+        return {
+            "name": self.name,
+            "arguments": [argument.to_json() for argument in self.arguments.values()],
+            "result_type": [column.to_json() for column in self.result_type.values()],
+            "description": self.description
+        }
+
+    @classmethod
+    def from_json(cls, json_data: dict[str, Any]) -> 'Function':
+        arguments = [Argument.from_json(argument)
+                     for argument in json_data["arguments"]]
+        result_type = [Column.from_json(column)
+                       for column in json_data["result_type"]]
+        return cls(
+            name=json_data["name"],
+            arguments={argument.name: argument for argument in arguments},
+            result_type={column.name: column for column in result_type},
+            description=json_data["description"]
+        )
 
 
 @dataclass
@@ -148,15 +219,27 @@ class ForeignKey:
     mapping: list[ForeignKeyMapping] = field(default_factory=list)
 
     def render(self) -> str:
-        rendered = 'FOREIGN KEY ('
-        rendered += ', '.join(
+        source_columns = ', '.join(
             mapping.source_column for mapping in self.mapping)
-        rendered += f') REFERENCES {self.target_schema}.{
-            self.target_table}('
-        rendered += ', '.join(
+        target_columns = ', '.join(
             mapping.target_column for mapping in self.mapping)
-        rendered += ')'
-        return rendered
+        return f'FOREIGN KEY ({source_columns}) REFERENCES {self.target_schema}.{self.target_table}({target_columns})'
+
+    def to_json(self) -> dict[str, Any]:
+        return {
+            "target_schema": self.target_schema,
+            "target_table": self.target_table,
+            "mapping": [{"source_column": mapping.source_column, "target_column": mapping.target_column} for mapping in self.mapping]
+        }
+
+    @classmethod
+    def from_json(cls, json_data: dict[str, Any]) -> 'ForeignKey':
+        return cls(
+            target_schema=json_data["target_schema"],
+            target_table=json_data["target_table"],
+            mapping=[ForeignKeyMapping(source_column=mapping["source_column"], target_column=mapping["target_column"])
+                     for mapping in json_data["mapping"]]
+        )
 
 
 @dataclass
@@ -165,27 +248,74 @@ class Schema:
     tables: dict[str, Table] = field(default_factory=dict)
 
     def render(self) -> str:
-        rendered = ""
-        for table in self.tables.values():
-            rendered += "\n"
-            rendered += table.render(self.name)
-            rendered += "\n"
-        return rendered
+        return "".join(f"\n{table.render(self.name)}\n" for table in self.tables.values())
+
+    def to_json(self) -> dict[str, Any]:
+        return {"name": self.name, "tables": [table.to_json() for table in self.tables.values()]}
+
+    @classmethod
+    def from_json(cls, json_data: dict[str, Any]) -> 'Schema':
+        tables = [Table.from_json(table) for table in json_data["tables"]]
+        return cls(name=json_data["name"], tables={table.name: table for table in tables})
+
+
+FUNCTIONS_PREAMBLE = "Below are the available SQL functions. Remember these need to be called via Python/SQL and not directly as tool calls. To pass a struct argument to a SQL function, you must use the inline STRUCT syntax of Apache DataFusion with named fields (eg: STRUCT('value1' as field1, 'value2' as field2)). Any optional fields may be omitted if you don't wish to pass them.\n"
 
 
 @dataclass
 class Catalog:
     schemas: dict[str, Schema] = field(default_factory=dict)
     functions: dict[str, Function] = field(default_factory=dict)
+    # Memoized output of render_for_prompt, which is called on every LLM turn.
+    rendered: Optional[str] = field(
+        default=None, init=False, repr=False, compare=False)
 
     def render_for_prompt(self) -> str:
-        rendered = ""
-        for schema in self.schemas.values():
-            rendered += schema.render()
+        if self.rendered is None:
+            self.rendered = self.render()
+        return self.rendered
+
+    def invalidate_rendered(self):
+        """Must be called after mutating the catalog in place"""
+        self.rendered = None
+
+    def render(self) -> str:
+        parts = [schema.render() for schema in self.schemas.values()]
         if len(self.functions) > 0:
-            rendered += "Below are the available SQL functions. Remember these need to be called via Python/SQL and not directly as tool calls. To pass a struct argument to a SQL function, you must use the inline STRUCT syntax of Apache DataFusion with named fields (eg: STRUCT('value1' as field1, 'value2' as field2)). Any optional fields may be omitted if you don't wish to pass them.\n"
-        for function in self.functions.values():
-            rendered += "\n"
-            rendered += function.render()
-            rendered += "\n"
-        return rendered
+            parts.append(FUNCTIONS_PREAMBLE)
+        parts.extend(f"\n{function.render()}\n" for function in self.functions.values())
+        return "".join(parts)
+
+    def render_tables_for_prompt(self, table_keys: list[tuple[str, str]]) -> str:
+        """
+        Render only the given (schema name, table name) tables in full, along with
+        the names of the remaining tables and all the functions.
+        """
+        included = set(table_keys)
+        parts = [f"\n{self.schemas[schema_name].tables[table_name].render(schema_name)}\n"
+                 for schema_name, table_name in table_keys]
+        other_tables = [f"{schema.name}.{table.name}" for schema in self.schemas.values()
+                        for table in schema.tables.values() if (schema.name, table.name) not in included]
+        if len(other_tables) > 0:
+            parts.append(
+                f"\nOnly the tables most relevant to the conversation are described above. The other available tables are: {', '.join(other_tables)}\n")
+        if len(self.functions) > 0:
+            parts.append(FUNCTIONS_PREAMBLE)
+        parts.extend(f"\n{function.render()}\n" for function in self.functions.values())
+        return "".join(parts)
+
+    def to_json(self) -> dict[str, Any]:
+        return {
+            "schemas": [schema.to_json() for schema in self.schemas.values()],
+            "functions": [function.to_json() for function in self.functions.values()]
+        }
+
+    @classmethod
+    def from_json(cls, json_data: dict[str, Any]) -> 'Catalog':
+        schemas = [Schema.from_json(schema) for schema in json_data["schemas"]]
+        functions = [Function.from_json(function)
+                     for function in json_data["functions"]]
+        return cls(
+            schemas={schema.name: schema for schema in schemas},
+            functions={function.name: function for function in functions}
+        )
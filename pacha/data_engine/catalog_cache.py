@@ -0,0 +1,119 @@
+from contextlib import aclosing
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Optional
+from pacha.data_engine.catalog import Catalog
+from pacha.data_engine.data_engine import SQL_STREAM_BATCH_SIZE, ColumnarSqlOutput, DataEngine, SqlOutput
+from pacha.utils.logging import get_logger
+import asyncio
+import json
+import os
+import time
+
+DEFAULT_CATALOG_TTL_SECS = 300
+
+
+@dataclass
+class CachedCatalog:
+    catalog: Catalog
+    fingerprint: Optional[str]
+    # Unix timestamp of when the catalog was last known to be fresh
+    validated_at: float
+
+    def to_json(self) -> dict[str, Any]:
+        return {
+            "catalog": self.catalog.to_json(),
+            "fingerprint": self.fingerprint,
+            "validated_at": self.validated_at
+        }
+
+    @classmethod
+    def from_json(cls, json_data: dict[str, Any]) -> 'CachedCatalog':
+        return cls(
+            catalog=Catalog.from_json(json_data["catalog"]),
+            fingerprint=json_data["fingerprint"],
+            validated_at=json_data["validated_at"]
+        )
+
+
+@dataclass
+class CachingDataEngine(DataEngine):
+    """
+    Wraps a data engine and caches its catalog. A cached catalog is served as is
+    for `ttl_secs`. Once it expires, the wrapped engine's catalog fingerprint is
+    compared with the cached one and the catalog is only rebuilt if they differ
+    (or if the engine can't compute a fingerprint).
+    If `path` is set, the cached catalog is also persisted to that file so that
+    it survives restarts.
+    """
+    data_engine: DataEngine
+    ttl_secs: float = DEFAULT_CATALOG_TTL_SECS
+    path: Optional[str] = None
+    cached: Optional[CachedCatalog] = field(default=None, init=False)
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock, init=False)
+
+    async def get_catalog(self) -> Catalog:
+        # Concurrent callers share a single introspection
+        async with self.lock:
+            if self.cached is None and self.path is not None:
+                self.cached = self.load()
+
+            if self.cached is not None and time.time() - self.cached.validated_at < self.ttl_secs:
+                return self.cached.catalog
+
+            catalog, fingerprint = await self.data_engine.get_catalog_if_changed(
+                None if self.cached is None else self.cached.fingerprint)
+            if catalog is None:
+                assert self.cached is not None
+                get_logger().debug("Catalog fingerprint unchanged, reusing cached catalog")
+                self.cached.validated_at = time.time()
+            else:
+                get_logger().info("Introspected catalog")
+                self.cached = CachedCatalog(
+                    catalog=catalog, fingerprint=fingerprint, validated_at=time.time())
+            self.save()
+            return self.cached.catalog
+
+    def invalidate(self):
+        """Force the next `get_catalog` call to re-introspect"""
+        self.cached = None
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def load(self) -> Optional[CachedCatalog]:
+        assert self.path is not None
+        try:
+            with open(self.path) as file:
+                return CachedCatalog.from_json(json.load(file))
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            get_logger().warning(
+                f"Ignoring unreadable catalog cache {self.path}: {e}")
+            return None
+
+    def save(self):
+        if self.path is None or self.cached is None:
+            return
+        # Write to a temporary file and move it in place so that readers never
+        # see a partially written cache.
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as file:
+            json.dump(self.cached.to_json(), file)
+        os.replace(temp_path, self.path)
+
+    async def get_catalog_fingerprint(self) -> Optional[str]:
+        return await self.data_engine.get_catalog_fingerprint()
+
+    async def get_catalog_if_changed(self, fingerprint: Optional[str]) -> tuple[Optional[Catalog], Optional[str]]:
+        return await self.data_engine.get_catalog_if_changed(fingerprint)
+
+    async def execute_sql(self, sql: str, allow_mutations: bool = False) -> SqlOutput:
+        return await self.data_engine.execute_sql(sql, allow_mutations)
+
+    async def execute_sql_stream(self, sql: str, allow_mutations: bool = False, batch_size: int = SQL_STREAM_BATCH_SIZE) -> AsyncIterator[SqlOutput]:
+        async with aclosing(self.data_engine.execute_sql_stream(sql, allow_mutations, batch_size)) as batches:
+            async for batch in batches:
+                yield batch
+
+    async def execute_sql_columnar(self, sql: str, allow_mutations: bool = False) -> ColumnarSqlOutput:
+        return await self.data_engine.execute_sql_columnar(sql, allow_mutations)
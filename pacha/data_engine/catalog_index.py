@@ -0,0 +1,143 @@
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Optional
+from pacha.data_engine.catalog import Catalog, Table
+import math
+import re
+
+# BM25 parameters
+K1 = 1.5
+B = 0.75
+
+# Table and schema names are the strongest relevance signal, so they are
+# counted these many times in a table's document.
+NAME_WEIGHT = 3
+
+# Stop words commonly found in user questions that would otherwise match
+# descriptions.
+STOP_WORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'by', 'do', 'for', 'from', 'get', 'give', 'has',
+    'have', 'how', 'i', 'in', 'is', 'it', 'list', 'me', 'my', 'of', 'on', 'or', 'show',
+    'that', 'the', 'their', 'them', 'this', 'to', 'was', 'we', 'were', 'what', 'when',
+    'where', 'which', 'who', 'with', 'you'
+}
+
+CAMEL_CASE_BOUNDARY = re.compile(r'([a-z0-9])([A-Z])')
+WORD = re.compile(r'[a-z0-9]+')
+
+TableKey = tuple[str, str]
+
+
+def stem(token: str) -> str:
+    # Deliberately naive plural folding. It is applied to both the catalog and
+    # the query, so it only needs to be consistent, not linguistically correct.
+    if len(token) > 4 and token.endswith('ies'):
+        return token[:-3] + 'y'
+    if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+        return token[:-1]
+    return token
+
+
+def tokenize(text: Optional[str]) -> list[str]:
+    if text is None:
+        return []
+    words = WORD.findall(CAMEL_CASE_BOUNDARY.sub(r'\1 \2', text).lower())
+    return [stem(word) for word in words if word not in STOP_WORDS]
+
+
+def table_tokens(schema_name: str, table: Table) -> list[str]:
+    tokens = (tokenize(schema_name) + tokenize(table.name)) * NAME_WEIGHT
+    tokens += tokenize(table.description)
+    for column in table.columns.values():
+        tokens += tokenize(column.name)
+        tokens += tokenize(column.description)
+    return tokens
+
+
+@dataclass
+class CatalogIndex:
+    """
+    Offline lexical (BM25) index over the tables of a catalog, used to render only
+    the tables relevant to a user query into prompts for large catalogs.
+    """
+    catalog: Catalog
+    table_keys: list[TableKey] = field(init=False)
+    # Map of token to (table index, term frequency)
+    postings: dict[str, list[tuple[int, int]]] = field(init=False)
+    document_lengths: list[int] = field(init=False)
+    average_document_length: float = field(init=False)
+    # Tables connected by a foreign key in either direction
+    neighbours: dict[TableKey, set[TableKey]] = field(init=False)
+
+    def __post_init__(self):
+        self.table_keys = []
+        self.postings = {}
+        self.document_lengths = []
+        self.neighbours = {}
+        for schema in self.catalog.schemas.values():
+            for table in schema.tables.values():
+                key = (schema.name, table.name)
+                tokens = table_tokens(schema.name, table)
+                for token, frequency in Counter(tokens).items():
+                    self.postings.setdefault(token, []).append(
+                        (len(self.table_keys), frequency))
+                self.table_keys.append(key)
+                self.document_lengths.append(len(tokens))
+                for foreign_key in table.foreign_keys:
+                    target = (foreign_key.target_schema,
+                              foreign_key.target_table)
+                    self.neighbours.setdefault(key, set()).add(target)
+                    self.neighbours.setdefault(target, set()).add(key)
+        # Ignore foreign keys to tables that aren't in the catalog
+        known_tables = set(self.table_keys)
+        for key, neighbours in self.neighbours.items():
+            neighbours.intersection_update(known_tables)
+        self.average_document_length = sum(
+            self.document_lengths) / max(len(self.document_lengths), 1)
+
+    def scores(self, query: str) -> dict[TableKey, float]:
+        scores: dict[int, float] = {}
+        table_count = len(self.table_keys)
+        for token in set(tokenize(query)):
+            postings = self.postings.get(token)
+            if postings is None:
+                continue
+            idf = math.log(1 + (table_count - len(postings) +
+                           0.5) / (len(postings) + 0.5))
+            for index, frequency in postings:
+                length_norm = 1 - B + B * \
+                    self.document_lengths[index] / \
+                    self.average_document_length
+                scores[index] = scores.get(
+                    index, 0) + idf * frequency * (K1 + 1) / (frequency + K1 * length_norm)
+        return {self.table_keys[index]: score for index, score in scores.items()}
+
+    def select_tables(self, query: str, top_k: int) -> list[TableKey]:
+        """
+        The `top_k` most relevant tables for the query, followed by up to `top_k`
+        more tables that are directly connected to them via foreign keys (so
+        that the joins between relevant tables are visible). If the query
+        matches no table, the most connected tables are used instead.
+        """
+        scores = self.scores(query)
+        if scores:
+            selected = sorted(scores, key=lambda key: scores[key], reverse=True)[
+                :top_k]
+        else:
+            selected = sorted(self.table_keys, key=lambda key: (
+                -len(self.neighbours.get(key, ())), key))[:top_k]
+        selected_set = set(selected)
+        candidates = {neighbour for key in selected for neighbour in self.neighbours.get(key, ())
+                      if neighbour not in selected_set}
+        expansion = sorted(candidates, key=lambda key: (
+            scores.get(key, 0), key), reverse=True)[:top_k]
+        return selected + expansion
+
+    def render_for_prompt(self, query: Optional[str], top_k: Optional[int]) -> str:
+        """
+        Render the tables relevant to `query`. Falls back to rendering the full
+        catalog if there is no query or the catalog is small enough.
+        """
+        if query is None or top_k is None or len(self.table_keys) <= top_k:
+            return self.catalog.render_for_prompt()
+        return self.catalog.render_tables_for_prompt(self.select_tables(query, top_k))
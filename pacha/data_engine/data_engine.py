@@ -1,32 +1,159 @@
-from dataclasses import dataclass
-from typing import Any, Callable, TypedDict
+from array import array
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Callable, Iterator, NotRequired, Optional, TypedDict
 from abc import ABC, abstractmethod
 from pacha.data_engine.catalog import Catalog
 
 SqlOutput = list[dict[str, Any]]
 
+# Default number of rows per batch yielded by DataEngine.execute_sql_stream
+SQL_STREAM_BATCH_SIZE = 1000
+
+
+# Values of a single column. Columns with only (non-bool) ints or floats are
+# compacted into typed arrays, everything else is a list.
+ColumnValues = list[Any] | array
+
+
+class ColumnarSqlOutputJson(TypedDict):
+    columns: list[str]
+    values: list[list[Any]]
+
+
+@dataclass
+class ColumnarSqlOutput:
+    """
+    Column oriented representation of a SQL result. Column names are stored once
+    rather than once per row, which makes it much cheaper to hold and serialize
+    wide results than the equivalent `SqlOutput`.
+    """
+    columns: list[str] = field(default_factory=list)
+    values: list[ColumnValues] = field(default_factory=list)
+    num_rows: int = 0
+
+    def __len__(self) -> int:
+        return self.num_rows
+
+    def append_rows(self, rows: SqlOutput):
+        if len(rows) == 0:
+            return
+        # Typed arrays can't hold None or values of other types, so compacted
+        # columns become lists again (until the next compact)
+        self.values = [values.tolist() if isinstance(values, array) else values
+                       for values in self.values]
+        indices = {column: index for index,
+                   column in enumerate(self.columns)}
+        for row in rows:
+            for column in row:
+                if column not in indices:
+                    # Rows seen so far didn't have this column
+                    indices[column] = len(self.columns)
+                    self.columns.append(column)
+                    self.values.append([None] * self.num_rows)
+            for column, values in zip(self.columns, self.values):
+                values.append(row.get(column))
+            self.num_rows += 1
+
+    def compact(self):
+        """Convert purely integer or floating point columns to typed arrays"""
+        for index, values in enumerate(self.values):
+            if isinstance(values, array) or len(values) == 0:
+                continue
+            value_types = set(map(type, values))
+            try:
+                if value_types == {int}:
+                    self.values[index] = array('q', values)
+                elif value_types == {float}:
+                    self.values[index] = array('d', values)
+            except OverflowError:
+                # Integers beyond 64 bits stay as a list
+                pass
+
+    def column(self, name: str) -> ColumnValues:
+        return self.values[self.columns.index(name)]
+
+    def iter_rows(self) -> Iterator[dict[str, Any]]:
+        for row_values in zip(*self.values):
+            yield dict(zip(self.columns, row_values))
+
+    def to_rows(self) -> SqlOutput:
+        return list(self.iter_rows())
+
+    def head(self, num_rows: int) -> SqlOutput:
+        """The first `num_rows` rows, without converting the rest"""
+        return [dict(zip(self.columns, row_values))
+                for row_values in zip(*(values[:num_rows] for values in self.values))]
+
+    def to_json(self) -> ColumnarSqlOutputJson:
+        return {
+            "columns": self.columns,
+            "values": [values.tolist() if isinstance(values, array) else values for values in self.values]
+        }
+
+    @classmethod
+    def from_json(cls, json_data: ColumnarSqlOutputJson) -> 'ColumnarSqlOutput':
+        values: list[ColumnValues] = list(json_data['values'])
+        return cls(
+            columns=json_data['columns'],
+            values=values,
+            num_rows=len(values[0]) if len(values) > 0 else 0
+        )
+
+    @classmethod
+    def from_rows(cls, rows: SqlOutput) -> 'ColumnarSqlOutput':
+        output = cls()
+        output.append_rows(rows)
+        output.compact()
+        return output
+
 
 class SqlStatementJson(TypedDict):
     sql: str
     result: SqlOutput
+    row_count: NotRequired[Optional[int]]
+    result_bytes: NotRequired[Optional[int]]
+    latency_secs: NotRequired[Optional[float]]
+    error: NotRequired[Optional[str]]
 
 
 @dataclass
 class SqlStatement:
     sql: str
+    # May only be a sample of the rows of the result, see row_count
     result: SqlOutput
+    # Number of rows of the full result
+    row_count: Optional[int] = None
+    # Approximate size of the full result as JSON
+    result_bytes: Optional[int] = None
+    # Time from issuing the SQL to receiving the last row
+    latency_secs: Optional[float] = None
+    # Set if the SQL failed or its result wasn't read in full
+    error: Optional[str] = None
 
     def to_json(self) -> SqlStatementJson:
         return {
             "sql": self.sql,
-            "result": self.result
+            "result": self.result,
+            "row_count": self.row_count,
+            "result_bytes": self.result_bytes,
+            "latency_secs": self.latency_secs,
+            "error": self.error
         }
 
+    @classmethod
+    def from_columnar(cls, sql: str, output: ColumnarSqlOutput, sample_rows: int) -> 'SqlStatement':
+        """Statement for a columnar result, with only its first `sample_rows` rows as row dicts"""
+        return cls(sql=sql, result=output.head(sample_rows), row_count=len(output))
+
     @classmethod
     def from_json(cls, json_data: SqlStatementJson) -> 'SqlStatement':
         return cls(
             sql=json_data['sql'],
-            result=json_data['result']
+            result=json_data['result'],
+            row_count=json_data.get('row_count'),
+            result_bytes=json_data.get('result_bytes'),
+            latency_secs=json_data.get('latency_secs'),
+            error=json_data.get('error')
         )
 
 
@@ -48,3 +175,45 @@ class DataEngine(ABC):
     @abstractmethod
     async def execute_sql(self, sql: str, allow_mutations: bool = False) -> SqlOutput:
         ...
+
+    async def get_catalog_fingerprint(self) -> Optional[str]:
+        """
+        Return a value that changes whenever anything the catalog is built from
+        changes, and which is cheaper to compute than `get_catalog`. Returns None
+        if the engine can't compute one.
+        """
+        return None
+
+    async def get_catalog_if_changed(self, fingerprint: Optional[str]) -> tuple[Optional[Catalog], Optional[str]]:
+        """
+        Return the catalog, or None if the catalog fingerprint is still
+        `fingerprint`, along with the current fingerprint. Engines that compute
+        the fingerprint from the same data as the catalog should override this
+        to fetch that data only once.
+        """
+        current_fingerprint = await self.get_catalog_fingerprint()
+        if fingerprint is not None and current_fingerprint == fingerprint:
+            return None, current_fingerprint
+        return await self.get_catalog(), current_fingerprint
+
+    async def execute_sql_stream(self, sql: str, allow_mutations: bool = False, batch_size: int = SQL_STREAM_BATCH_SIZE) -> AsyncIterator[SqlOutput]:
+        """
+        Execute SQL and yield the resulting rows in batches of at most `batch_size` rows.
+        Engines that can decode their responses incrementally should override this;
+        the default implementation batches the fully buffered result of `execute_sql`.
+        """
+        result = await self.execute_sql(sql, allow_mutations)
+        for start in range(0, len(result), batch_size):
+            yield result[start:start + batch_size]
+
+    async def execute_sql_columnar(self, sql: str, allow_mutations: bool = False) -> ColumnarSqlOutput:
+        """
+        Execute SQL and return the result in columnar form. Rows are folded into
+        columns batch by batch, so the full row oriented result is never held.
+        Use `ColumnarSqlOutput.to_rows` or `iter_rows` where row dicts are needed.
+        """
+        output = ColumnarSqlOutput()
+        async for batch in self.execute_sql_stream(sql, allow_mutations):
+            output.append_rows(batch)
+        output.compact()
+        return output
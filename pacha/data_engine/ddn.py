@@ -1,9 +1,20 @@
 from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, NoReturn, Optional
 
 from pacha.data_engine.catalog import Argument, Column, Function, ScalarType, Catalog, Schema, Table, ForeignKey, ForeignKeyMapping, TypeReference
 from pacha.data_engine import DataEngine, SqlOutput
-import requests
+from pacha.data_engine.data_engine import SQL_STREAM_BATCH_SIZE
+from pacha.data_engine.json_stream import JsonArrayStreamParser
+import httpx
 import asyncio
+import hashlib
+import json
+
+try:
+    # Only needed for HTTP/2 (the `http2` extra)
+    import h2
+except ImportError:
+    h2 = None
 
 TABLES_QUERY = '''
 SELECT t.schema_name, 
@@ -70,6 +81,18 @@ JOIN hasura.struct_type_field f
 ON f.struct_type_name = tvf.return_type
 '''
 
+# Every query that the catalog is built from, in the order of the arguments of
+# create_schema_from_introspection
+INTROSPECTION_QUERIES = [TABLES_QUERY, COLUMNS_QUERY, FOREIGN_KEYS_QUERY, TABLE_VALUED_FUNCTIONS_QUERY,
+                         TABLE_VALUED_FUNCTION_ARGUMENTS_QUERY, TABLE_VALUED_FUNCTION_FIELDS_QUERY]
+
+# Defaults for the pooled HTTP transport used to talk to the DDN SQL endpoint.
+MAX_CONNECTIONS = 20
+MAX_KEEPALIVE_CONNECTIONS = 10
+KEEPALIVE_EXPIRY_SECS = 30.0
+CONNECT_TIMEOUT_SECS = 5.0
+READ_TIMEOUT_SECS = 60.0
+
 
 @dataclass
 class DdnDataEngineException(Exception):
@@ -77,6 +100,15 @@ class DdnDataEngineException(Exception):
         super().__init__(message)
 
 
+def raise_for_response_json(response_json: Any) -> NoReturn:
+    if isinstance(response_json, dict):
+        error = response_json.get("error")
+        if error is not None:
+            raise DdnDataEngineException(error)
+    raise DdnDataEngineException(
+        f"malformed DDN response: {response_json}")
+
+
 def map_data_type(data_type: str) -> ScalarType | str:
     data_type_lower = data_type.lower()
     if data_type_lower.startswith("int"):
@@ -122,17 +154,24 @@ def create_schema_from_introspection(
         )
         table.columns[column.name] = column
 
+    # Foreign keys keyed by (source schema, source table, target schema, target table),
+    # so that multi-column foreign keys are grouped without scanning the
+    # existing foreign keys of the table for every introspected row.
+    foreign_keys: dict[tuple[str, str, str, str], ForeignKey] = {}
     for foreign_key_data in foreign_keys_data:
-        source_table = schemas[foreign_key_data["from_schema_name"]
-                               ].tables[foreign_key_data["from_table_name"]]
+        source_schema_name = foreign_key_data["from_schema_name"]
+        source_table_name = foreign_key_data["from_table_name"]
         target_schema_name = foreign_key_data["to_schema_name"]
         target_table_name = foreign_key_data["to_table_name"]
-        foreign_key = next((foreign_key for foreign_key in source_table.foreign_keys if foreign_key.target_schema ==
-                           target_schema_name and foreign_key.target_table == target_table_name), None)
+        key = (source_schema_name, source_table_name,
+               target_schema_name, target_table_name)
+        foreign_key = foreign_keys.get(key)
         if foreign_key is None:
             foreign_key = ForeignKey(
                 target_schema=target_schema_name, target_table=target_table_name)
-            source_table.foreign_keys.append(foreign_key)
+            foreign_keys[key] = foreign_key
+            schemas[source_schema_name].tables[source_table_name].foreign_keys.append(
+                foreign_key)
         foreign_key.mapping.append(ForeignKeyMapping(
             source_column=foreign_key_data["from_column_name"], target_column=foreign_key_data["to_column_name"]))
 
@@ -156,36 +195,110 @@ def create_schema_from_introspection(
     return Catalog(schemas=schemas, functions=functions)
 
 
+def get_introspection_fingerprint(introspection: list[SqlOutput]) -> str:
+    # Hashes all the rows the catalog is built from, since changes to any of
+    # them (eg: a column's type or description) change the catalog
+    fingerprint_data = json.dumps(introspection, sort_keys=True)
+    return hashlib.sha256(fingerprint_data.encode()).hexdigest()
+
+
 @dataclass
 class DdnDataEngine(DataEngine):
     url: str
     headers: dict[str, str] = field(default_factory=dict)
+    # Limits for the shared keep-alive connection pool. DdnDataEngine only
+    # ever talks to a single host, so these are effectively per-host limits.
+    max_connections: int = MAX_CONNECTIONS
+    max_keepalive_connections: int = MAX_KEEPALIVE_CONNECTIONS
+    connect_timeout: float = CONNECT_TIMEOUT_SECS
+    read_timeout: float = READ_TIMEOUT_SECS
+    # Requires the optional `h2` package (the `http2` extra)
+    http2: bool = False
+    _client: Optional[httpx.AsyncClient] = field(
+        default=None, init=False, repr=False)
+    _client_loop: Optional[asyncio.AbstractEventLoop] = field(
+        default=None, init=False, repr=False)
+
+    def __post_init__(self):
+        if self.http2 and h2 is None:
+            raise DdnDataEngineException(
+                "HTTP/2 requires the h2 package, install pacha with the http2 extra")
+
+    def _get_client(self) -> httpx.AsyncClient:
+        # Pooled connections are bound to the event loop that opened them, and
+        # the engine may be used from more than one loop (eg: catalog
+        # introspection during setup and then the server's loop).
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client.is_closed or self._client_loop is not loop:
+            self._client = httpx.AsyncClient(
+                http2=self.http2,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_keepalive_connections,
+                    keepalive_expiry=KEEPALIVE_EXPIRY_SECS),
+                timeout=httpx.Timeout(
+                    self.read_timeout, connect=self.connect_timeout))
+            self._client_loop = loop
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._client_loop = None
 
     async def get_catalog(self) -> Catalog:
-        tables_data, columns_data, foreign_keys_data, table_valued_functions_data, table_valued_function_arguments_data, table_valued_function_fields_data, = await asyncio.gather(
-            self.execute_sql(TABLES_QUERY),
-            self.execute_sql(COLUMNS_QUERY),
-            self.execute_sql(FOREIGN_KEYS_QUERY),
-            self.execute_sql(TABLE_VALUED_FUNCTIONS_QUERY),
-            self.execute_sql(TABLE_VALUED_FUNCTION_ARGUMENTS_QUERY),
-            self.execute_sql(TABLE_VALUED_FUNCTION_FIELDS_QUERY))
-        catalog = create_schema_from_introspection(tables_data, columns_data, foreign_keys_data,
-                                                   table_valued_functions_data, table_valued_function_arguments_data, table_valued_function_fields_data)
-
-        return catalog
+        return create_schema_from_introspection(*await self.get_introspection())
+
+    async def get_catalog_fingerprint(self) -> Optional[str]:
+        return get_introspection_fingerprint(await self.get_introspection())
+
+    async def get_catalog_if_changed(self, fingerprint: Optional[str]) -> tuple[Optional[Catalog], Optional[str]]:
+        # The fingerprint needs all the introspection rows, so the catalog is
+        # built from the same rows rather than introspecting again
+        introspection = await self.get_introspection()
+        current_fingerprint = get_introspection_fingerprint(introspection)
+        if fingerprint is not None and current_fingerprint == fingerprint:
+            return None, current_fingerprint
+        return create_schema_from_introspection(*introspection), current_fingerprint
+
+    async def get_introspection(self) -> list[SqlOutput]:
+        return list(await asyncio.gather(*(self.execute_sql(query) for query in INTROSPECTION_QUERIES)))
 
     async def execute_sql(self, sql: str, allow_mutations: bool = False) -> SqlOutput:
-        headers = {"Content-type": "application/json"} | self.headers
-        data = {"sql": sql, "disallowMutations": not allow_mutations}
-        response = requests.post(self.url, json=data, headers=headers)
-        if response.headers["content-length"] == "0":
+        try:
+            response = await self._get_client().post(self.url, json=self._request_body(sql, allow_mutations), headers=self._request_headers())
+        except httpx.TimeoutException as e:
+            raise DdnDataEngineException(f"DDN request timed out: {e}")
+        if len(response.content) == 0:
             return []
         response_json = response.json()
         if isinstance(response_json, list):
             return response_json
-        if isinstance(response_json, dict):
-            error = response_json.get("error")
-            if error is not None:
-                raise DdnDataEngineException(error)
-        raise DdnDataEngineException(
-            f"malformed DDN response: {response_json}")
+        raise_for_response_json(response_json)
+
+    async def execute_sql_stream(self, sql: str, allow_mutations: bool = False, batch_size: int = SQL_STREAM_BATCH_SIZE) -> AsyncIterator[SqlOutput]:
+        parser = JsonArrayStreamParser()
+        batch: SqlOutput = []
+        try:
+            async with self._get_client().stream("POST", self.url, json=self._request_body(sql, allow_mutations), headers=self._request_headers()) as response:
+                async for text in response.aiter_text():
+                    for row in parser.feed(text):
+                        batch.append(row)
+                        if len(batch) >= batch_size:
+                            yield batch
+                            batch = []
+        except httpx.TimeoutException as e:
+            raise DdnDataEngineException(f"DDN request timed out: {e}")
+        parser.finish()
+        if parser.is_array:
+            if len(batch) > 0:
+                yield batch
+        elif parser.started:
+            raise_for_response_json(parser.document)
+
+    def _request_headers(self) -> dict[str, str]:
+        return {"Content-type": "application/json"} | self.headers
+
+    def _request_body(self, sql: str, allow_mutations: bool) -> dict[str, Any]:
+        return {"sql": sql, "disallowMutations": not allow_mutations}
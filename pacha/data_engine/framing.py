@@ -0,0 +1,81 @@
+from dataclasses import dataclass
+from typing import Optional, TypeVar
+from pydantic import BaseModel
+import zlib
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+M = TypeVar('M', bound=BaseModel)
+
+# Encodings of the messages exchanged with the Python runtime
+JSON = "json"
+MSGPACK = "msgpack"
+
+# Compressions of the messages exchanged with the Python runtime
+ZLIB = "zlib"
+
+# Smaller payloads aren't worth the CPU time to compress
+COMPRESSION_THRESHOLD_BYTES = 16 * 1024
+# Fast compression, since large payloads are mostly repetitive JSON/msgpack
+COMPRESSION_LEVEL = 1
+
+# Binary frames start with a byte of these flags, followed by the payload.
+# Text frames are always uncompressed JSON.
+FLAG_MSGPACK = 0x01
+FLAG_ZLIB = 0x02
+
+
+def supported_encodings() -> list[str]:
+    """Encodings supported by this client, in order of preference"""
+    if msgpack is None:
+        return [JSON]
+    return [MSGPACK, JSON]
+
+
+def supported_compressions() -> list[str]:
+    return [ZLIB]
+
+
+@dataclass
+class Framing:
+    """
+    How messages are encoded on a websocket connection to the Python runtime.
+    Starts out as plain JSON text frames, and is switched to the encoding and
+    compression the runtime acknowledges during the hello exchange.
+    """
+    encoding: str = JSON
+    compression: Optional[str] = None
+    compression_threshold: int = COMPRESSION_THRESHOLD_BYTES
+
+    def encode(self, message: BaseModel) -> str | bytes:
+        if self.encoding == JSON and self.compression is None:
+            return message.model_dump_json()
+        if self.encoding == MSGPACK:
+            payload = msgpack.packb(message.model_dump(mode='json'))
+            flags = FLAG_MSGPACK
+        else:
+            payload = message.model_dump_json().encode()
+            flags = 0
+        if self.compression == ZLIB and len(payload) >= self.compression_threshold:
+            payload = zlib.compress(payload, COMPRESSION_LEVEL)
+            flags |= FLAG_ZLIB
+        return bytes([flags]) + payload
+
+
+def decode_frame(frame: str | bytes, model: type[M]) -> M:
+    """Decode a text or binary frame, regardless of the negotiated framing"""
+    if isinstance(frame, str):
+        return model.model_validate_json(frame)
+    flags = frame[0]
+    payload = frame[1:]
+    if flags & FLAG_ZLIB:
+        payload = zlib.decompress(payload)
+    if flags & FLAG_MSGPACK:
+        if msgpack is None:
+            raise ValueError(
+                "Received a msgpack message, but msgpack is not installed")
+        return model.model_validate(msgpack.unpackb(payload))
+    return model.model_validate_json(payload)
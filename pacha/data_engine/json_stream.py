@@ -0,0 +1,80 @@
+import json
+from typing import Any
+
+WHITESPACE = ' \t\n\r'
+# Characters skipped between array elements.
+SEPARATORS = WHITESPACE + ','
+ELEMENT_DELIMITERS = SEPARATORS + ']'
+
+
+class JsonArrayStreamParser:
+    """
+    Incrementally decodes a top level JSON array, yielding its elements as soon
+    as they have been fully received. Any other top level document (eg: an error
+    object) is buffered and made available as `document` once `finish` is called.
+    """
+
+    def __init__(self):
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.started = False
+        self.is_array = False
+        self.finished = False
+        self.document: Any = None
+
+    def feed(self, text: str) -> list[Any]:
+        self.buffer += text
+        if not self.started:
+            stripped = self.buffer.lstrip(WHITESPACE)
+            if len(stripped) == 0:
+                self.buffer = ""
+                return []
+            self.started = True
+            self.is_array = stripped[0] == '['
+            self.buffer = stripped[1:] if self.is_array else stripped
+        if not self.is_array or self.finished:
+            return []
+        return self.decode_elements(final=False)
+
+    def finish(self):
+        if self.is_array:
+            if not self.finished:
+                self.decode_elements(final=True)
+            if not self.finished:
+                raise json.JSONDecodeError(
+                    "Unterminated JSON array", self.buffer, len(self.buffer))
+        elif self.started:
+            self.document = json.loads(self.buffer)
+            self.buffer = ""
+
+    def decode_elements(self, final: bool) -> list[Any]:
+        elements = []
+        position = 0
+        length = len(self.buffer)
+        while True:
+            while position < length and self.buffer[position] in SEPARATORS:
+                position += 1
+            if position >= length:
+                break
+            if self.buffer[position] == ']':
+                self.finished = True
+                position += 1
+                break
+            try:
+                element, end = self.decoder.raw_decode(self.buffer, position)
+            except json.JSONDecodeError:
+                if final:
+                    raise
+                # The element has not been fully received yet.
+                break
+            # A scalar (eg: a number) may have only been partially received, so
+            # only accept an element once the following delimiter is seen.
+            if end >= length or self.buffer[end] not in ELEMENT_DELIMITERS:
+                if final:
+                    raise json.JSONDecodeError(
+                        "Expecting ',' delimiter", self.buffer, end)
+                break
+            elements.append(element)
+            position = end
+        self.buffer = self.buffer[position:]
+        return elements
@@ -0,0 +1,326 @@
+from collections import deque
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Optional
+from pacha.data_engine import local_runtime_worker
+from pacha.data_engine.local_runtime_worker import DEFAULT_PRELOAD_MODULES, FRAME_BINARY, FRAME_END, FRAME_HEADER, FRAME_TEXT
+from pacha.error import PachaException
+from pacha.utils.logging import get_logger
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+DEFAULT_WORKERS = 2
+# Workers are replaced after these many executions, so that state leaked by
+# executions (eg: modules imported, memory fragmentation) doesn't accumulate
+DEFAULT_MAX_TASKS_PER_WORKER = 100
+# When an execution ends without the worker signalling its end (eg: after an
+# error, or when a request from the code failed), the worker is given this long
+# to finish before it is killed rather than reused
+DRAIN_TIMEOUT_SECS = 0.1
+# The only environment variables passed on to workers, so that the executed code
+# can't read secrets from the environment (eg: API keys)
+INHERITED_ENV_VARS = ['PATH', 'LANG', 'LC_ALL', 'TZ']
+
+
+def kill(process: asyncio.subprocess.Process):
+    if process.returncode is None:
+        try:
+            process.kill()
+        except ProcessLookupError:
+            # Already exited, or its transport was closed (which kills it)
+            pass
+
+
+@dataclass
+class LocalWorker:
+    process: asyncio.subprocess.Process
+    # Number of executions by the worker so far
+    tasks: int = 0
+    # Peak resident memory of the worker, as of its last execution
+    max_rss_bytes: int = 0
+
+
+@dataclass
+class LocalRuntimeConnection:
+    """
+    Connection to a local worker process for a single execution, used in place
+    of a websocket connection to the remote Python runtime
+    """
+    worker: LocalWorker
+    runtime: 'LocalRuntime'
+    # Set once the worker has signalled the end of the execution
+    ended: bool = False
+
+    async def send(self, frame: str | bytes):
+        stdin = self.worker.process.stdin
+        assert stdin is not None
+        if isinstance(frame, str):
+            payload, kind = frame.encode(), FRAME_TEXT
+        else:
+            payload, kind = frame, FRAME_BINARY
+        stdin.write(FRAME_HEADER.pack(len(payload), kind) + payload)
+        try:
+            await stdin.drain()
+        except ConnectionResetError:
+            raise PachaException("Local Python worker exited unexpectedly")
+
+    def __aiter__(self) -> AsyncIterator[str | bytes]:
+        return self.frames()
+
+    async def frames(self) -> AsyncIterator[str | bytes]:
+        while True:
+            frame = await self.read_frame()
+            if frame is None:
+                return
+            yield frame
+
+    async def read_frame(self) -> Optional[str | bytes]:
+        stdout = self.worker.process.stdout
+        assert stdout is not None
+        try:
+            header = await stdout.readexactly(FRAME_HEADER.size)
+            size, kind = FRAME_HEADER.unpack(header)
+            payload = await stdout.readexactly(size)
+        except asyncio.IncompleteReadError:
+            raise PachaException("Local Python worker exited unexpectedly")
+        if kind == FRAME_END:
+            self.ended = True
+            self.worker.max_rss_bytes = json.loads(payload)['max_rss_bytes']
+            return None
+        return payload.decode() if kind == FRAME_TEXT else payload
+
+    async def close(self):
+        if not self.ended:
+            try:
+                await asyncio.wait_for(self.drain(), DRAIN_TIMEOUT_SECS)
+            except (TimeoutError, PachaException):
+                pass
+        self.runtime.release(self.worker, reusable=self.ended)
+
+    async def drain(self):
+        async for _ in self.frames():
+            pass
+
+
+@dataclass
+class LocalRuntime:
+    """
+    Executes Python code in local worker processes instead of the remote Python
+    runtime, so that requests from the code (eg: run_sql) don't need network round
+    trips. Up to `size` idle workers are started ahead of time, with commonly used
+    modules already imported, and are reused across executions. At most
+    `max_workers` executions run at a time, and further executions wait in a queue.
+
+    Workers are limited to `max_memory_bytes` of address space and each execution
+    to `max_cpu_secs` of CPU time. Workers are replaced after
+    `max_tasks_per_worker` executions, or once their resident memory has exceeded
+    `max_rss_bytes`. Workers run isolated from Pacha's environment variables,
+    working directory and Python path, in a temporary directory. They are still
+    not a complete sandbox: the code runs as the same user as Pacha.
+    """
+    size: int = DEFAULT_WORKERS
+    max_workers: Optional[int] = None
+    max_tasks_per_worker: Optional[int] = DEFAULT_MAX_TASKS_PER_WORKER
+    max_memory_bytes: Optional[int] = None
+    max_rss_bytes: Optional[int] = None
+    max_cpu_secs: Optional[float] = None
+    preload_modules: list[str] = field(
+        default_factory=lambda: list(DEFAULT_PRELOAD_MODULES))
+    # Metrics, for sizing the pool
+    executions: int = 0
+    # Executions that had to wait for another execution to finish
+    queued_executions: int = 0
+    queue_wait_secs: float = 0.0
+    max_queue_wait_secs: float = 0.0
+    recycled_workers: int = 0
+    waiting: int = field(default=0, init=False)
+    busy: int = field(default=0, init=False)
+    idle: deque[LocalWorker] = field(
+        default_factory=deque, init=False, repr=False)
+    # Limits concurrent executions to max_workers
+    slots: Optional[asyncio.Semaphore] = field(
+        default=None, init=False, repr=False)
+    background_tasks: set[asyncio.Task] = field(
+        default_factory=set, init=False, repr=False)
+    starting: int = field(default=0, init=False, repr=False)
+    # Every worker process that hasn't been reaped yet, whether idle, starting or busy
+    processes: set[asyncio.subprocess.Process] = field(
+        default_factory=set, init=False, repr=False)
+    closed: bool = field(default=False, init=False, repr=False)
+    # Worker processes are bound to the event loop that started them
+    loop: Optional[asyncio.AbstractEventLoop] = field(
+        default=None, init=False, repr=False)
+    # Working directory of the workers
+    directory: Optional[tempfile.TemporaryDirectory] = field(
+        default=None, init=False, repr=False)
+
+    async def acquire(self) -> LocalRuntimeConnection:
+        """Get a worker for a single execution. The caller must close the connection."""
+        if self.closed:
+            raise PachaException("Local Python runtime is closed")
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            # Workers of another loop can't be used or awaited from this one, so
+            # they are killed and left to be reaped by their own loop
+            for task in self.background_tasks:
+                task.cancel()
+            self.background_tasks.clear()
+            for process in self.processes:
+                kill(process)
+            self.processes.clear()
+            self.idle.clear()
+            self.starting = 0
+            self.busy = 0
+            self.waiting = 0
+            self.slots = None if self.max_workers is None else asyncio.Semaphore(
+                self.max_workers)
+            self.loop = loop
+
+        if self.slots is not None:
+            if self.slots.locked():
+                self.queued_executions += 1
+            queued_at = time.monotonic()
+            self.waiting += 1
+            try:
+                await self.slots.acquire()
+            finally:
+                self.waiting -= 1
+            wait_secs = time.monotonic() - queued_at
+            self.queue_wait_secs += wait_secs
+            self.max_queue_wait_secs = max(
+                self.max_queue_wait_secs, wait_secs)
+
+        try:
+            worker = None
+            while len(self.idle) > 0 and worker is None:
+                worker = self.idle.popleft()
+                if worker.process.returncode is not None:
+                    worker = None
+            if worker is None:
+                worker = LocalWorker(process=await self.start_worker())
+        except BaseException:
+            if self.slots is not None:
+                self.slots.release()
+            raise
+        finally:
+            self.replenish()
+        self.busy += 1
+        self.executions += 1
+        return LocalRuntimeConnection(worker=worker, runtime=self)
+
+    def release(self, worker: LocalWorker, reusable: bool):
+        self.busy -= 1
+        if self.slots is not None:
+            self.slots.release()
+        worker.tasks += 1
+        recycle = (self.max_tasks_per_worker is not None and worker.tasks >= self.max_tasks_per_worker) or \
+            (self.max_rss_bytes is not None and worker.max_rss_bytes > self.max_rss_bytes)
+        if reusable and not recycle and worker.process.returncode is None and len(self.idle) < self.size:
+            self.idle.append(worker)
+            return
+        if recycle:
+            self.recycled_workers += 1
+        self.stop_worker(worker.process)
+        # Replace the worker ahead of the next execution
+        self.replenish()
+
+    def get_stats(self) -> dict[str, int | float]:
+        return {
+            "idle": len(self.idle),
+            "busy": self.busy,
+            "waiting": self.waiting,
+            "executions": self.executions,
+            "queued_executions": self.queued_executions,
+            "average_queue_wait_secs": self.queue_wait_secs / self.executions if self.executions > 0 else 0.0,
+            "max_queue_wait_secs": self.max_queue_wait_secs,
+            "recycled_workers": self.recycled_workers
+        }
+
+    async def start_worker(self) -> asyncio.subprocess.Process:
+        # Isolated mode ignores PYTHON* environment variables and the user's site
+        # packages, and doesn't add the current directory to the Python path
+        args = [sys.executable, '-I', local_runtime_worker.__file__]
+        if self.max_memory_bytes is not None:
+            args += ['--max-memory-bytes', str(self.max_memory_bytes)]
+        if self.max_cpu_secs is not None:
+            args += ['--max-cpu-secs', str(self.max_cpu_secs)]
+        for module in self.preload_modules:
+            args += ['--preload', module]
+        if self.directory is None:
+            self.directory = tempfile.TemporaryDirectory(
+                prefix='pacha-local-runtime-')
+        env = {name: os.environ[name]
+               for name in INHERITED_ENV_VARS if name in os.environ}
+        env |= {'HOME': self.directory.name, 'TMPDIR': self.directory.name}
+        process = await asyncio.create_subprocess_exec(
+            *args, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, env=env, cwd=self.directory.name)
+        self.processes.add(process)
+        # Workers signal that they are ready once the modules are imported
+        assert process.stdout is not None
+        try:
+            size, kind = FRAME_HEADER.unpack(await process.stdout.readexactly(FRAME_HEADER.size))
+            await process.stdout.readexactly(size)
+        except asyncio.IncompleteReadError:
+            await self.reap(process)
+            raise PachaException(
+                f"Local Python worker exited on startup with code {process.returncode}")
+        if kind != FRAME_END:
+            self.stop_worker(process)
+            raise PachaException("Local Python worker failed to start")
+        return process
+
+    def stop_worker(self, process: asyncio.subprocess.Process):
+        kill(process)
+        self.spawn(self.reap(process))
+
+    async def reap(self, process: asyncio.subprocess.Process):
+        await process.wait()
+        self.processes.discard(process)
+
+    def replenish(self):
+        if self.closed:
+            return
+        for _ in range(self.size - len(self.idle) - self.starting):
+            self.starting += 1
+            self.spawn(self.add_idle_worker())
+
+    async def add_idle_worker(self):
+        try:
+            process = await self.start_worker()
+        except Exception as e:
+            # Executions will start workers on demand, and the pool is
+            # replenished again on the next acquire
+            get_logger().warning(f"Failed to start a local Python worker: {e}")
+            return
+        finally:
+            self.starting -= 1
+        if not self.closed and len(self.idle) < self.size:
+            self.idle.append(LocalWorker(process=process))
+        else:
+            # Enough workers were released back to the pool in the meantime
+            self.stop_worker(process)
+
+    def spawn(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+
+    async def close(self):
+        """Kill all the workers, including those of running executions"""
+        self.closed = True
+        tasks = list(self.background_tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.idle.clear()
+        processes = list(self.processes)
+        for process in processes:
+            kill(process)
+        await asyncio.gather(*(process.wait() for process in processes))
+        self.processes.clear()
+        if self.directory is not None:
+            self.directory.cleanup()
+            self.directory = None
@@ -0,0 +1,206 @@
+"""
+Worker process of the local Python runtime (see local_runtime.py).
+
+Executes Python code sent by the client, speaking the same messages as the
+remote Python runtime, framed over stdin and stdout. Each execution starts with
+a hello message and ends with an end frame, after which the worker waits for
+the next execution. Only the standard library is imported here, so that
+workers start quickly.
+"""
+from typing import Any, BinaryIO, Optional
+import argparse
+import importlib
+import json
+import os
+import resource
+import signal
+import struct
+import sys
+import traceback
+
+# Frames are a header of the payload length and kind, followed by the payload
+FRAME_HEADER = struct.Struct('>IB')
+FRAME_TEXT = 0
+FRAME_BINARY = 1
+# Sent by the worker once it is ready and after each execution, with a JSON
+# payload of the worker's resource usage
+FRAME_END = 2
+
+DEFAULT_PRELOAD_MODULES = ['collections', 'datetime',
+                           'itertools', 'json', 'math', 're', 'statistics']
+
+# Printed text is sent once this much has been buffered, or before any other message
+PRINT_BUFFER_CHARS = 64 * 1024
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+class CpuTimeExceeded(Exception):
+    pass
+
+
+class Channel:
+    def __init__(self, input: BinaryIO, output: BinaryIO):
+        self.input = input
+        self.output = output
+        # Consecutive prints are coalesced into a single message
+        self.prints: list[str] = []
+        self.print_chars = 0
+
+    def read(self) -> Optional[dict[str, Any]]:
+        header = self.input.read(FRAME_HEADER.size)
+        if len(header) < FRAME_HEADER.size:
+            return None
+        size, kind = FRAME_HEADER.unpack(header)
+        payload = self.input.read(size)
+        if len(payload) < size:
+            return None
+        if kind != FRAME_TEXT:
+            # The worker only acknowledges JSON text framing
+            raise ValueError(f"Unexpected frame kind {kind}")
+        return json.loads(payload)
+
+    def write(self, message: dict[str, Any]):
+        self.flush_prints()
+        payload = json.dumps(message, default=str).encode()
+        self.write_frame(FRAME_TEXT, payload)
+
+    def print(self, text: str):
+        self.prints.append(text)
+        self.print_chars += len(text)
+        if self.print_chars >= PRINT_BUFFER_CHARS:
+            self.flush_prints()
+
+    def flush_prints(self):
+        if len(self.prints) > 0:
+            text = '\n'.join(self.prints)
+            self.prints = []
+            self.print_chars = 0
+            self.write({"type": "print", "text": text})
+
+    def end(self):
+        self.flush_prints()
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        # ru_maxrss is in kilobytes on Linux, and in bytes on macOS
+        max_rss_bytes = usage.ru_maxrss if sys.platform == 'darwin' else usage.ru_maxrss * 1024
+        self.write_frame(FRAME_END, json.dumps(
+            {"max_rss_bytes": max_rss_bytes}).encode())
+
+    def write_frame(self, kind: int, payload: bytes):
+        self.output.write(FRAME_HEADER.pack(len(payload), kind) + payload)
+        self.output.flush()
+
+
+class Executor:
+    """The `executor` available to the executed code"""
+
+    def __init__(self, channel: Channel):
+        self._channel = channel
+        self._msg_id = 0
+
+    def _request(self, message: dict[str, Any], result_field: str) -> Any:
+        self._msg_id += 1
+        self._channel.write(message | {"msg_id": self._msg_id})
+        while True:
+            response = self._channel.read()
+            if response is None:
+                raise ClientDisconnected()
+            if response.get("orig_msg_id") == self._msg_id:
+                return response[result_field]
+
+    def print(self, text: Any):
+        self._channel.print(str(text))
+
+    def store_artifact(self, identifier: str, title: str, artifact_type: str, data: Any):
+        self._channel.write({"type": "store_artifact", "identifier": identifier,
+                            "title": title, "artifact_type": artifact_type, "data": data})
+
+    def get_artifact(self, identifier: str) -> Any:
+        return self._request({"type": "get_artifact", "identifier": identifier}, "contents")
+
+    def run_sql(self, sql: str) -> list[dict[str, Any]]:
+        return self._request({"type": "run_sql", "sql": sql}, "data")
+
+    def classify(self, instructions: str, inputs_to_classify: list[str], categories: list[str], allow_multiple: bool) -> list[str | list[str]]:
+        return self._request({"type": "classify", "instructions": instructions, "inputs_to_classify": inputs_to_classify,
+                              "categories": categories, "allow_multiple": allow_multiple}, "results")
+
+    def summarize(self, instructions: str, input: str) -> str:
+        return self._request({"type": "summarize", "instructions": instructions, "input": input}, "summary")
+
+    def column_stats(self, identifier: str, columns: list[str], group_by: list[str] = [], aggregates: Optional[list[str]] = None,
+                     percentiles: list[float] = [], histogram_bins: int = 0) -> list[dict[str, Any]]:
+        return self._request({"type": "column_stats", "identifier": identifier, "columns": columns, "group_by": group_by,
+                              "aggregates": aggregates, "percentiles": percentiles, "histogram_bins": histogram_bins}, "stats")
+
+
+def on_cpu_time_exceeded(signum, frame):
+    raise CpuTimeExceeded("CPU time limit exceeded")
+
+
+def limit_cpu_time(max_cpu_secs: Optional[float]):
+    """Limit the CPU time of the next execution, on top of what the worker has used so far"""
+    if max_cpu_secs is None:
+        return
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    used = usage.ru_utime + usage.ru_stime
+    resource.setrlimit(resource.RLIMIT_CPU, (int(
+        used + max_cpu_secs) + 1, resource.RLIM_INFINITY))
+
+
+def execute(channel: Channel, code: str, max_cpu_secs: Optional[float]):
+    executor = Executor(channel)
+    try:
+        limit_cpu_time(max_cpu_secs)
+        exec(compile(code, '<python_code>', 'exec'),
+             {'__name__': '__main__', 'executor': executor})
+    except ClientDisconnected:
+        raise
+    except BaseException:
+        # Including SystemExit, so that exit() in the code doesn't stop the worker
+        channel.write({"type": "error", "message": traceback.format_exc()})
+    finally:
+        if max_cpu_secs is not None:
+            resource.setrlimit(resource.RLIMIT_CPU,
+                               (resource.RLIM_INFINITY, resource.RLIM_INFINITY))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--max-memory-bytes', type=int)
+    parser.add_argument('--max-cpu-secs', type=float)
+    parser.add_argument('--preload', type=str, action='append',
+                        default=[], help='Module to import ahead of executions')
+    args = parser.parse_args()
+
+    if args.max_memory_bytes is not None:
+        resource.setrlimit(resource.RLIMIT_AS,
+                           (args.max_memory_bytes, args.max_memory_bytes))
+    signal.signal(signal.SIGXCPU, on_cpu_time_exceeded)
+    for module in args.preload:
+        importlib.import_module(module)
+
+    # Messages are exchanged over the original stdout, and anything the code
+    # prints to stdout goes to stderr instead
+    output = os.fdopen(os.dup(sys.stdout.fileno()), 'wb')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    channel = Channel(sys.stdin.buffer, output)
+    channel.end()
+
+    while True:
+        hello = channel.read()
+        if hello is None:
+            break
+        channel.write({"type": "hello_ack", "encoding": "json",
+                      "compression": None, "features": []})
+        try:
+            execute(channel, hello["python"], args.max_cpu_secs)
+        except ClientDisconnected:
+            break
+        channel.end()
+
+
+if __name__ == '__main__':
+    main()
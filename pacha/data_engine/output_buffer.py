@@ -0,0 +1,60 @@
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Optional
+
+
+@dataclass
+class OutputBuffer:
+    """
+    Text output collected in chunks, which keeps appends linear. Beyond
+    `max_chars`, only the first and last halves of the output are kept, with a
+    marker of how much was omitted in between.
+    """
+    max_chars: Optional[int] = None
+    head: list[str] = field(default_factory=list, init=False, repr=False)
+    head_chars: int = field(default=0, init=False)
+    tail: deque[str] = field(default_factory=deque, init=False, repr=False)
+    tail_chars: int = field(default=0, init=False)
+    omitted_chars: int = field(default=0, init=False)
+    # Joined output, until the next append
+    joined: Optional[str] = field(default=None, init=False, repr=False)
+
+    def append(self, text: str):
+        if len(text) == 0:
+            return
+        self.joined = None
+        if self.max_chars is None:
+            self.head.append(text)
+            self.head_chars += len(text)
+            return
+
+        head_room = self.max_chars // 2 - self.head_chars
+        if head_room > 0:
+            self.head.append(text[:head_room])
+            self.head_chars += min(len(text), head_room)
+            text = text[head_room:]
+            if len(text) == 0:
+                return
+
+        self.tail.append(text)
+        self.tail_chars += len(text)
+        excess = self.tail_chars - (self.max_chars - self.max_chars // 2)
+        while excess > 0:
+            first = self.tail[0]
+            if len(first) <= excess:
+                self.tail.popleft()
+                removed = len(first)
+            else:
+                self.tail[0] = first[excess:]
+                removed = excess
+            self.tail_chars -= removed
+            self.omitted_chars += removed
+            excess -= removed
+
+    def text(self) -> str:
+        if self.joined is None:
+            joined = "".join(self.head)
+            if self.omitted_chars > 0:
+                joined += f"\n... ({self.omitted_chars} characters of output omitted) ...\n"
+            self.joined = joined + "".join(self.tail)
+        return self.joined
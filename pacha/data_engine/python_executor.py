@@ -1,23 +1,94 @@
 from dataclasses import dataclass, field
 from pydantic import BaseModel, RootModel, Field
-from typing import Annotated, Callable, Literal, Optional, Any, Union, override
+from typing import Annotated, AsyncIterator, Awaitable, Callable, Literal, Optional, Any, TypeVar, Union, override
 from pacha.data_engine.artifacts import ArtifactType, ArtifactData
+from pacha.data_engine.artifact_spill import estimate_size
+from pacha.data_engine.artifact_stats import compute_column_stats
 from pacha.data_engine.context import ExecutionContext
 from pacha.data_engine.data_engine import SqlHooks
+from pacha.data_engine.framing import Framing, decode_frame, supported_compressions, supported_encodings
+from pacha.data_engine.local_runtime import LocalRuntime
+from pacha.data_engine.output_buffer import OutputBuffer
+from pacha.data_engine.runtime_pool import RuntimeConnection, RuntimeConnectionPool, connect_to_runtime, get_runtime_connection_pool
 from pacha.data_engine import DataEngine, SqlOutput, SqlStatement
 from pacha.data_engine.user_confirmations import UserConfirmationProvider, UserConfirmationResult
 from pacha.error import PachaException
 from pacha.sdk.llm import Llm
-from websockets.asyncio.client import connect
+from pacha.sdk.llm_cache import LlmCache
+from websockets.exceptions import ConnectionClosed
 from os import getenv
-import copy
+from contextlib import aclosing
 import asyncio
+import json
+import time
 import traceback
 
+# Default limit on concurrent LLM calls made by the AI primitives of a single execution
+MAX_CONCURRENT_LLM_CALLS = 8
+# Inputs to summarize longer than these many characters are split into chunks
+# that are summarized separately and then combined (map-reduce)
+SUMMARIZE_CHUNK_CHARS = 100_000
+# Default limit on requests from the Python runtime handled concurrently
+MAX_IN_FLIGHT_REQUESTS = 16
+# Feature advertised in the hello message for chunked transfer of table data
+CHUNKED_TRANSFER = "chunked_transfer"
+# Number of rows per chunk when sending table artifacts in chunks
+TRANSFER_CHUNK_ROWS = 1000
+# Default number of chunks sent ahead of the runtime's acknowledgements
+TRANSFER_WINDOW_CHUNKS = 4
+# Default number of rows of each SQL result kept in the recorded SQL statements
+SQL_SAMPLE_ROWS = 10
+# Default limit on the printed output of an execution, which is included in
+# prompts. Beyond this, the start and end of the output are kept.
+MAX_OUTPUT_CHARS = 20_000
+
+T = TypeVar('T')
+
 def noop(*args, **kwargs):
     pass
 
 
+async def gather_or_cancel(awaitables: list[Awaitable[T]]) -> list[T]:
+    """Like asyncio.gather, but cancels the remaining awaitables if any of them fail"""
+    tasks = [asyncio.ensure_future(awaitable) for awaitable in awaitables]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+
+@dataclass
+class PythonExecutorOptions:
+    # Maximum number of LLM calls the AI primitives make concurrently
+    max_concurrent_llm_calls: int = MAX_CONCURRENT_LLM_CALLS
+    # Number of inputs packed into a single classification prompt. With 1, each
+    # input is classified with a separate LLM call.
+    classify_batch_size: int = 1
+    # If set, responses to identical classify/summarize prompts are reused
+    # rather than asking the LLM again. May be shared across executions.
+    llm_cache: Optional[LlmCache] = None
+    # None disables chunked summarization
+    summarize_chunk_chars: Optional[int] = SUMMARIZE_CHUNK_CHARS
+    # Number of connections to the Python runtime to keep open ahead of time,
+    # shared by all executions on the same event loop. 0 connects on demand.
+    warm_runtime_connections: int = 0
+    # If set, code is executed by local worker processes rather than the remote
+    # Python runtime (PROMPTQL_URI). May be shared across executions.
+    local_runtime: Optional[LocalRuntime] = None
+    # None keeps all the printed output
+    max_output_chars: Optional[int] = MAX_OUTPUT_CHARS
+    # Rows of each SQL result kept in `sql_statements`, along with its row
+    # count, size and latency. Full results are not kept.
+    sql_sample_rows: int = SQL_SAMPLE_ROWS
+
+    def __post_init__(self):
+        if self.summarize_chunk_chars is not None and self.summarize_chunk_chars <= 0:
+            raise PachaException(
+                "summarize_chunk_chars must be positive, or None to disable chunked summarization")
+
+
 @dataclass
 class PythonExecutorHooks:
     on_python_execute: Callable[[str], None] = noop
@@ -26,6 +97,20 @@ class PythonExecutorHooks:
 
 class HelloMessage(BaseModel):
     python: str
+    # Encodings and compressions the client can use for subsequent messages, in
+    # order of preference. Runtimes that don't support these ignore them and
+    # keep using JSON text frames.
+    encodings: Optional[list[str]] = None
+    compressions: Optional[list[str]] = None
+    # Optional protocol features the client supports (eg: CHUNKED_TRANSFER)
+    features: Optional[list[str]] = None
+
+class HelloAckMessage(BaseModel):
+    type: Literal["hello_ack"]
+    encoding: str
+    compression: Optional[str] = None
+    # Optional protocol features the runtime has enabled
+    features: list[str] = Field(default_factory=list)
     
 class PrintMessage(BaseModel):
     type: Literal["print"]
@@ -42,6 +127,32 @@ class StoreArtifactMessage(BaseModel):
     artifact_type: ArtifactType
     data: ArtifactData
 
+class StoreArtifactChunkMessage(BaseModel):
+    """Part of the rows of a table artifact, when chunked transfer is enabled"""
+    type: Literal["store_artifact_chunk"]
+    identifier: str
+    title: str
+    artifact_type: ArtifactType
+    data: list[dict[str, Any]]
+    last: bool
+    msg_id: int
+
+class ChunkAckMessage(BaseModel):
+    """Acknowledges that the runtime has received a ChunkResponse"""
+    type: Literal["chunk_ack"]
+    orig_msg_id: int
+    chunk: int
+
+class ChunkResponse(BaseModel):
+    """Part of the rows of a get_artifact or run_sql response, when chunked transfer is enabled"""
+    orig_msg_id: int
+    chunk: int
+    data: list[dict[str, Any]]
+    last: bool
+
+class ChunkAckResponse(BaseModel):
+    orig_msg_id: int
+
 class GetArtifactMessage(BaseModel):
     type: Literal["get_artifact"]
     identifier: str
@@ -51,6 +162,20 @@ class GetArtifactResponse(BaseModel):
     orig_msg_id: int
     contents: ArtifactData
 
+class ColumnStatsMessage(BaseModel):
+    type: Literal["column_stats"]
+    identifier: str
+    columns: list[str]
+    group_by: list[str] = []
+    aggregates: Optional[list[str]] = None
+    percentiles: list[float] = []
+    histogram_bins: int = 0
+    msg_id: int
+
+class ColumnStatsResponse(BaseModel):
+    orig_msg_id: int
+    stats: list[dict[str, Any]]
+
 class ClassifyMessage(BaseModel):
     type: Literal["classify"]
     instructions: str
@@ -89,10 +214,14 @@ class MutationsDisallowed(Exception):
 ServerMessage = RootModel[
     Annotated[
         Union[
+            HelloAckMessage,
             PrintMessage,
             ErrorMessage,
             StoreArtifactMessage,
+            StoreArtifactChunkMessage,
+            ChunkAckMessage,
             GetArtifactMessage,
+            ColumnStatsMessage,
             ClassifyMessage,
             SummarizeMessage,
             RunSQLMessage
@@ -123,8 +252,16 @@ class ClientHooks:
         """Get an artifact"""
         pass
     
+    async def column_stats(self, identifier: str, columns: list[str], group_by: list[str], aggregates: Optional[list[str]], percentiles: list[float], histogram_bins: int) -> list[dict[str, Any]]:
+        """Compute statistics over the columns of a table artifact"""
+        pass
+
     async def run_sql(self, sql: str, allow_mutations: bool) -> SqlOutput:
         pass
+
+    async def run_sql_stream(self, sql: str, allow_mutations: bool) -> AsyncIterator[SqlOutput]:
+        """Run SQL, yielding the resulting rows in batches"""
+        yield await self.run_sql(sql, allow_mutations)
     
     async def request_confirmation(self, sql: str) -> bool:
         pass
@@ -135,58 +272,324 @@ class ClientHooks:
     async def summarize(self, instructions: str, input: str) -> str:
         pass
     
+RequestMessage = GetArtifactMessage | ColumnStatsMessage | ClassifyMessage | SummarizeMessage | RunSQLMessage
+ResponseMessage = GetArtifactResponse | ColumnStatsResponse | ClassifyResponse | SummarizeResponse | RunSQLResponse
+
+
+async def iterate_chunks(rows: list[Any], chunk_rows: int) -> AsyncIterator[list[Any]]:
+    for start in range(0, len(rows), chunk_rows):
+        yield rows[start:start + chunk_rows]
+
+
+@dataclass
+class InFlightSlot:
+    """
+    A request's slot in the session's in-flight limit. It may be given up and
+    reacquired while the request runs, so it's only released if it's held.
+    """
+    semaphore: asyncio.Semaphore
+    held: bool = True
+
+    async def acquire(self):
+        await self.semaphore.acquire()
+        self.held = True
+
+    def release(self):
+        if self.held:
+            self.held = False
+            self.semaphore.release()
+
+
+@dataclass
+class Session:
+    """State of a single execution's connection to the Python runtime"""
+    connection: RuntimeConnection
+    in_flight: asyncio.Semaphore
+    framing: Framing = field(default_factory=Framing)
+    chunked_transfer: bool = False
+    send_lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    # Send windows of the chunked responses in progress, by orig_msg_id
+    windows: dict[int, asyncio.Semaphore] = field(default_factory=dict)
+    # Rows received so far of the artifacts being stored in chunks, by identifier
+    artifact_chunks: dict[str, list[dict[str, Any]]] = field(default_factory=dict)
+
+    async def send(self, message: BaseModel):
+        frame = self.framing.encode(message)
+        async with self.send_lock:
+            await self.connection.send(frame)
+
+    async def wait_for_window(self, window: asyncio.Semaphore, slot: InFlightSlot):
+        """
+        Wait for room in the send window of a chunked response. The request's
+        in-flight slot is given up while waiting, since the acknowledgements are
+        only read once the reader gets a slot for any request it has received.
+        """
+        if not window.locked():
+            await window.acquire()
+            return
+        slot.release()
+        try:
+            await window.acquire()
+        finally:
+            await slot.acquire()
+
+
 @dataclass
 class Client:
-    api_token: str
-    uri: str
     hooks: ClientHooks
+    # The remote Python runtime, used unless a local runtime is set
+    api_token: Optional[str] = None
+    uri: Optional[str] = None
+    # If set, code is executed by local worker processes instead
+    local_runtime: Optional[LocalRuntime] = None
+    # Requests from the Python runtime (eg: run_sql) are handled concurrently, up
+    # to this many at a time, and responded to as they complete. Responses are
+    # matched to their requests by orig_msg_id, so their order doesn't matter.
+    # Messages aren't read while this many requests are in flight.
+    max_in_flight_requests: int = MAX_IN_FLIGHT_REQUESTS
+    # If set, connections are taken from the pool rather than opened on demand
+    pool: Optional[RuntimeConnectionPool] = None
+    # Offer the runtime binary (msgpack) and compressed framing for messages
+    negotiate_framing: bool = True
+    # Offer the runtime chunked transfer of table data
+    negotiate_chunked_transfer: bool = True
+    # Number of chunks of a response sent ahead of the runtime's acknowledgements.
+    # Along with the chunk size, this bounds the memory used for a transfer on
+    # both ends, regardless of the size of the table.
+    transfer_window_chunks: int = TRANSFER_WINDOW_CHUNKS
+    # Only one confirmation is requested from the user at a time
+    confirmation_lock: asyncio.Lock = field(
+        default_factory=asyncio.Lock, init=False, repr=False)
     
     async def exec_code(self, code: str):       
-        headers = {
-            "Authorization": f"Bearer {self.api_token}"
-        }
-        
-        async with connect(self.uri, additional_headers=headers) as websocket:
-            hello_message = HelloMessage(python=code)
-            await websocket.send(hello_message.json())
+        hello_message = HelloMessage(python=code)
+        if self.negotiate_framing:
+            hello_message.encodings = supported_encodings()
+            hello_message.compressions = supported_compressions()
+        if self.negotiate_chunked_transfer:
+            hello_message.features = [CHUNKED_TRANSFER]
+        connection: RuntimeConnection
+        if self.local_runtime is not None:
+            connection = await self.local_runtime.acquire()
+            await connection.send(hello_message.json())
+        else:
+            assert self.uri is not None and self.api_token is not None
+            if self.pool is None:
+                connection = await connect_to_runtime(self.uri, self.api_token)
+                await connection.send(hello_message.json())
+            else:
+                connection = await self.pool.acquire()
+                try:
+                    await connection.send(hello_message.json())
+                except ConnectionClosed:
+                    # The pooled connection was dropped after its health check
+                    connection = await connect_to_runtime(self.uri, self.api_token)
+                    await connection.send(hello_message.json())
 
-            async for message_json in websocket:
-                message = ServerMessage.model_validate_json(message_json).root
+        try:
+            await self.handle_messages(connection)
+        finally:
+            await connection.close()
 
+    async def handle_messages(self, connection: RuntimeConnection):
+        session = Session(connection=connection, in_flight=asyncio.Semaphore(
+            self.max_in_flight_requests))
+        requests: set[asyncio.Task] = set()
+        failure: asyncio.Future[BaseException] = asyncio.get_running_loop().create_future()
+        # Consecutive prints are coalesced and passed to the hooks at once
+        pending_prints: list[str] = []
+
+        async def flush_prints():
+            if len(pending_prints) > 0:
+                text = '\n'.join(pending_prints)
+                pending_prints.clear()
+                await self.hooks.print(text)
+
+        def on_request_done(request: asyncio.Task):
+            requests.discard(request)
+            if not request.cancelled() and request.exception() is not None and not failure.done():
+                failure.set_result(request.exception())
+
+        async def read_messages():
+            async for frame in connection:
+                message = decode_frame(frame, ServerMessage).root
+                if isinstance(message, PrintMessage):
+                    pending_prints.append(message.text)
+                    continue
+                await flush_prints()
+
+                # Prints and artifact stores are handled in order, as they are
+                # received, since later messages may depend on them. Reading
+                # waits for an in-flight slot for each request, which applies
+                # back pressure to the runtime. Chunked responses give up their
+                # slot while waiting for acknowledgements, so that those are
+                # always read eventually.
                 match message:
-                    case PrintMessage():
-                        await self.hooks.print(message.text)
+                    case HelloAckMessage():
+                        if message.encoding not in supported_encodings() or (message.compression is not None and message.compression not in supported_compressions()):
+                            raise PachaException(
+                                f"Python runtime chose an unsupported framing: {message.encoding}, {message.compression}")
+                        session.framing.encoding = message.encoding
+                        session.framing.compression = message.compression
+                        session.chunked_transfer = self.negotiate_chunked_transfer and CHUNKED_TRANSFER in message.features
                     case ErrorMessage():
                         await self.hooks.on_error(message.message)
                         break
                     case StoreArtifactMessage():
                         await self.hooks.maybe_cancel()
                         await self.hooks.store_artifact(message.identifier, message.title, message.artifact_type, message.data)
-                    case GetArtifactMessage():
-                        artifact = await self.hooks.get_artifact(message.identifier)
-                        await websocket.send(GetArtifactResponse(orig_msg_id=message.msg_id, contents=artifact).json())
-                    case ClassifyMessage():
-                        results = await self.hooks.classify(message.instructions, message.inputs_to_classify, message.categories, message.allow_multiple)
-                        await websocket.send(ClassifyResponse(orig_msg_id=message.msg_id, results=results).json())
-                    case SummarizeMessage():
-                        summary = await self.hooks.summarize(message.instructions, message.input)
-                        await websocket.send(SummarizeResponse(orig_msg_id=message.msg_id, summary=summary).json())
-                    case RunSQLMessage():
-                        data = None
-                        
-                        try:
-                            data = await self.hooks.run_sql(message.sql, allow_mutations=False)
-                        except MutationsDisallowed:
-                            if await self.hooks.request_confirmation(message.sql):
-                                data = await self.hooks.run_sql(message.sql, allow_mutations=True)
-                            else:
-                                raise
-                            
-                        if data is None:
-                            raise PachaException(
-                                f"User did not approve execution of SQL mutation: {message.sql}")
-                        
-                        await websocket.send(RunSQLResponse(orig_msg_id=message.msg_id, data=data).json())
+                    case StoreArtifactChunkMessage():
+                        # Artifacts are stored whole, so the rows are collected
+                        # until the last chunk. A chunk is acknowledged once it
+                        # has been handled, so the runtime can't get more than
+                        # its window ahead of this reader.
+                        rows = session.artifact_chunks.setdefault(
+                            message.identifier, [])
+                        rows.extend(message.data)
+                        if message.last:
+                            del session.artifact_chunks[message.identifier]
+                            await self.hooks.maybe_cancel()
+                            await self.hooks.store_artifact(message.identifier, message.title, message.artifact_type, rows)
+                        await session.send(ChunkAckResponse(orig_msg_id=message.msg_id))
+                    case ChunkAckMessage():
+                        window = session.windows.get(message.orig_msg_id)
+                        if window is not None:
+                            window.release()
+                    case _:
+                        await session.in_flight.acquire()
+                        request = asyncio.create_task(
+                            self.respond(session, message, InFlightSlot(session.in_flight)))
+                        requests.add(request)
+                        request.add_done_callback(on_request_done)
+
+        reader = asyncio.create_task(read_messages())
+        try:
+            await asyncio.wait([reader, failure], return_when=asyncio.FIRST_COMPLETED)
+            if failure.done():
+                raise failure.result()
+            reader.result()
+        finally:
+            reader.cancel()
+            for request in list(requests):
+                request.cancel()
+            # Nothing is reading from or writing to the connection once this returns
+            await asyncio.gather(reader, *requests, return_exceptions=True)
+            await flush_prints()
+
+    async def respond(self, session: Session, message: RequestMessage, slot: InFlightSlot):
+        # The in-flight slot is acquired by the reader, before the request's task is created
+        try:
+            if session.chunked_transfer and isinstance(message, RunSQLMessage):
+                # Rows are sent as they are received from the data engine,
+                # rather than after the full result has been collected
+                await self.send_chunked(session, slot, message.msg_id, self.run_sql_stream(message.sql))
+            elif session.chunked_transfer and isinstance(message, GetArtifactMessage):
+                artifact = await self.hooks.get_artifact(message.identifier)
+                if isinstance(artifact, list) and len(artifact) > TRANSFER_CHUNK_ROWS:
+                    await self.send_chunked(session, slot, message.msg_id, iterate_chunks(artifact, TRANSFER_CHUNK_ROWS))
+                else:
+                    await session.send(GetArtifactResponse(orig_msg_id=message.msg_id, contents=artifact))
+            else:
+                await session.send(await self.handle_request(message))
+        finally:
+            slot.release()
+
+    async def send_chunked(self, session: Session, slot: InFlightSlot, orig_msg_id: int, chunks: AsyncIterator[list[Any]]):
+        window = asyncio.Semaphore(self.transfer_window_chunks)
+        session.windows[orig_msg_id] = window
+        try:
+            # Chunks are sent one behind, so that the last one can be marked as such
+            chunk_index = 0
+            previous: Optional[list[Any]] = None
+            async for chunk in chunks:
+                if previous is not None:
+                    await session.wait_for_window(window, slot)
+                    await session.send(ChunkResponse(orig_msg_id=orig_msg_id, chunk=chunk_index, data=previous, last=False))
+                    chunk_index += 1
+                previous = chunk
+            await session.wait_for_window(window, slot)
+            await session.send(ChunkResponse(orig_msg_id=orig_msg_id, chunk=chunk_index, data=previous if previous is not None else [], last=True))
+        finally:
+            del session.windows[orig_msg_id]
+
+    async def run_sql_stream(self, sql: str) -> AsyncIterator[SqlOutput]:
+        try:
+            async for batch in self.hooks.run_sql_stream(sql, allow_mutations=False):
+                yield batch
+            return
+        except MutationsDisallowed:
+            async with self.confirmation_lock:
+                if not await self.hooks.request_confirmation(sql):
+                    raise
+        async for batch in self.hooks.run_sql_stream(sql, allow_mutations=True):
+            yield batch
+
+    async def handle_request(self, message: RequestMessage) -> ResponseMessage:
+        match message:
+            case GetArtifactMessage():
+                artifact = await self.hooks.get_artifact(message.identifier)
+                return GetArtifactResponse(orig_msg_id=message.msg_id, contents=artifact)
+            case ColumnStatsMessage():
+                stats = await self.hooks.column_stats(message.identifier, message.columns, message.group_by, message.aggregates, message.percentiles, message.histogram_bins)
+                return ColumnStatsResponse(orig_msg_id=message.msg_id, stats=stats)
+            case ClassifyMessage():
+                results = await self.hooks.classify(message.instructions, message.inputs_to_classify, message.categories, message.allow_multiple)
+                return ClassifyResponse(orig_msg_id=message.msg_id, results=results)
+            case SummarizeMessage():
+                summary = await self.hooks.summarize(message.instructions, message.input)
+                return SummarizeResponse(orig_msg_id=message.msg_id, summary=summary)
+            case RunSQLMessage():
+                data = None
+                
+                try:
+                    data = await self.hooks.run_sql(message.sql, allow_mutations=False)
+                except MutationsDisallowed:
+                    async with self.confirmation_lock:
+                        if await self.hooks.request_confirmation(message.sql):
+                            data = await self.hooks.run_sql(message.sql, allow_mutations=True)
+                        else:
+                            raise
+                    
+                if data is None:
+                    raise PachaException(
+                        f"User did not approve execution of SQL mutation: {message.sql}")
+                
+                return RunSQLResponse(orig_msg_id=message.msg_id, data=data)
+
+def split_into_chunks(text: str, max_chars: int) -> list[str]:
+    """Split text into chunks of at most max_chars, preferably at line boundaries"""
+    if max_chars <= 0:
+        raise ValueError(f"max_chars must be positive, got {max_chars}")
+    chunks = []
+    start = 0
+    while len(text) - start > max_chars:
+        end = text.rfind('\n', start, start + max_chars)
+        end = start + max_chars if end <= start else end + 1
+        chunks.append(text[start:end])
+        start = end
+    chunks.append(text[start:])
+    return chunks
+
+
+def parse_batch_classification(answer: str, expected_length: int, allow_multiple: bool) -> Optional[list[str | list[str]]]:
+    answer = answer.strip()
+    # Tolerate the answer being wrapped in a markdown code block
+    if answer.startswith('```'):
+        answer = answer.strip('`').removeprefix('json').strip()
+    try:
+        output = json.loads(answer)
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(output, list) or len(output) != expected_length:
+        return None
+    for element in output:
+        if allow_multiple:
+            if not isinstance(element, list) or not all(isinstance(category, str) for category in element):
+                return None
+        elif not isinstance(element, str):
+            return None
+    return output
+
 
 @dataclass
 class PythonExecutor(ClientHooks):
@@ -194,15 +597,60 @@ class PythonExecutor(ClientHooks):
     hooks: PythonExecutorHooks
     llm: Llm
     context: ExecutionContext
+    options: PythonExecutorOptions = field(default_factory=PythonExecutorOptions)
     sql_statements: list[SqlStatement] = field(default_factory=list)
-    output_text: str = ""
     error: Optional[str] = None
     modified_artifact_identifiers: list[str] = field(default_factory=list)
+    # Statements that failed for attempting mutations, by SQL, until they are
+    # retried with the user's confirmation
+    awaiting_confirmation: dict[str, SqlStatement] = field(
+        default_factory=dict, init=False, repr=False)
+    output: OutputBuffer = field(init=False)
+    llm_semaphore: asyncio.Semaphore = field(init=False)
+    # In flight LLM calls, by cache key
+    llm_calls: dict[str, asyncio.Future[str]] = field(
+        default_factory=dict, init=False, repr=False)
+
+    def __post_init__(self):
+        self.output = OutputBuffer(max_chars=self.options.max_output_chars)
+        self.llm_semaphore = asyncio.Semaphore(
+            self.options.max_concurrent_llm_calls)
+
+    @property
+    def output_text(self) -> str:
+        return self.output.text()
+
+    async def ask_llm(self, input: str, system_prompt: str) -> str:
+        # Identical prompts (eg: repeated inputs to classify) share a single
+        # call, rather than each missing the cache and calling the LLM
+        key = LlmCache.key(self.llm, input, system_prompt, None)
+        call = self.llm_calls.get(key)
+        if call is None:
+            call = asyncio.ensure_future(
+                self.call_llm(key, input, system_prompt))
+            self.llm_calls[key] = call
+            call.add_done_callback(
+                lambda _: self.llm_calls.pop(key, None))
+        # Cancelling one caller doesn't cancel the call for the others
+        return await asyncio.shield(call)
+
+    async def call_llm(self, key: str, input: str, system_prompt: str) -> str:
+        cache = self.options.llm_cache
+        if cache is not None:
+            response = await cache.get(key)
+            if response is not None:
+                return response
+        async with self.llm_semaphore:
+            await self.maybe_cancel()
+            response = await self.llm.ask(input, system_prompt)
+        if cache is not None:
+            await cache.put(key, response)
+        return response
 
     @override
     async def print(self, text: str):
         await self.maybe_cancel()
-        self.output_text += str(text) + '\n'
+        self.output.append(str(text) + '\n')
         
     @override
     async def on_error(self, message: str):
@@ -211,7 +659,7 @@ class PythonExecutor(ClientHooks):
     @override
     async def store_artifact(self, identifier: str, title: str, artifact_type: ArtifactType, data: ArtifactData):
         """Store an artifact"""
-        output, is_stored = self.context.artifacts.store_artifact(
+        output, is_stored = await self.context.artifacts.store_artifact(
             identifier, title, artifact_type, data)
         if is_stored:
             self.modified_artifact_identifiers.append(identifier)
@@ -220,8 +668,22 @@ class PythonExecutor(ClientHooks):
     @override
     async def get_artifact(self, identifier: str) -> ArtifactData:
         """Get an artifact"""
-        return copy.deepcopy(self.context.artifacts.get_artifact(identifier))
+        # Not copied, since the data is only serialized to the runtime and
+        # stored artifacts are never modified in place
+        await self.context.artifacts.load([identifier])
+        return self.context.artifacts.get_artifact(identifier)
     
+    @override
+    async def column_stats(self, identifier: str, columns: list[str], group_by: list[str], aggregates: Optional[list[str]], percentiles: list[float], histogram_bins: int) -> list[dict[str, Any]]:
+        await self.context.artifacts.load([identifier])
+        data = self.context.artifacts.get_artifact(identifier)
+        if not isinstance(data, list):
+            raise PachaException(
+                f"Artifact {identifier} is not a table artifact")
+        # Computed on a worker thread, so that large artifacts don't block
+        # other executions
+        return await asyncio.to_thread(compute_column_stats, data, columns, group_by, aggregates, percentiles, histogram_bins)
+
     @override
     async def request_confirmation(self, sql: str) -> bool:
         if self.context.confirmation_provider is None:
@@ -247,18 +709,40 @@ class PythonExecutor(ClientHooks):
                 Your response must exactly be one of the possible categories with no fluff words (eg: nothing like "here is the category") or fluff characters (eg: no extra punctuation)
             """
 
-        output: list[str | list[str]] = []
-        for input in inputs_to_classify:
-            answer = (await self.llm.ask(input, system_prompt)).strip()
-            await self.maybe_cancel()
-            if allow_multiple:
-                if answer == 'None':
-                    output.append([])
-                else:
-                    output.append(answer.split('\n'))
-            else:
-                output.append(answer)
-        return output
+        batch_size = max(1, self.options.classify_batch_size)
+        batches = [inputs_to_classify[start:start + batch_size]
+                   for start in range(0, len(inputs_to_classify), batch_size)]
+        # Results are gathered in the order of the batches, which preserves the input order
+        batch_outputs = await gather_or_cancel([self.classify_batch(system_prompt, batch, allow_multiple)
+                                                for batch in batches])
+        await self.maybe_cancel()
+        return [output for batch_output in batch_outputs for output in batch_output]
+
+    async def classify_one(self, system_prompt: str, input: str, allow_multiple: bool) -> str | list[str]:
+        answer = (await self.ask_llm(input, system_prompt)).strip()
+        if allow_multiple:
+            if answer == 'None':
+                return []
+            return answer.split('\n')
+        return answer
+
+    async def classify_batch(self, system_prompt: str, inputs: list[str], allow_multiple: bool) -> list[str | list[str]]:
+        if len(inputs) > 1:
+            batch_system_prompt = f"""
+                {system_prompt}
+                You will be given {len(inputs)} inputs to classify, each starting with a line like "Input 1:".
+                Classify each input separately, and respond with only a JSON array with exactly {len(inputs)} elements, one per input and in the same order.
+                {'Each element must be a JSON array of the applicable categories (empty if no categories apply).' if allow_multiple else 'Each element must be exactly one of the possible categories, as a JSON string.'}
+            """
+            batch_input = '\n\n'.join(
+                f'Input {index + 1}:\n{input}' for index, input in enumerate(inputs))
+            answer = await self.ask_llm(batch_input, batch_system_prompt)
+            output = parse_batch_classification(
+                answer, len(inputs), allow_multiple)
+            if output is not None:
+                return output
+            # The model didn't follow the batch format, so classify individually
+        return await gather_or_cancel([self.classify_one(system_prompt, input, allow_multiple) for input in inputs])
     
     @override
     async def summarize(self, instructions: str, input: str) -> str:
@@ -267,35 +751,106 @@ class PythonExecutor(ClientHooks):
             You are a summarization tool. Given the input from the user, summarize it according to these instructions. Response only with the summarized text and nothing else (eg: no fluff words like "here is the summary", and no chatting to the user).
             {instructions}
         """
-        return await self.llm.ask(input, system_prompt)
+        chunk_chars = self.options.summarize_chunk_chars
+        if chunk_chars is not None:
+            while len(input) > chunk_chars:
+                chunks = split_into_chunks(input, chunk_chars)
+                chunk_system_prompt = f"""
+                    You are a summarization tool. The input from the user is one part of a larger input that is too long to summarize at once.
+                    Summarize this part so that the summaries of all the parts can later be combined into a single summary following these instructions. Keep any details relevant to the instructions.
+                    Response only with the summarized text and nothing else (eg: no fluff words like "here is the summary", and no chatting to the user).
+                    {instructions}
+                """
+                summaries = await gather_or_cancel([self.ask_llm(chunk, chunk_system_prompt) for chunk in chunks])
+                await self.maybe_cancel()
+                combined = '\n\n'.join(summaries)
+                if len(combined) >= len(input):
+                    # Summarizing isn't shrinking the input, so stop reducing
+                    break
+                input = combined
+        return await self.ask_llm(input, system_prompt)
     
     @override
     async def run_sql(self, sql: str, allow_mutations: bool) -> SqlOutput:
+        data: SqlOutput = []
+        async for batch in self.run_sql_stream(sql, allow_mutations):
+            data.extend(batch)
+        return data
+
+    @override
+    async def run_sql_stream(self, sql: str, allow_mutations: bool) -> AsyncIterator[SqlOutput]:
+        # Retrying with mutations allowed, once the user has confirmed them,
+        # continues the statement of the first attempt
+        statement = self.awaiting_confirmation.pop(
+            sql, None) if allow_mutations else None
+        if statement is None:
+            self.hooks.sql.on_sql_request(sql)
+            statement = SqlStatement(sql=sql, result=[])
+            self.sql_statements.append(statement)
+        started_at = time.monotonic()
+        sample: SqlOutput = []
+        row_count = 0
+        result_bytes = 0
+        error: Optional[str] = None
         try:
-            return await self.data_engine.execute_sql(sql, allow_mutations)
+            # Rows are decoded incrementally, which keeps the raw response body
+            # from being held alongside the decoded rows and lets cancellation
+            # interrupt long transfers.
+            async with aclosing(self.data_engine.execute_sql_stream(sql, allow_mutations)) as batches:
+                async for batch in batches:
+                    await self.maybe_cancel()
+                    if len(sample) < self.options.sql_sample_rows:
+                        sample.extend(
+                            batch[:self.options.sql_sample_rows - len(sample)])
+                    row_count += len(batch)
+                    result_bytes += estimate_size(batch)
+                    yield batch
         except Exception as e:
             if "Mutations are requested to be disallowed as part of the request" in str(e):
+                error = "Mutations are disallowed"
+                self.awaiting_confirmation[sql] = statement
                 raise MutationsDisallowed()
-            else:
-                raise
-    
+            error = str(e) or type(e).__name__
+            raise
+        except BaseException:
+            # Cancelled, or the caller stopped reading the rows
+            error = "The result was not read in full"
+            raise
+        finally:
+            statement.result = sample
+            statement.row_count = row_count
+            statement.result_bytes = result_bytes
+            statement.latency_secs = time.monotonic() - started_at
+            statement.error = error
+            if error is None:
+                self.hooks.sql.on_sql_response(sample)
+
     async def exec_code(self, code: str):
-        token = getenv("PROMPTQL_SECRET_KEY")
-        if token is None:
-            raise PachaException("Expected PROMPTQL_SECRET_KEY")            
-        
-        uri = getenv("PROMPTQL_URI")
-        if uri is None:
-            raise PachaException("Expected PROMPTQL_URI environment variable")
-        
+        client = self.create_client()
         self.hooks.on_python_execute(code)
         
         try:
-            client = Client(api_token=token, uri=uri, hooks=self)
-            
             await client.exec_code(code)
             
             self.hooks.on_python_output(self.output_text)
         except Exception as e:
             limit = 1 - len(traceback.extract_tb(e.__traceback__))
             self.error = traceback.format_exc(limit)
+
+    def create_client(self) -> Client:
+        if self.options.local_runtime is not None:
+            return Client(hooks=self, local_runtime=self.options.local_runtime)
+
+        token = getenv("PROMPTQL_SECRET_KEY")
+        if token is None:
+            raise PachaException("Expected PROMPTQL_SECRET_KEY")            
+        
+        uri = getenv("PROMPTQL_URI")
+        if uri is None:
+            raise PachaException("Expected PROMPTQL_URI environment variable")
+
+        pool = None
+        if self.options.warm_runtime_connections > 0:
+            pool = get_runtime_connection_pool(
+                uri, token, self.options.warm_runtime_connections)
+        return Client(api_token=token, uri=uri, hooks=self, pool=pool)
@@ -0,0 +1,151 @@
+from collections import deque
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Protocol
+from websockets.asyncio.client import ClientConnection, connect
+from websockets.exceptions import ConnectionClosed
+from websockets.protocol import State
+from pacha.utils.logging import get_logger
+import asyncio
+import time
+
+HEALTH_CHECK_TIMEOUT_SECS = 5.0
+# Connections idle for less than this are used without a health check (ping)
+HEALTH_CHECK_IDLE_SECS = 10.0
+# Servers and proxies commonly drop idle connections, so older idle
+# connections are replaced in the background.
+MAX_IDLE_SECS = 60.0
+
+
+class RuntimeConnection(Protocol):
+    """
+    Connection to a Python runtime for a single execution. Websocket connections
+    to the remote runtime satisfy this, as do connections to local workers.
+    """
+    async def send(self, message: str | bytes): ...
+
+    def __aiter__(self) -> AsyncIterator[str | bytes]: ...
+
+    async def close(self): ...
+
+
+async def connect_to_runtime(uri: str, api_token: str) -> ClientConnection:
+    headers = {
+        "Authorization": f"Bearer {api_token}"
+    }
+    return await connect(uri, additional_headers=headers)
+
+
+@dataclass
+class RuntimeConnectionPool:
+    """
+    Keeps up to `size` authenticated websocket connections to the Python runtime
+    open ahead of time, so that executions don't wait for the TLS handshake and
+    authentication. The runtime signals the end of an execution by closing the
+    connection, so each connection is only used for a single execution and the
+    pool is replenished in the background. Idle connections are also replaced in
+    the background before servers or proxies might drop them.
+    """
+    uri: str
+    api_token: str
+    size: int
+    max_idle_secs: float = MAX_IDLE_SECS
+    # Idle connections along with when they were opened
+    idle: deque[tuple[ClientConnection, float]] = field(
+        default_factory=deque, init=False, repr=False)
+    background_tasks: set[asyncio.Task] = field(
+        default_factory=set, init=False, repr=False)
+    connecting: int = field(default=0, init=False, repr=False)
+    closed: bool = field(default=False, init=False, repr=False)
+
+    async def connect(self) -> ClientConnection:
+        return await connect_to_runtime(self.uri, self.api_token)
+
+    async def acquire(self) -> ClientConnection:
+        """Get an open connection for a single execution. The caller must close it."""
+        try:
+            while len(self.idle) > 0:
+                connection, connected_at = self.idle.popleft()
+                if await self.is_healthy(connection, connected_at):
+                    return connection
+                self.spawn(connection.close())
+            return await self.connect()
+        finally:
+            self.replenish()
+
+    async def is_healthy(self, connection: ClientConnection, connected_at: float) -> bool:
+        idle_secs = time.monotonic() - connected_at
+        if connection.state is not State.OPEN or idle_secs > self.max_idle_secs:
+            return False
+        if idle_secs < HEALTH_CHECK_IDLE_SECS:
+            return True
+        try:
+            pong = await connection.ping()
+            await asyncio.wait_for(pong, HEALTH_CHECK_TIMEOUT_SECS)
+            return True
+        except (TimeoutError, ConnectionClosed):
+            return False
+
+    def replenish(self):
+        if self.closed:
+            return
+        for _ in range(self.size - len(self.idle) - self.connecting):
+            self.connecting += 1
+            self.spawn(self.add_idle_connection())
+
+    async def add_idle_connection(self):
+        try:
+            connection = await self.connect()
+        except Exception as e:
+            # Executions will connect on demand, and the pool is replenished
+            # again on the next acquire
+            get_logger().warning(
+                f"Failed to open a connection to the Python runtime: {e}")
+            return
+        finally:
+            self.connecting -= 1
+        entry = (connection, time.monotonic())
+        self.idle.append(entry)
+        self.spawn(self.expire(entry))
+
+    async def expire(self, entry: tuple[ClientConnection, float]):
+        """Replace an idle connection once it has been idle for `max_idle_secs`"""
+        await asyncio.sleep(self.max_idle_secs)
+        if entry in self.idle:
+            self.idle.remove(entry)
+            await entry[0].close()
+            self.replenish()
+
+    def spawn(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+
+    async def close(self):
+        self.closed = True
+        for task in list(self.background_tasks):
+            task.cancel()
+        while len(self.idle) > 0:
+            connection, _ = self.idle.popleft()
+            await connection.close()
+
+
+# Connections are bound to the event loop that opened them, so pools are per loop
+pools: dict[tuple[str, str, asyncio.AbstractEventLoop], RuntimeConnectionPool] = {}
+
+
+def get_runtime_connection_pool(uri: str, api_token: str, size: int) -> RuntimeConnectionPool:
+    for key in [key for key in pools if key[2].is_closed()]:
+        del pools[key]
+    key = (uri, api_token, asyncio.get_running_loop())
+    pool = pools.get(key)
+    if pool is None:
+        pool = RuntimeConnectionPool(uri=uri, api_token=api_token, size=size)
+        pools[key] = pool
+    return pool
+
+
+async def close_runtime_connection_pools():
+    """Close the pools of the running event loop, eg: on shutdown"""
+    loop = asyncio.get_running_loop()
+    for key in [key for key in pools if key[2] is loop]:
+        await pools.pop(key).close()
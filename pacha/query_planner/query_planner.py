@@ -4,7 +4,8 @@ from pacha.data_engine.artifacts import Artifacts
 from pacha.data_engine.context import ExecutionContext
 from pacha.query_planner.instructions import *
 from pacha.data_engine import DataEngine, SqlOutput
-from pacha.query_planner.input import QueryPlanningInput
+from pacha.data_engine.catalog_index import CatalogIndex
+from pacha.query_planner.input import QueryPlanningInput, UserTurn as PlanningUserTurn
 from pacha.query_planner.data_context import *
 from pacha.data_engine.python_executor import PythonExecutor, PythonExecutorHooks
 from pacha.utils.logging import get_logger
@@ -12,6 +13,7 @@ from pacha.sdk.chat import Turn, AssistantTurn, UserTurn
 import pacha.sdk.llm as llm
 import pacha.sdk.llms.llama as llama
 import pacha.sdk.llms.openai as openai
+import asyncio
 
 
 CODE_BEGIN_BACKTICKS = "```\n"
@@ -25,11 +27,11 @@ MAX_RETRIES = 3
 MAX_CONVERSATION_HISTORY_TURNS = 3
 
 
-def get_system_instructions(llm: llm.Llm, catalog: Catalog):
+def get_system_instructions(llm: llm.Llm, rendered_catalog: str):
     if isinstance(llm, openai.OpenAI):
-        return OPENAI_SYSTEM_INSTRUCTIONS_TEMPLATE.format(catalog=catalog.render_for_prompt())
+        return OPENAI_SYSTEM_INSTRUCTIONS_TEMPLATE.format(catalog=rendered_catalog)
     else:
-        return LLAMA_SYSTEM_INSTRUCTIONS_TEMPLATE.format(catalog=catalog.render_for_prompt())
+        return LLAMA_SYSTEM_INSTRUCTIONS_TEMPLATE.format(catalog=rendered_catalog)
 
 
 @dataclass
@@ -60,25 +62,54 @@ class QueryPlannerHooks:
     python: PythonExecutorHooks = field(default_factory=PythonExecutorHooks)
 
 
+@dataclass
+class PlanCandidate:
+    """How to generate one of the plans in speculative query planning"""
+    temperature: float = 0
+    # Defaults to the planner's LLM
+    planner_llm: Optional[llm.Llm] = None
+
+
+def is_final(data_context: DataContext) -> bool:
+    """Whether the data context can be used as is: its code ran without errors, or there was no code"""
+    return data_context.data is None or data_context.data.error is None
+
+
 @dataclass
 class QueryPlanner:
     data_engine: DataEngine
     system_prompt: Optional[str] = None
     planner_llm: llm.Llm = field(default_factory=llama.LlamaOnTogether)
     hooks: QueryPlannerHooks = field(default_factory=QueryPlannerHooks)
-    catalog: Catalog = field(init=False)
-
-    async def __post_init__(self):
-        self.catalog = await self.data_engine.get_catalog()
-
-    async def exec_code(self, code: str) -> QueryPlanExecutionResult:
-        executor = PythonExecutor(self.data_engine, context=ExecutionContext(), hooks=self.hooks.python, llm=self.planner_llm)
+    # If set, only these many tables relevant to the conversation (and the
+    # tables they are directly related to) are described in the prompt.
+    schema_top_k: Optional[int] = None
+    # If set, a plan is generated and executed for each of these candidates
+    # concurrently, and the first successful one is used. This trades LLM calls
+    # and query load for latency.
+    speculative_candidates: list[PlanCandidate] = field(default_factory=list)
+    catalog_index: Optional[CatalogIndex] = field(default=None, init=False)
+
+    async def get_catalog_index(self) -> CatalogIndex:
+        if self.catalog_index is None:
+            self.catalog_index = CatalogIndex(await self.data_engine.get_catalog())
+        return self.catalog_index
+
+    async def exec_code(self, code: str, hooks: Optional[PythonExecutorHooks] = None) -> QueryPlanExecutionResult:
+        executor = PythonExecutor(self.data_engine, context=ExecutionContext(),
+                                  hooks=self.hooks.python if hooks is None else hooks, llm=self.planner_llm)
         await executor.exec_code(code)
         return QueryPlanExecutionResult(executor.output_text, executor.sql_statements, executor.error)
 
-    async def get_model_output(self, input: QueryPlanningInput, previous_try: Optional[DataContext]) -> str:
+    async def get_model_output(self, input: QueryPlanningInput, previous_try: Optional[DataContext], candidate: Optional[PlanCandidate] = None) -> str:
+        if candidate is None:
+            candidate = PlanCandidate()
+        planner_llm = candidate.planner_llm or self.planner_llm
+        catalog_index = await self.get_catalog_index()
+        recent_user_text = '\n'.join(turn.text for turn in input.turns[-MAX_CONVERSATION_HISTORY_TURNS:]
+                                     if isinstance(turn, PlanningUserTurn))
         query_planner_system_prompt = get_system_instructions(
-            self.planner_llm, self.catalog)
+            planner_llm, catalog_index.render_for_prompt(recent_user_text, self.schema_top_k))
         if self.system_prompt is not None:
             query_planner_system_prompt += f"\nAdditional Instructions: {
                 self.system_prompt}"
@@ -103,14 +134,14 @@ class QueryPlanner:
             UserTurn(text=user_prompt)
         ] + turns
 
-        output = (await self.planner_llm.get_assistant_turn(
+        output = (await planner_llm.get_assistant_turn(
             llm.Chat(system_prompt=query_planner_system_prompt, turns=turns),
-            temperature=0)).text
+            temperature=candidate.temperature)).text
         assert(output is not None)
         return output
 
-    async def get_query_plan(self, input: QueryPlanningInput, previous_try: Optional[DataContext]) -> QueryPlan:
-        model_output = await self.get_model_output(input, previous_try)
+    async def get_query_plan(self, input: QueryPlanningInput, previous_try: Optional[DataContext], candidate: Optional[PlanCandidate] = None) -> QueryPlan:
+        model_output = await self.get_model_output(input, previous_try, candidate)
 
         python_code = None
 
@@ -130,14 +161,17 @@ class QueryPlanner:
 
         return QueryPlan(raw=model_output, python_code=python_code)
 
-    async def execute_query_plan(self, query_plan: QueryPlan) -> Optional[QueryPlanExecutionResult]:
+    async def execute_query_plan(self, query_plan: QueryPlan, hooks: Optional[PythonExecutorHooks] = None) -> Optional[QueryPlanExecutionResult]:
         if query_plan.python_code is None:
             return None
-        return await self.exec_code(query_plan.python_code)
+        return await self.exec_code(query_plan.python_code, hooks)
 
     async def get_data_context(self, input: QueryPlanningInput) -> DataContext:
         get_logger().info("Calling Query Planner...")
-        data_context = await self.get_data_context_internal(input, previous_try=None)
+        if len(self.speculative_candidates) > 0:
+            data_context = await self.get_speculative_data_context(input)
+        else:
+            data_context = await self.get_data_context_internal(input, previous_try=None)
         retries = 0
         while data_context.data is not None and data_context.data.error is not None and retries < MAX_RETRIES:
             get_logger().info("Retrying Query Planning...")
@@ -146,12 +180,66 @@ class QueryPlanner:
             retries += 1
         return data_context
 
-    async def get_data_context_internal(self, input: QueryPlanningInput, previous_try: Optional[DataContext]) -> DataContext:
-        query_plan = await self.get_query_plan(input, previous_try)
-        self.hooks.on_query_plan_generation(query_plan)
+    async def get_speculative_data_context(self, input: QueryPlanningInput) -> DataContext:
+        """
+        The first data context of the candidates that ran successfully or had no
+        code (eg: the model answered directly), cancelling the others. If none of
+        them did, the first failed one, to retry from. The hooks are only called
+        for the chosen data context.
+        """
+        silent_hooks = PythonExecutorHooks()
+        tasks = [asyncio.create_task(self.get_data_context_internal(input, previous_try=None, candidate=candidate, python_hooks=silent_hooks))
+                 for candidate in self.speculative_candidates]
+        try:
+            chosen: Optional[DataContext] = None
+            failed: Optional[DataContext] = None
+            exception: Optional[BaseException] = None
+            for next_completed in asyncio.as_completed(tasks):
+                try:
+                    data_context = await next_completed
+                except Exception as e:
+                    get_logger().warning(f"Speculative query plan failed: {e}")
+                    exception = exception or e
+                    continue
+                if is_final(data_context):
+                    chosen = data_context
+                    break
+                failed = failed or data_context
+            if chosen is None:
+                chosen = failed
+            if chosen is None:
+                assert exception is not None
+                raise exception
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        self.replay_hooks(chosen)
+        return chosen
+
+    def replay_hooks(self, data_context: DataContext):
+        """Call the hooks for a data context generated and executed without them"""
+        self.hooks.on_query_plan_generation(data_context.query_plan)
+        if data_context.query_plan.python_code is not None and data_context.data is not None:
+            self.hooks.python.on_python_execute(
+                data_context.query_plan.python_code)
+            for statement in data_context.data.sql_statements:
+                self.hooks.python.sql.on_sql_request(statement.sql)
+                if statement.error is None:
+                    self.hooks.python.sql.on_sql_response(statement.result)
+            self.hooks.python.on_python_output(data_context.data.output)
+        self.hooks.on_query_plan_execution(data_context)
 
-        execution_result = await self.execute_query_plan(query_plan)
+    async def get_data_context_internal(self, input: QueryPlanningInput, previous_try: Optional[DataContext], candidate: Optional[PlanCandidate] = None,
+                                        python_hooks: Optional[PythonExecutorHooks] = None) -> DataContext:
+        """If `python_hooks` are set, they are used instead of the planner's hooks, and the planner's hooks aren't called"""
+        query_plan = await self.get_query_plan(input, previous_try, candidate)
+        if python_hooks is None:
+            self.hooks.on_query_plan_generation(query_plan)
+
+        execution_result = await self.execute_query_plan(query_plan, python_hooks)
         data_context = DataContext(
             query_plan, data=execution_result, previous_try=previous_try)
-        self.hooks.on_query_plan_execution(data_context)
+        if python_hooks is None:
+            self.hooks.on_query_plan_execution(data_context)
         return data_context
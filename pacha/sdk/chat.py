@@ -64,6 +64,11 @@ def get_prompt_characters(turn: Turn) -> int:
         return sum(len(tool_response.output.get_response()) for tool_response in turn.tool_responses)
 
 
+def get_recent_user_text(turns: list[Turn], max_user_turns: int) -> str:
+    texts = [turn.text for turn in turns if isinstance(turn, UserTurn)]
+    return '\n'.join(texts[-max_user_turns:])
+
+
 @dataclass
 class Chat:
     system_prompt: Union[None, str, Callable[[list[Turn]], str]]
@@ -15,8 +15,17 @@ class LlmException(Exception):
 class Llm(ABC):
     @abstractmethod
     async def get_assistant_turn(self, chat: Chat, tools: list[Tool] = [], temperature: Optional[float] = None) -> AssistantTurn:
+        """
+        Must not block the event loop (eg: use an async client, or run a sync
+        one in a thread), since calls can run concurrently, eg: for
+        speculative query planning.
+        """
         ...
 
+    def get_model_identifier(self) -> str:
+        """Identifies the underlying model, eg: for caching responses"""
+        return type(self).__qualname__
+
     async def ask(self, user_prompt: str, system_prompt: Optional[str] = None, temperature: Optional[float] = None) -> str:
         chat_obj = Chat(system_prompt)
         chat_obj.add_turn(UserTurn(text=user_prompt))
@@ -0,0 +1,107 @@
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Optional
+from pacha.sdk.llm import Llm
+import aiosqlite
+import hashlib
+import json
+import threading
+
+DEFAULT_MAX_ENTRIES = 10000
+
+
+@dataclass
+class LlmCache:
+    """
+    Content addressed cache of LLM responses, keyed by a hash of the model, system
+    prompt, user prompt and temperature. The most recently used `max_entries`
+    responses are kept in memory. If `path` is set, responses are also persisted
+    to a SQLite database there, so that they survive restarts.
+    """
+    max_entries: int = DEFAULT_MAX_ENTRIES
+    path: Optional[str] = None
+    hits: int = 0
+    misses: int = 0
+    entries: OrderedDict[str, str] = field(
+        default_factory=OrderedDict, init=False, repr=False)
+    connection: Optional[aiosqlite.Connection] = field(
+        default=None, init=False, repr=False)
+    # Executions may run on different threads (eg: the chat server's thread pool)
+    lock: threading.Lock = field(
+        default_factory=threading.Lock, init=False, repr=False)
+
+    @staticmethod
+    def key(llm: Llm, user_prompt: str, system_prompt: Optional[str], temperature: Optional[float]) -> str:
+        key_data = json.dumps(
+            [llm.get_model_identifier(), system_prompt, user_prompt, temperature])
+        return hashlib.sha256(key_data.encode()).hexdigest()
+
+    async def get_connection(self) -> aiosqlite.Connection:
+        assert self.path is not None
+        if self.connection is None:
+            connection = await aiosqlite.connect(self.path)
+            await connection.execute(
+                "CREATE TABLE IF NOT EXISTS llm_responses (key TEXT PRIMARY KEY, response TEXT NOT NULL)")
+            await connection.commit()
+            with self.lock:
+                if self.connection is None:
+                    self.connection = connection
+                    connection = None
+            if connection is not None:
+                # Another caller opened the database concurrently
+                await connection.close()
+        assert self.connection is not None
+        return self.connection
+
+    async def get(self, key: str) -> Optional[str]:
+        with self.lock:
+            response = self.entries.get(key)
+            if response is not None:
+                self.entries.move_to_end(key)
+        if response is None and self.path is not None:
+            connection = await self.get_connection()
+            async with connection.execute(
+                    "SELECT response FROM llm_responses WHERE key = ?", (key,)) as cursor:
+                row = await cursor.fetchone()
+            if row is not None:
+                response = row[0]
+                with self.lock:
+                    self.remember(key, response)
+        with self.lock:
+            if response is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return response
+
+    async def put(self, key: str, response: str):
+        with self.lock:
+            self.remember(key, response)
+        if self.path is not None:
+            connection = await self.get_connection()
+            await connection.execute(
+                "INSERT OR REPLACE INTO llm_responses (key, response) VALUES (?, ?)", (key, response))
+            await connection.commit()
+
+    def remember(self, key: str, response: str):
+        self.entries[key] = response
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    async def clear(self):
+        with self.lock:
+            self.entries.clear()
+        if self.path is not None:
+            connection = await self.get_connection()
+            await connection.execute("DELETE FROM llm_responses")
+            await connection.commit()
+
+    async def close(self):
+        with self.lock:
+            connection, self.connection = self.connection, None
+        if connection is not None:
+            await connection.close()
+
+    def get_stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries)}
@@ -55,6 +55,9 @@ class Anthropic(Llm):
     def __init__(self, *args, **kwargs):
         self.client = anthropic.AsyncAnthropic(*args, **kwargs)
 
+    def get_model_identifier(self) -> str:
+        return f"{type(self).__qualname__}:{MODEL}"
+
     async def get_assistant_turn(self, chat: Chat, tools: list[Tool] = [], temperature: Optional[float] = None) -> AssistantTurn:
         messages = [to_message(turn) for turn in chat.turns]
         system_prompt = chat.get_system_prompt()
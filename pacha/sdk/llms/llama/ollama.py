@@ -1,3 +1,4 @@
+import asyncio
 import ollama
 
 from pacha.utils.logging import get_logger
@@ -22,6 +23,9 @@ class LlamaOnOLlama(Llm):
     def __init__(self, *args, **kwargs):
         self.client = ollama.Client(*args, **kwargs)
 
+    def get_model_identifier(self) -> str:
+        return f"{type(self).__qualname__}:{LLAMA_MODEL_OLLAMA}"
+
     async def get_assistant_turn(self, chat: Chat, tools = [], temperature=None) -> AssistantTurn:
         assert(len(tools) == 0)
         messages = []
@@ -38,7 +42,8 @@ class LlamaOnOLlama(Llm):
         if temperature is not None:
             options["temperature"] = temperature
 
-        response = self.client.chat(
+        response = await asyncio.to_thread(
+            self.client.chat,
             model=LLAMA_MODEL_OLLAMA,
             messages=messages,
             options=options
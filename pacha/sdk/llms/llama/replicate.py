@@ -1,3 +1,5 @@
+import asyncio
+
 import replicate
 
 from pacha.utils.logging import get_logger
@@ -51,6 +53,9 @@ class LlamaOnReplicate(Llm):
     def __init__(self, *args, **kwargs):
         self.client = replicate.Client(*args, **kwargs)
 
+    def get_model_identifier(self) -> str:
+        return f"{type(self).__qualname__}:{LLAMA_MODEL_REPLICATE}"
+
     async def get_assistant_turn(self, chat: Chat, tools = [], temperature=None) -> AssistantTurn:
         assert(len(tools) == 0)
         prompt = render_prompt_for_chat(chat)
@@ -62,4 +67,6 @@ class LlamaOnReplicate(Llm):
 
         if temperature is not None:
             input["temperature"] = str(temperature)
-        return AssistantTurn(text=''.join(self.client.run(LLAMA_MODEL_REPLICATE, input=input)))
+        output = await asyncio.to_thread(
+            lambda: ''.join(self.client.run(LLAMA_MODEL_REPLICATE, input=input)))
+        return AssistantTurn(text=output)
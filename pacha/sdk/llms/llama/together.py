@@ -1,3 +1,5 @@
+import asyncio
+
 from together import Together
 from together.types.chat_completions import ChatCompletionMessage, MessageRole, ChatCompletionResponse
 
@@ -22,6 +24,9 @@ class LlamaOnTogether(Llm):
     def __init__(self, *args, **kwargs):
         self.client = Together(*args, **kwargs)
 
+    def get_model_identifier(self) -> str:
+        return f"{type(self).__qualname__}:{LLAMA_MODEL_TOGETHER}"
+
     async def get_assistant_turn(self, chat: Chat, tools = [], temperature=None) -> AssistantTurn:
         assert(len(tools) == 0)
         messages = []
@@ -31,7 +36,8 @@ class LlamaOnTogether(Llm):
                 role=MessageRole.SYSTEM, content=system_prompt))
         messages.extend([to_message(turn).model_dump() for turn in chat.turns])
         get_logger().debug(f"Llama Messages: {messages}")
-        response = self.client.chat.completions.create(
+        response = await asyncio.to_thread(
+            self.client.chat.completions.create,
             model=LLAMA_MODEL_TOGETHER,
             messages=messages,
             temperature=temperature
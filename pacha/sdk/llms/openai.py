@@ -59,6 +59,9 @@ class OpenAI(Llm):
     def __init__(self, *args, **kwargs):
         self.client = openai.AsyncOpenAI(*args, **kwargs)
 
+    def get_model_identifier(self) -> str:
+        return f"{type(self).__qualname__}:{MODEL}"
+
     async def get_assistant_turn(self, chat: Chat, tools: list[Tool] = [], temperature: Optional[float] = None) -> AssistantTurn:
         messages = []
         system_prompt = chat.get_system_prompt()
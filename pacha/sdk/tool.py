@@ -44,7 +44,11 @@ class Tool(ABC):
         ...
 
     @abstractmethod
-    def system_prompt_fragment(self, artifacts: Artifacts) -> str:
+    def system_prompt_fragment(self, artifacts: Artifacts, query: Optional[str] = None) -> str:
+        """
+        `query` is the recent user input, which tools may use to include only the
+        relevant parts of the schema.
+        """
         ...
 
     @abstractmethod
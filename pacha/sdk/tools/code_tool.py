@@ -1,21 +1,29 @@
-from dataclasses import dataclass, field, asdict
+from dataclasses import dataclass, field, asdict, replace
 from typing import Optional, TypedDict, NotRequired, cast
 from pacha.data_engine.artifacts import Artifacts
 from pacha.data_engine.catalog import Catalog
+from pacha.data_engine.catalog_index import CatalogIndex
 from pacha.data_engine.context import ExecutionContext
 from pacha.data_engine.data_engine import DataEngine, SqlStatement
-from pacha.data_engine.python_executor import PythonExecutor, PythonExecutorHooks
+from pacha.data_engine.python_executor import PythonExecutor, PythonExecutorHooks, PythonExecutorOptions
 from pacha.sdk.llm import Llm
 from pacha.sdk.tools.sql_tool import SYSTEM_PROMPT_FRAGMENT_TEMPLATE
 from pacha.sdk.tool import Tool, ToolOutput
 
 CODE_ARGUMENT_NAME = "python_code"
 
+# Cap on the size of the description of the previously created artifacts in
+# the system prompt, which otherwise grows with every artifact in the thread
+ARTIFACTS_PROMPT_TOKENS = 4000
+
 
 @dataclass
 class PythonOptions:
     enable_artifacts: bool
     enable_ai_primitives: bool
+    # Requires a Python runtime that implements column_stats (eg: the local
+    # runtime, for which create_python_tool enables this)
+    enable_column_stats: bool = False
 
 
 def build_tool_description(options: PythonOptions) -> str:
@@ -57,6 +65,14 @@ def build_python_methods(options: PythonOptions) -> str:
   The returned artifact data can also be modified (eg: to append rows or columns to it) and stored back.
   For follow-up questions, avoid retrieving the data from the database again if you can look it up in a previously created artifact."""
 
+    if options.enable_artifacts and options.enable_column_stats:
+        methods += """
+- `def column_stats(self, identifier: str, columns: list[str], group_by: list[str] = [], aggregates: list[str] = ['count', 'mean', 'min', 'max'], percentiles: list[float] = [], histogram_bins: int = 0) -> list[dict[str, Any]]`:
+  This can be used to compute statistics over the `columns` of a previously created table artifact, without retrieving its data. Prefer this over computing metrics over artifact rows in Python.
+  The `aggregates` can be any of 'count', 'distinct', 'sum', 'mean', 'std', 'min' and 'max'. The `percentiles` are between 0 and 100 (eg: 50 for the median). If `histogram_bins` is more than 0, a histogram with these many equal width bins is computed too.
+  It returns one row per group of rows with the same values of the `group_by` columns (or a single row without `group_by`). Each row has the values of the `group_by` columns, the number of rows in the group as 'row_count', and for each column '<column>_<aggregate>' (eg: 'price_mean'), '<column>_p<percentile>' (eg: 'price_p50') and '<column>_histogram' (a list of bins like {'start': 0.0, 'end': 10.0, 'count': 3}).
+  Null values are ignored. For columns that are not numeric, only 'count', 'distinct', 'min' and 'max' are computed."""
+
     if options.enable_ai_primitives:
         methods += """
 - `def classify(self, instructions: str, inputs_to_classify: list[str], categories: list[str], allow_multiple: bool) -> list[str | list[str]]`:
@@ -201,7 +217,7 @@ executor.store_artifact('most_recent_controversial_articles_with_comments_summar
     return examples
 
 
-def build_system_prompt_fragment(tool_name: str, catalog: Catalog, artifacts: Artifacts, options: PythonOptions) -> str:
+def build_system_prompt_fragment(tool_name: str, rendered_catalog: str, artifacts: Artifacts, options: PythonOptions, artifacts_prompt_tokens: Optional[int] = ARTIFACTS_PROMPT_TOKENS) -> str:
     prompt = f"""
 When executing Python code using the "{tool_name}" tool, you have access to an `executor` variable, which has the following methods:
 {build_python_methods(options)}
@@ -233,13 +249,13 @@ Do not write very big python programs that do a lot of work. Instead, break them
             prompt += f"""
 The previously created artifacts by you are:
 
-{artifacts.render_for_prompt()}
+{artifacts.render_for_prompt(artifacts_prompt_tokens)}
 """
 
     prompt += f"""
 The schema of the database available using the "{tool_name}" tool is as follows.
 
-{catalog.render_for_prompt()}
+{rendered_catalog}
 """
     return prompt
 
@@ -269,7 +285,16 @@ class PachaPythonTool(Tool):
     options: PythonOptions = field(default_factory=lambda: PythonOptions(
         enable_artifacts=True, enable_ai_primitives=True))
     hooks: PythonExecutorHooks = field(default_factory=PythonExecutorHooks)
+    executor_options: PythonExecutorOptions = field(
+        default_factory=PythonExecutorOptions)
+    # If set, only these many tables relevant to the conversation (and the
+    # tables they are directly related to) are described in the prompt.
+    schema_top_k: Optional[int] = None
+    # Approximate number of tokens to describe previously created artifacts in,
+    # or None to describe all of them in full
+    artifacts_prompt_tokens: Optional[int] = ARTIFACTS_PROMPT_TOKENS
     catalog: Catalog = field(init=False)
+    catalog_index: CatalogIndex = field(init=False)
 
     def name(self) -> str:
         return 'execute_python'
@@ -279,7 +304,7 @@ class PachaPythonTool(Tool):
         if input_code is None:
             return PythonToolOutput(output="", error=f"Missing parameter {CODE_ARGUMENT_NAME}", sql_statements=[], modified_artifact_identifiers=[])
         executor = PythonExecutor(
-            data_engine=self.data_engine, context=context, hooks=self.hooks, llm=self.llm)
+            data_engine=self.data_engine, context=context, hooks=self.hooks, llm=self.llm, options=self.executor_options)
         await executor.exec_code(input_code)
         return PythonToolOutput(output=executor.output_text, error=executor.error, sql_statements=executor.sql_statements, modified_artifact_identifiers=executor.modified_artifact_identifiers)
 
@@ -298,8 +323,8 @@ class PachaPythonTool(Tool):
     def description(self) -> str:
         return build_tool_description(self.options)
 
-    def system_prompt_fragment(self, artifacts: Artifacts) -> str:
-        return build_system_prompt_fragment(self.name(), self.catalog, artifacts, self.options)
+    def system_prompt_fragment(self, artifacts: Artifacts, query: Optional[str] = None) -> str:
+        return build_system_prompt_fragment(self.name(), self.catalog_index.render_for_prompt(query, self.schema_top_k), artifacts, self.options, self.artifacts_prompt_tokens)
 
     def input_as_text(self, input) -> str:
         return input.get(CODE_ARGUMENT_NAME, "")
@@ -307,5 +332,8 @@ class PachaPythonTool(Tool):
 
 async def create_python_tool(*args, **kwargs) -> PachaPythonTool:
     tool = PachaPythonTool(*args, **kwargs)
+    if tool.executor_options.local_runtime is not None:
+        tool.options = replace(tool.options, enable_column_stats=True)
     tool.catalog = await tool.data_engine.get_catalog()
+    tool.catalog_index = CatalogIndex(tool.catalog)
     return tool
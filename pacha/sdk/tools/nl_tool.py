@@ -1,4 +1,5 @@
 from dataclasses import dataclass
+from typing import Optional
 from pacha.query_planner.query_planner import QueryPlanner, QueryPlanningInput
 from pacha.query_planner.input import UserTurn
 from pacha.sdk.tool import StringToolOutput, Tool
@@ -34,7 +35,7 @@ class PachaNlTool(Tool):
     def description(self) -> str:
         return "Use this tool to retrieve any contextual data relevant to the conversation."
 
-    def system_prompt_fragment(self, artifacts) -> str:
+    def system_prompt_fragment(self, artifacts, query: Optional[str] = None) -> str:
         return ""
     
     def input_as_text(self, input) -> str:
@@ -1,7 +1,9 @@
+from contextlib import aclosing
 from dataclasses import dataclass, field, asdict
 from typing import Optional, TypedDict, NotRequired, cast
 from pacha.data_engine.catalog import Catalog
-from pacha.data_engine.data_engine import DataEngine, SqlOutput
+from pacha.data_engine.catalog_index import CatalogIndex
+from pacha.data_engine.data_engine import ColumnarSqlOutput, DataEngine, SqlOutput
 from pacha.sdk.tool import Tool, ToolOutput
 
 SQL_ARGUMENT_NAME = "sql"
@@ -30,11 +32,19 @@ def get_system_prompt_fragment(tool_name: str, catalog: Catalog) -> str:
 class SqlToolOutput(ToolOutput):
     output: Optional[SqlOutput] = None
     error: Optional[str] = None
+    truncated: bool = False
+    # Render the output with each column name once rather than once per row
+    columnar: bool = False
 
     def get_response(self) -> str:
         response = ""
         if self.output is not None:
-            response += str(self.output)
+            if self.columnar:
+                response += str(ColumnarSqlOutput.from_rows(self.output).to_json())
+            else:
+                response += str(self.output)
+            if self.truncated:
+                response += f"\n(output truncated to the first {len(self.output)} rows)"
         if self.error is not None:
             response += str(self.error)
         return response
@@ -47,7 +57,16 @@ class SqlToolOutput(ToolOutput):
 # Do not construct directly, use create_sql_tool instead.
 class PachaSqlTool(Tool):
     data_engine: DataEngine
+    # If set, stop reading the result after these many rows.
+    max_rows: Optional[int] = None
+    # If set, only these many tables relevant to the conversation (and the
+    # tables they are directly related to) are described in the prompt.
+    schema_top_k: Optional[int] = None
+    # If set, results are shown to the LLM in columnar form, which is much
+    # shorter for wide results
+    columnar: bool = False
     catalog: Catalog = field(init=False)
+    catalog_index: CatalogIndex = field(init=False)
 
     def name(self) -> str:
         return 'execute_sql'
@@ -55,7 +74,17 @@ class PachaSqlTool(Tool):
     async def execute(self, input, context) -> SqlToolOutput:
         sql = input[SQL_ARGUMENT_NAME]
         try:
-            return SqlToolOutput(output=await self.data_engine.execute_sql(sql))
+            output: SqlOutput = []
+            truncated = False
+            # Closing the stream early stops the transfer of any remaining rows.
+            async with aclosing(self.data_engine.execute_sql_stream(sql)) as batches:
+                async for batch in batches:
+                    if self.max_rows is not None and len(output) + len(batch) > self.max_rows:
+                        output.extend(batch[:self.max_rows - len(output)])
+                        truncated = True
+                        break
+                    output.extend(batch)
+            return SqlToolOutput(output=output, truncated=truncated, columnar=self.columnar)
         except Exception as e:
             return SqlToolOutput(error=str(e))
 
@@ -74,8 +103,8 @@ class PachaSqlTool(Tool):
     def description(self) -> str:
         return TOOL_DESCRIPTION
 
-    def system_prompt_fragment(self, artifacts) -> str:
-        return SYSTEM_PROMPT_FRAGMENT_TEMPLATE.format(tool_name=self.name(), catalog=self.catalog.render_for_prompt())
+    def system_prompt_fragment(self, artifacts, query: Optional[str] = None) -> str:
+        return SYSTEM_PROMPT_FRAGMENT_TEMPLATE.format(tool_name=self.name(), catalog=self.catalog_index.render_for_prompt(query, self.schema_top_k))
 
     def input_as_text(self, input) -> str:
         return input.get(SQL_ARGUMENT_NAME, "")
@@ -83,4 +112,5 @@ class PachaSqlTool(Tool):
 async def create_sql_tool(*args, **kwargs) -> PachaSqlTool:
     tool = PachaSqlTool(*args, **kwargs)
     tool.catalog = await tool.data_engine.get_catalog()
-    return tool
\ No newline at end of file
+    tool.catalog_index = CatalogIndex(tool.catalog)
+    return tool
@@ -0,0 +1,74 @@
+import argparse
+import time
+
+from pacha.data_engine.catalog_index import CatalogIndex
+from pacha.data_engine.ddn import create_schema_from_introspection
+
+DATA_TYPES = ['Int32', 'Int64', 'Float64', 'Utf8', 'Boolean', 'Date32', 'Timestamp(Microsecond, None)']
+
+
+def generate_introspection(num_tables: int, columns_per_table: int, foreign_keys_per_table: int, schemas: int):
+    tables_data = []
+    columns_data = []
+    foreign_keys_data = []
+    for table_index in range(num_tables):
+        schema_name = f"schema_{table_index % schemas}"
+        table_name = f"table_{table_index}"
+        tables_data.append({"schema_name": schema_name, "table_name": table_name,
+                           "description": f"Synthetic table number {table_index}", "type_description": None})
+        for column_index in range(columns_per_table):
+            columns_data.append({
+                "schema_name": schema_name,
+                "table_name": table_name,
+                "column_name": f"column_{column_index}",
+                "description": None,
+                "data_type": DATA_TYPES[column_index % len(DATA_TYPES)],
+                "data_type_normalized": None,
+                "is_nullable": "YES"
+            })
+        for foreign_key_index in range(foreign_keys_per_table):
+            target_index = (table_index + foreign_key_index + 1) % num_tables
+            # Two column foreign keys, to exercise the grouping of mappings
+            for column_index in range(2):
+                foreign_keys_data.append({
+                    "from_schema_name": schema_name,
+                    "from_table_name": table_name,
+                    "from_column_name": f"column_{column_index}",
+                    "to_schema_name": f"schema_{target_index % schemas}",
+                    "to_table_name": f"table_{target_index}",
+                    "to_column_name": f"column_{column_index}"
+                })
+    return tables_data, columns_data, foreign_keys_data
+
+
+def time_it(label: str, function):
+    start = time.perf_counter()
+    result = function()
+    print(f"{label}: {(time.perf_counter() - start) * 1000:.1f} ms")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark building, indexing and rendering a synthetic catalog')
+    parser.add_argument('--tables', type=int, default=10000)
+    parser.add_argument('--columns-per-table', type=int, default=10)
+    parser.add_argument('--foreign-keys-per-table', type=int, default=5)
+    parser.add_argument('--schemas', type=int, default=10)
+    args = parser.parse_args()
+
+    tables_data, columns_data, foreign_keys_data = generate_introspection(
+        args.tables, args.columns_per_table, args.foreign_keys_per_table, args.schemas)
+    print(f"{len(tables_data)} tables, {len(columns_data)} columns, {len(foreign_keys_data)} foreign key columns")
+
+    catalog = time_it("Build catalog", lambda: create_schema_from_introspection(
+        tables_data, columns_data, foreign_keys_data, [], [], []))
+    time_it("Render catalog", catalog.render_for_prompt)
+    time_it("Render catalog (memoized)", catalog.render_for_prompt)
+    index = time_it("Build catalog index", lambda: CatalogIndex(catalog))
+    time_it("Select relevant tables", lambda: index.select_tables(
+        "synthetic table number 42 column_3", 10))
+
+
+if __name__ == "__main__":
+    main()
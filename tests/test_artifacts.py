@@ -0,0 +1,78 @@
+from typing import Any
+from pacha.data_engine.artifacts import Artifact, apply_artifact_diff, diff_artifacts
+import json
+import unittest
+
+
+def table(rows: list[dict[str, Any]], version: int = 1) -> Artifact:
+    return Artifact(identifier="orders", title="Orders", artifact_type='table', data=rows, version=version)
+
+
+BASE_ROWS = [{"id": index, "status": "open", "total": index * 10} for index in range(10)]
+
+
+class ArtifactDiffTest(unittest.TestCase):
+    def assert_round_trips(self, base: Artifact, rows: list[dict[str, Any]]):
+        artifact = table(rows, version=base.version + 1)
+        result = diff_artifacts(base, artifact)
+        assert result is not None
+        diff, shared_rows = result
+        self.assertEqual(shared_rows, rows)
+        # Diffs are persisted as JSON, which turns tuples into lists
+        applied = apply_artifact_diff(base, json.loads(json.dumps(diff)))
+        self.assertEqual(applied.data, rows)
+        self.assertEqual([list(row) for row in applied.data], [list(row) for row in rows])
+        self.assertEqual(applied.version, base.version + 1)
+        self.assertEqual(applied.title, artifact.title)
+        # Unchanged rows are shared with the previous version
+        for old_row, new_row in zip(base.data, applied.data):
+            if old_row == new_row:
+                self.assertIs(old_row, new_row)
+
+    def test_appended_rows(self):
+        self.assert_round_trips(table(BASE_ROWS), BASE_ROWS + [{"id": 10, "status": "open", "total": 100}])
+
+    def test_changed_cells(self):
+        rows = [dict(row) for row in BASE_ROWS]
+        rows[3]["status"] = "shipped"
+        rows[7]["total"] = None
+        self.assert_round_trips(table(BASE_ROWS), rows)
+
+    def test_added_column_keeps_column_order(self):
+        rows = [{"id": row["id"], "customer": f"c{row['id']}", "status": row["status"], "total": row["total"]}
+                for row in BASE_ROWS]
+        self.assert_round_trips(table(BASE_ROWS), rows)
+
+    def test_column_added_to_some_rows(self):
+        rows = [dict(row) for row in BASE_ROWS]
+        rows[2] = {"id": 2, "note": "late", "status": "open", "total": 20}
+        self.assert_round_trips(table(BASE_ROWS), rows)
+
+    def test_chain_of_diffs(self):
+        base = table(BASE_ROWS)
+        rows = BASE_ROWS + [{"id": 10, "status": "open", "total": 100}]
+        result = diff_artifacts(base, table(rows, version=2))
+        assert result is not None
+        second = apply_artifact_diff(base, result[0])
+        changed = [dict(row) for row in rows]
+        changed[10]["status"] = "shipped"
+        self.assert_round_trips(second, changed)
+
+    def test_unsupported_changes(self):
+        base = table(BASE_ROWS)
+        cases = {
+            "removed rows": BASE_ROWS[:-1],
+            "removed column": [{"id": row["id"], "total": row["total"]} for row in BASE_ROWS],
+            "mostly changed": [{**row, "status": "closed", "total": -1} for row in BASE_ROWS],
+            "inconsistent column order": [{"total": row["total"], "id": row["id"], "status": "x"} if row["id"] == 1
+                                          else {"status": "x", "id": row["id"], "total": row["total"]} if row["id"] == 2
+                                          else row for row in BASE_ROWS],
+        }
+        for name, rows in cases.items():
+            self.assertIsNone(diff_artifacts(base, table(rows, version=2)), name)
+        text = Artifact(identifier="orders", title="Orders", artifact_type='text', data="hello")
+        self.assertIsNone(diff_artifacts(text, table(BASE_ROWS, version=2)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+from typing import Optional
+from pacha.data_engine.catalog import Catalog, Column, ForeignKey, ScalarType, Schema, Table, TypeReference
+from pacha.data_engine.catalog_index import CatalogIndex, tokenize
+import unittest
+
+
+def text_column(name: str, description: Optional[str] = None) -> Column:
+    return Column(name=name, type=TypeReference(nullable=True, underlying_type=ScalarType.TEXT), description=description)
+
+
+def make_catalog() -> Catalog:
+    tables = [
+        Table(name="customers", description="People who have placed orders",
+              columns={"email": text_column("email")}),
+        Table(name="orders", columns={"status": text_column("status", "Whether the order shipped")},
+              foreign_keys=[ForeignKey(target_schema="public", target_table="customers"),
+                            ForeignKey(target_schema="public", target_table="products")]),
+        Table(name="products", columns={"sku": text_column("sku")}),
+        Table(name="invoiceLines", columns={"amount": text_column("amount")},
+              foreign_keys=[ForeignKey(target_schema="public", target_table="orders")]),
+        Table(name="audit_log", columns={"message": text_column("message")}),
+    ]
+    return Catalog(schemas={"public": Schema(name="public", tables={table.name: table for table in tables})})
+
+
+class TokenizeTest(unittest.TestCase):
+    def test_splits_camel_case_and_folds_plurals(self):
+        self.assertEqual(tokenize("invoiceLines"), ["invoice", "line"])
+        self.assertEqual(tokenize("Show me the categories"), ["category"])
+        self.assertEqual(tokenize(None), [])
+
+
+class CatalogIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.index = CatalogIndex(make_catalog())
+
+    def test_ranks_name_matches_first(self):
+        scores = self.index.scores("which products sold best")
+        self.assertEqual(max(scores, key=lambda key: scores[key]), ("public", "products"))
+        self.assertNotIn(("public", "audit_log"), scores)
+
+    def test_expands_with_foreign_key_neighbours(self):
+        self.assertEqual(self.index.select_tables("invoice lines", 1),
+                         [("public", "invoiceLines"), ("public", "orders")])
+
+    def test_falls_back_to_most_connected_tables_when_nothing_matches(self):
+        selected = self.index.select_tables("xyzzy", 1)
+        self.assertEqual(selected[0], ("public", "orders"))
+        self.assertEqual(len(selected), 2)
+        self.assertNotIn(("public", "audit_log"), selected)
+
+    def test_renders_full_catalog_when_small_enough(self):
+        catalog = self.index.catalog
+        self.assertEqual(self.index.render_for_prompt("orders", 10), catalog.render_for_prompt())
+        self.assertEqual(self.index.render_for_prompt(None, 1), catalog.render_for_prompt())
+        self.assertIn("The other available tables are", self.index.render_for_prompt("orders", 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
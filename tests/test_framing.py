@@ -0,0 +1,104 @@
+from typing import Any
+from unittest import mock
+from pacha.data_engine import SqlOutput
+from pacha.data_engine import framing
+from pacha.data_engine.framing import Framing, decode_frame, supported_encodings
+from pacha.data_engine.python_executor import Client, ClientHooks, RunSQLResponse
+from pacha.error import PachaException
+import asyncio
+import json
+import unittest
+
+
+def large_response() -> RunSQLResponse:
+    return RunSQLResponse(orig_msg_id=1, data=[{"n": n, "name": "row"} for n in range(2000)])
+
+
+class FramingTest(unittest.TestCase):
+    def test_plain_json_uses_text_frames(self):
+        message = RunSQLResponse(orig_msg_id=1, data=[{"n": 1}])
+        frame = Framing().encode(message)
+        self.assertIsInstance(frame, str)
+        self.assertEqual(decode_frame(frame, RunSQLResponse), message)
+
+    def test_round_trips_every_framing(self):
+        message = large_response()
+        for encoding in supported_encodings():
+            for compression in [None, framing.ZLIB]:
+                frame = Framing(encoding=encoding, compression=compression).encode(message)
+                self.assertEqual(decode_frame(frame, RunSQLResponse), message,
+                                 f"{encoding}, {compression}")
+
+    def test_only_compresses_large_payloads(self):
+        small = RunSQLResponse(orig_msg_id=1, data=[{"n": 1}])
+        frame = Framing(encoding=framing.JSON, compression=framing.ZLIB).encode(small)
+        self.assertEqual(frame[0], 0)
+        frame = Framing(encoding=framing.JSON, compression=framing.ZLIB).encode(large_response())
+        self.assertEqual(frame[0], framing.FLAG_ZLIB)
+        self.assertEqual(decode_frame(frame, RunSQLResponse), large_response())
+
+    def test_offers_only_json_without_msgpack(self):
+        with mock.patch.object(framing, 'msgpack', None):
+            self.assertEqual(supported_encodings(), [framing.JSON])
+            with self.assertRaises(ValueError):
+                decode_frame(bytes([framing.FLAG_MSGPACK]) + b'\x80', RunSQLResponse)
+
+
+class FakeConnection:
+    """Sends the given frames, then waits for as many responses before closing"""
+
+    def __init__(self, frames: list[str | bytes], responses: int):
+        self.frames = frames
+        self.responses = responses
+        self.sent: list[str | bytes] = []
+        self.done = asyncio.Event()
+
+    async def send(self, message: str | bytes):
+        self.sent.append(message)
+        if len(self.sent) >= self.responses:
+            self.done.set()
+
+    async def __aiter__(self):
+        for frame in self.frames:
+            yield frame
+        await self.done.wait()
+
+    async def close(self):
+        pass
+
+
+class NumbersHooks(ClientHooks):
+    async def run_sql(self, sql: str, allow_mutations: bool) -> SqlOutput:
+        return [{"n": n} for n in range(3)]
+
+
+def hello_ack(encoding: str, compression: Any = None) -> str:
+    return json.dumps({"type": "hello_ack", "encoding": encoding, "compression": compression})
+
+
+RUN_SQL = json.dumps({"type": "run_sql", "sql": "SELECT n", "msg_id": 7})
+
+
+class NegotiationTest(unittest.IsolatedAsyncioTestCase):
+    async def test_switches_to_acknowledged_framing(self):
+        connection = FakeConnection([hello_ack(supported_encodings()[0], framing.ZLIB), RUN_SQL], responses=1)
+        await Client(hooks=NumbersHooks()).handle_messages(connection)
+        expected = Framing(encoding=supported_encodings()[0], compression=framing.ZLIB).encode(
+            RunSQLResponse(orig_msg_id=7, data=[{"n": n} for n in range(3)]))
+        self.assertEqual(connection.sent, [expected])
+
+    async def test_keeps_json_text_frames_without_ack(self):
+        connection = FakeConnection([RUN_SQL], responses=1)
+        await Client(hooks=NumbersHooks()).handle_messages(connection)
+        self.assertEqual(decode_frame(connection.sent[0], RunSQLResponse).data, [{"n": n} for n in range(3)])
+        self.assertIsInstance(connection.sent[0], str)
+
+    async def test_rejects_unsupported_framing(self):
+        for ack in [hello_ack("cbor"), hello_ack(framing.JSON, "brotli")]:
+            connection = FakeConnection([ack], responses=0)
+            with self.assertRaises(PachaException):
+                await Client(hooks=NumbersHooks()).handle_messages(connection)
+
+
+if __name__ == '__main__':
+    unittest.main()
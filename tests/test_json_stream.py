@@ -0,0 +1,54 @@
+from pacha.data_engine.json_stream import JsonArrayStreamParser
+import json
+import unittest
+
+
+def parse_in_pieces(text: str, piece_length: int) -> tuple[list, JsonArrayStreamParser]:
+    parser = JsonArrayStreamParser()
+    elements = []
+    for start in range(0, len(text), piece_length):
+        elements.extend(parser.feed(text[start:start + piece_length]))
+    parser.finish()
+    return elements, parser
+
+
+class JsonArrayStreamParserTest(unittest.TestCase):
+    def test_matches_json_loads_for_any_split(self):
+        rows = [{"id": 1, "name": "a \"quoted\", [bracketed] name", "tags": ["x", "y"]},
+                {"id": 22, "score": -1.5e3, "ok": True, "missing": None},
+                123, "é\\", []]
+        text = ' \n' + json.dumps(rows, indent=1) + '\n'
+        for piece_length in range(1, len(text) + 1):
+            elements, parser = parse_in_pieces(text, piece_length)
+            self.assertEqual(elements, rows, f"piece length {piece_length}")
+            self.assertIsNone(parser.document)
+
+    def test_yields_elements_as_they_complete(self):
+        parser = JsonArrayStreamParser()
+        self.assertEqual(parser.feed('[{"a": 1}, {"a"'), [{"a": 1}])
+        self.assertEqual(parser.feed(': 2}, 1'), [{"a": 2}])
+        # The number may continue in the next piece
+        self.assertEqual(parser.feed('2]'), [12])
+        parser.finish()
+
+    def test_empty_array(self):
+        elements, parser = parse_in_pieces('[ ]', 1)
+        self.assertEqual(elements, [])
+        self.assertIsNone(parser.document)
+
+    def test_buffers_other_documents(self):
+        error = {"error": "relation does not exist", "path": "$"}
+        elements, parser = parse_in_pieces(json.dumps(error), 3)
+        self.assertEqual(elements, [])
+        self.assertEqual(parser.document, error)
+
+    def test_unterminated_array_fails_on_finish(self):
+        for text in ['[1, 2', '[{"a": 1}', '[1, 2,']:
+            parser = JsonArrayStreamParser()
+            parser.feed(text)
+            with self.assertRaises(json.JSONDecodeError):
+                parser.finish()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+from typing import Optional
+from pacha.data_engine import DataEngine, SqlOutput
+from pacha.data_engine.artifacts import Artifacts
+from pacha.data_engine.catalog import Catalog
+from pacha.data_engine.context import ExecutionContext
+from pacha.data_engine.local_runtime import LocalRuntime
+from pacha.data_engine.python_executor import PythonExecutor, PythonExecutorHooks, PythonExecutorOptions
+from pacha.error import PachaException
+import os
+import unittest
+
+
+class NumbersDataEngine(DataEngine):
+    """Answers any SQL with the rows 0 to 9, so that executions run offline"""
+
+    async def get_catalog(self) -> Catalog:
+        return Catalog(schemas={}, functions={})
+
+    async def execute_sql(self, sql: str, allow_mutations: bool = False) -> SqlOutput:
+        return [{"n": n} for n in range(10)]
+
+
+class LocalRuntimeTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.runtime = LocalRuntime(size=1, max_cpu_secs=5)
+        self.artifacts = Artifacts()
+
+    async def asyncTearDown(self):
+        await self.runtime.close()
+
+    async def execute(self, code: str) -> PythonExecutor:
+        executor = PythonExecutor(data_engine=NumbersDataEngine(), hooks=PythonExecutorHooks(), llm=None,  # type: ignore
+                                  context=ExecutionContext(artifacts=self.artifacts),
+                                  options=PythonExecutorOptions(local_runtime=self.runtime))
+        await executor.exec_code(code)
+        return executor
+
+    async def test_runs_sql_and_stores_artifacts(self):
+        executor = await self.execute(
+            "rows = executor.run_sql('SELECT n FROM numbers')\n"
+            "executor.store_artifact('numbers', 'Numbers', 'table', rows)\n"
+            "executor.print(sum(row['n'] for row in rows))")
+        self.assertIsNone(executor.error)
+        self.assertTrue(executor.output_text.endswith("45\n"))
+        self.assertEqual(executor.sql_statements[0].row_count, 10)
+        self.assertEqual(len(self.artifacts.get_artifact('numbers')), 10)
+
+    async def test_reports_errors_and_reuses_workers(self):
+        executor = await self.execute("raise ValueError('boom')")
+        self.assertIn("ValueError: boom", executor.error or "")
+        executor = await self.execute("executor.print('after error')")
+        self.assertIsNone(executor.error)
+        self.assertEqual(executor.output_text, "after error\n")
+
+    async def test_isolates_environment(self):
+        os.environ["PROMPTQL_SECRET_KEY"] = "secret"
+        try:
+            executor = await self.execute(
+                "import os\n"
+                "executor.print(os.environ.get('PROMPTQL_SECRET_KEY'))\n"
+                "executor.print(os.getcwd())")
+        finally:
+            del os.environ["PROMPTQL_SECRET_KEY"]
+        self.assertIsNone(executor.error)
+        secret, cwd = executor.output_text.splitlines()
+        self.assertEqual(secret, "None")
+        directory: Optional[str] = self.runtime.directory and self.runtime.directory.name
+        self.assertEqual(os.path.realpath(cwd), os.path.realpath(directory or ""))
+
+    async def test_close_kills_all_workers(self):
+        connection = await self.runtime.acquire()
+        processes = list(self.runtime.processes)
+        await self.runtime.close()
+        self.assertTrue(all(process.returncode is not None for process in processes))
+        self.assertEqual(len(self.runtime.processes), 0)
+        await connection.close()
+        with self.assertRaises(PachaException):
+            await self.runtime.acquire()
+
+
+if __name__ == '__main__':
+    unittest.main()
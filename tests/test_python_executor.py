@@ -0,0 +1,34 @@
+from pacha.data_engine.python_executor import InFlightSlot, Session
+import asyncio
+import unittest
+
+
+class WaitForWindowTest(unittest.IsolatedAsyncioTestCase):
+    async def test_cancelled_reacquire_does_not_over_release(self):
+        in_flight = asyncio.Semaphore(1)
+        session = Session(connection=None, in_flight=in_flight)  # type: ignore
+        window = asyncio.Semaphore(0)
+        await in_flight.acquire()
+        slot = InFlightSlot(in_flight)
+
+        async def respond():
+            try:
+                await session.wait_for_window(window, slot)
+            finally:
+                slot.release()
+
+        request = asyncio.create_task(respond())
+        await asyncio.sleep(0)
+        # Another request takes the given up slot, so the reacquire waits
+        await in_flight.acquire()
+        window.release()
+        await asyncio.sleep(0)
+        request.cancel()
+        await asyncio.gather(request, return_exceptions=True)
+        self.assertFalse(slot.held)
+        in_flight.release()
+        self.assertEqual(in_flight._value, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()